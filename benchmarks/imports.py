@@ -0,0 +1,85 @@
+"""
+Measures how long importing blacksmith takes in a fresh interpreter, and checks it stays within budget.
+
+Usage:
+```
+    python -m benchmarks.imports --budget 250
+    python -m benchmarks.imports --module blacksmith.llm --module blacksmith.context --runs 20
+```
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Dependencies that should only be imported once they are used
+LAZY_MODULES = ("openai", "tiktoken", "aiohttp", "tenacity", "numpy", "redis")
+
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, runs: int) -> dict:
+    """
+    Imports `module` in `runs` fresh interpreters, returning the import times and eagerly loaded dependencies.
+    """
+    code = _PROBE.format(module=module, lazy=LAZY_MODULES)
+    # The first run compiles bytecode, so it is not counted
+    samples = []
+    for _ in range(runs + 1):
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        ).stdout
+        samples.append(json.loads(output))
+    seconds = [s["seconds"] for s in samples[1:]]
+    return {
+        "module": module,
+        "runs": runs,
+        "min": min(seconds),
+        "median": statistics.median(seconds),
+        "loaded": samples[-1]["loaded"],
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--module", action="append", default=None, help="Modules to import")
+    parser.add_argument("--runs", type=int, default=10, help="Fresh interpreters per module")
+    parser.add_argument("--budget", type=float, default=300, help="Allowed median, milliseconds")
+    parser.add_argument("--output", type=str, default=None, help="Path of the JSON results")
+    args = parser.parse_args(argv)
+
+    failures, results = [], []
+    for module in args.module or ["blacksmith.llm"]:
+        result = measure(module, args.runs)
+        results.append(result)
+        print(
+            f"{module:<24} median {result['median'] * 1000:>8.2f}ms  "
+            f"min {result['min'] * 1000:>8.2f}ms  "
+            f"eager {', '.join(result['loaded']) or '-'}",
+            flush=True,
+        )
+        if result["median"] * 1000 > args.budget:
+            failures.append(
+                f"{module} took {result['median'] * 1000:.2f}ms (budget {args.budget}ms)"
+            )
+        if result["loaded"]:
+            failures.append(f"{module} imported {', '.join(result['loaded'])} eagerly")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"budget": args.budget, "results": results}, f, indent=2)
+
+    for failure in failures:
+        print(f"Failed: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""
+Measures blacksmith's own overhead against a local mock of the chat-completions API.
+
+Usage:
+```
+    python -m benchmarks.run --latency 0.05 --concurrency 1,8,64 --output bench.json
+    python -m benchmarks.run --baseline bench.json
+```
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+from concurrent.futures import ThreadPoolExecutor
+from importlib.metadata import PackageNotFoundError, version
+from typing import Awaitable, Callable
+import openai
+from blacksmith.config.constants import ChatRoles
+from blacksmith.context import Config
+from blacksmith.llm import (
+    AsyncConversation,
+    ChatMessage,
+    Choice,
+    Conversation,
+    FunctionCall,
+    agenerate_from,
+    generate_from,
+)
+from blacksmith.tools import tool
+from blacksmith.utils.session import close_aiosession
+from benchmarks.server import MockServer
+
+CITIES = Choice(options=["San Francisco", "Los Angeles", "New York City"])
+
+
+@tool(name="bench_echo", description="Returns its input.", params={"text": "The text to return."})
+def bench_echo(text: str):
+    return text
+
+
+@tool(name="bench_aecho", description="Returns its input.", params={"text": "The text to return."})
+async def bench_aecho(text: str):
+    return text
+
+
+def _history(length: int) -> list[ChatMessage]:
+    roles = [ChatRoles.USER, ChatRoles.ASSISTANT]
+    return [
+        ChatMessage(role=roles[i % 2], content=f"Message {i}: " + "lorem ipsum " * 20)
+        for i in range(length)
+    ]
+
+
+def _percentile(latencies: list[float], q: float) -> float:
+    ordered = sorted(latencies)
+    return ordered[round(q * (len(ordered) - 1))]
+
+
+def _summarize(
+    name: str, mode: str, concurrency: int, latencies: list[float], errors: int, seconds: float
+) -> dict:
+    return {
+        "benchmark": name,
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "seconds": seconds,
+        "throughput": len(latencies) / seconds if seconds else 0.0,
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "p50": _percentile(latencies, 0.5) if latencies else None,
+        "p99": _percentile(latencies, 0.99) if latencies else None,
+    }
+
+
+def _timed(fn: Callable[[int], object], i: int) -> float | None:
+    start = time.perf_counter()
+    try:
+        fn(i)
+    except Exception:
+        return None
+    return time.perf_counter() - start
+
+
+def run_sync(fn: Callable[[int], object], requests: int, concurrency: int):
+    """
+    Calls `fn` `requests` times from `concurrency` threads, returning latencies, errors and wall-clock time.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = list(pool.map(lambda i: _timed(fn, i), range(requests)))
+    seconds = time.perf_counter() - start
+    latencies = [t for t in timings if t is not None]
+    return latencies, len(timings) - len(latencies), seconds
+
+
+def run_async(fn: Callable[[int], Awaitable[object]], requests: int, concurrency: int):
+    """
+    Async version of `run_sync`, with at most `concurrency` calls in flight on one event loop.
+    """
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(i: int) -> float | None:
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await fn(i)
+                except Exception:
+                    return None
+                return time.perf_counter() - start
+
+        try:
+            start = time.perf_counter()
+            timings = await asyncio.gather(*(timed(i) for i in range(requests)))
+            return timings, time.perf_counter() - start
+        finally:
+            await close_aiosession()
+
+    timings, seconds = asyncio.run(main())
+    latencies = [t for t in timings if t is not None]
+    return latencies, len(timings) - len(latencies), seconds
+
+
+def _consume(stream) -> None:
+    for _ in stream:
+        pass
+
+
+async def _aconsume(stream) -> None:
+    async for _ in stream:
+        pass
+
+
+def benchmarks(config: Config, history: list[int]) -> dict[str, tuple[Callable, Callable]]:
+    """
+    Returns the sync and async version of each benchmark, keyed on name.
+    """
+
+    # Only the tool suite uses the benchmark tools, so the other suites send plain requests
+    async def ask_stream(i: int):
+        stream = await AsyncConversation(config=config).ask(
+            f"Question {i}", use_functions=False, stream=True
+        )
+        await _aconsume(stream)
+
+    suites = {
+        "ask": (
+            lambda i: Conversation(config=config).ask(f"Question {i}", use_functions=False),
+            lambda i: AsyncConversation(config=config).ask(f"Question {i}", use_functions=False),
+        ),
+        "ask_stream": (
+            lambda i: _consume(
+                Conversation(config=config).ask(f"Question {i}", use_functions=False, stream=True)
+            ),
+            ask_stream,
+        ),
+        "generate_from": (
+            lambda i: generate_from(CITIES, f"Question {i}", config=config),
+            lambda i: agenerate_from(CITIES, f"Question {i}", config=config),
+        ),
+        "tool": (
+            lambda i: FunctionCall(tool="bench_echo", args={"text": str(i)}).execute(),
+            lambda i: FunctionCall(tool="bench_aecho", args={"text": str(i)}).aexecute(),
+        ),
+    }
+    for length in history:
+        messages = _history(length)
+        suites[f"long_history_{length}"] = (
+            lambda i, m=messages: Conversation(config=config, messages=list(m)).ask(
+                f"Q {i}", use_functions=False
+            ),
+            lambda i, m=messages: AsyncConversation(config=config, messages=list(m)).ask(
+                f"Q {i}", use_functions=False
+            ),
+        )
+    return suites
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Returns a description of every benchmark whose p50 latency regressed by more than `threshold`.
+    """
+    previous = {
+        (r["benchmark"], r["mode"], r["concurrency"]): r
+        for r in baseline["results"]
+        if r["p50"] is not None
+    }
+    regressions = []
+    for r in results["results"]:
+        before = previous.get((r["benchmark"], r["mode"], r["concurrency"]))
+        if before is None or r["p50"] is None:
+            continue
+        change = r["p50"] / before["p50"] - 1
+        if change > threshold:
+            regressions.append(
+                f"{r['benchmark']} ({r['mode']}, concurrency {r['concurrency']}): "
+                f"p50 {before['p50'] * 1000:.2f}ms -> {r['p50'] * 1000:.2f}ms (+{change:.0%})"
+            )
+    return regressions
+
+
+def _csv(value: str, cast=str) -> list:
+    return [cast(v) for v in value.split(",") if v]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--latency", type=float, default=0.0, help="Mock server latency, seconds")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Delay between chunks")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per run")
+    parser.add_argument("--concurrency", type=str, default="1,8,32", help="Concurrency levels")
+    parser.add_argument("--history", type=str, default="100,1000", help="History lengths")
+    parser.add_argument("--only", type=str, default="", help="Benchmarks to run")
+    parser.add_argument("--modes", type=str, default="sync,async", help="sync and/or async")
+    parser.add_argument("--output", type=str, default=None, help="Path of the JSON results")
+    parser.add_argument("--baseline", type=str, default=None, help="JSON results to compare to")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Allowed p50 regression")
+    args = parser.parse_args(argv)
+
+    try:
+        package_version = version("blacksmith")
+    except PackageNotFoundError:
+        package_version = None
+
+    results = {
+        "version": package_version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "server": {"latency": args.latency, "chunk_delay": args.chunk_delay},
+        "results": [],
+    }
+
+    with MockServer(latency=args.latency, chunk_delay=args.chunk_delay) as server:
+        openai.api_base = server.api_base
+        config = Config(model="gpt-3.5-turbo", temperature=0, api_key="sk-benchmark")
+        suites = benchmarks(config, _csv(args.history, int))
+        names = _csv(args.only) or list(suites)
+
+        for name in names:
+            sync_fn, async_fn = suites[name]
+            for mode in _csv(args.modes):
+                for concurrency in _csv(args.concurrency, int):
+                    run = run_sync if mode == "sync" else run_async
+                    fn = sync_fn if mode == "sync" else async_fn
+                    summary = _summarize(
+                        name, mode, concurrency, *run(fn, args.requests, concurrency)
+                    )
+                    results["results"].append(summary)
+                    print(
+                        f"{name:<24} {mode:<5} c={concurrency:<4} "
+                        f"{summary['throughput']:>9.1f} req/s  "
+                        f"p50 {(summary['p50'] or 0) * 1000:>8.2f}ms  "
+                        f"p99 {(summary['p99'] or 0) * 1000:>8.2f}ms  "
+                        f"errors {summary['errors']}",
+                        flush=True,
+                    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import json
+import time
+import socket
+import asyncio
+import threading
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def _arguments(function: dict) -> dict:
+    # Fill every parameter with a value of the right type, picking the first option of an enum
+    args = {}
+    for name, prop in function.get("parameters", {}).get("properties", {}).items():
+        if "enum" in prop:
+            args[name] = prop["enum"][0]
+        elif prop.get("type") == "integer":
+            args[name] = 1
+        elif prop.get("type") == "number":
+            args[name] = 1.0
+        elif prop.get("type") == "boolean":
+            args[name] = True
+        elif prop.get("type") == "array":
+            args[name] = []
+        elif prop.get("type") == "object":
+            args[name] = {}
+        else:
+            args[name] = "x"
+    return args
+
+
+def _message(body: dict, words: int) -> dict:
+    functions = body.get("functions") or []
+    function_call = body.get("function_call", "auto")
+    last = body["messages"][-1]
+
+    function = None
+    if isinstance(function_call, dict):
+        function = next((f for f in functions if f["name"] == function_call["name"]), None)
+    elif functions and function_call != "none":
+        # Call a tool once per question, then answer from the observation
+        if last["role"] == "user" and not (last.get("content") or "").startswith("Observation"):
+            function = functions[0]
+
+    if function is not None:
+        return {
+            "role": "assistant",
+            "content": None,
+            "function_call": {
+                "name": function["name"],
+                "arguments": json.dumps(_arguments(function)),
+            },
+        }
+    return {"role": "assistant", "content": " ".join(["lorem"] * words)}
+
+
+def _usage(body: dict, message: dict) -> dict:
+    # Rough token counts: one token per word
+    prompt = sum(len((m.get("content") or "").split()) + 3 for m in body["messages"])
+    completion = len((message.get("content") or "").split()) or 8
+    return {
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "total_tokens": prompt + completion,
+    }
+
+
+def create_app(latency: float = 0.0, words: int = 16, chunk_delay: float = 0.0) -> FastAPI:
+    """
+    Creates an app serving an OpenAI-compatible `/v1/chat/completions` endpoint.
+
+    Args:
+        latency (float): Seconds to wait before responding, or before the first chunk when streaming.
+        words (int): The number of words in text responses.
+        chunk_delay (float): Seconds between streamed chunks.
+    """
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if latency:
+            await asyncio.sleep(latency)
+        message = _message(body, words)
+        base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": body.get("model")}
+
+        if not body.get("stream"):
+            return JSONResponse(
+                {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                    "usage": _usage(body, message),
+                }
+            )
+
+        def chunk(delta: dict, finish_reason: str | None = None) -> str:
+            choice = {"index": 0, "delta": delta, "finish_reason": finish_reason}
+            payload = {**base, "object": "chat.completion.chunk", "choices": [choice]}
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def stream():
+            yield chunk({"role": "assistant"})
+            if message.get("function_call"):
+                function_call = message["function_call"]
+                yield chunk({"function_call": {"name": function_call["name"], "arguments": ""}})
+                yield chunk({"function_call": {"arguments": function_call["arguments"]}})
+            else:
+                for word in message["content"].split(" "):
+                    if chunk_delay:
+                        await asyncio.sleep(chunk_delay)
+                    yield chunk({"content": word + " "})
+            yield chunk({}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class MockServer:
+    """
+    Runs the mock chat-completions server on a background thread.
+
+    Usage:
+    ```
+        with MockServer(latency=0.05) as server:
+            openai.api_base = server.api_base
+            Conversation().ask("Hello")
+    ```
+    """
+
+    def __init__(
+        self, latency: float = 0.0, words: int = 16, chunk_delay: float = 0.0, port: int = 0
+    ) -> None:
+        self.latency = latency
+        self.words = words
+        self.chunk_delay = chunk_delay
+        self.port = port or _free_port()
+        self.api_base = f"http://127.0.0.1:{self.port}/v1"
+        config = uvicorn.Config(
+            create_app(latency=latency, words=words, chunk_delay=chunk_delay),
+            host="127.0.0.1",
+            port=self.port,
+            log_level="warning",
+            access_log=False,
+        )
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self) -> "MockServer":
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.should_exit = True
+        self._thread.join()
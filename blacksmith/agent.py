@@ -0,0 +1,173 @@
+import json
+import time
+import asyncio
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
+from blacksmith.config.constants import ChatRoles
+from blacksmith.config.prompts import DEFAULT_REACT_PROMPT
+from blacksmith.llm import AsyncConversation, FunctionCall, FunctionCallResult, LLMResponse
+from blacksmith.tools import aget_tools
+from blacksmith.utils.session import close_aiosession
+
+StopReason = Literal["answer", "max_steps", "timeout", "token_budget"]
+
+
+class AgentStep(BaseModel):
+    """
+    A class representing the timing trace of a single step of an `Agent` run.
+
+    Attributes:
+        index (int): The position of the step in the run.
+        started_at (float): Seconds from the start of the run to the start of the step.
+        llm_seconds (float): Time spent waiting on the completion.
+        tool_seconds (float): Time spent waiting on the tool call, if any.
+        tokens (int): Tokens used by the completion.
+        function_call (Optional[FunctionCallResult]): The tool call made in this step, if any.
+        reused (bool): Whether the tool call was answered by an identical earlier call in the same run.
+    """
+
+    index: int
+    started_at: float
+    llm_seconds: float = 0.0
+    tool_seconds: float = 0.0
+    tokens: int = 0
+    function_call: Optional[FunctionCallResult] = None
+    reused: bool = False
+
+
+class AgentResult(BaseModel):
+    """
+    A class representing the outcome of an `Agent` run.
+
+    Attributes:
+        answer (str | None): The final answer. `None` if the run stopped before the model answered.
+        stop_reason (StopReason): Why the run ended: "answer", "max_steps", "timeout" or "token_budget".
+        steps (list[AgentStep]): The per-step timing trace.
+        seconds (float): The wall-clock duration of the run.
+        tokens (int): Tokens used across all completions.
+        conversation (Optional[AsyncConversation]): The conversation of the run, forked from the agent's.
+    """
+
+    answer: str | None = None
+    stop_reason: StopReason
+    steps: list[AgentStep] = []
+    seconds: float = 0.0
+    tokens: int = 0
+    conversation: Optional[AsyncConversation] = None
+
+
+class Agent(BaseModel):
+    """
+    Class driving the ReAct loop of `ask` -> `execute_function_call` -> `continue_from_result` to completion.
+
+    Tool calls are started as soon as the completion that requests them is parsed. The model requests one
+    call per completion and the next completion needs its observation, so each step waits for its call;
+    completions and tool calls of the same run never overlap. The run stops when the model answers without
+    calling a tool, or when the step, wall-clock or token budget runs out.
+
+    Attributes:
+        conversation (AsyncConversation): The conversation each run is forked from, so runs do not see each
+            other's history. Defaults to a new conversation.
+        prompt (str): The prompt template, formatted with the question as `input`. Defaults to `DEFAULT_REACT_PROMPT`.
+        max_steps (int): The maximum number of tool calls. Defaults to 10.
+        max_seconds (Optional[float]): The wall-clock budget for the run. Defaults to `None` (no limit).
+        max_tokens (Optional[int]): The token budget for the run. Defaults to `None` (no limit).
+        reuse_calls (bool): Answer a tool call with the result of an identical earlier call in the same run. Only safe for tools without side effects. Defaults to `False`.
+
+    Usage:
+    ```
+        agent = Agent(max_steps=5, max_seconds=30)
+        result = agent.run("What is 5 * 10 + 3?")
+        print(result.answer)
+        for step in result.steps:
+            print(step.index, step.llm_seconds, step.tool_seconds)
+    ```
+    """
+
+    conversation: AsyncConversation = Field(default_factory=AsyncConversation)
+    prompt: str = DEFAULT_REACT_PROMPT
+    max_steps: int = 10
+    max_seconds: Optional[float] = None
+    max_tokens: Optional[int] = None
+    reuse_calls: bool = False
+
+    def run(self, question: str) -> AgentResult:
+        """
+        Runs the agent to completion on a new event loop. Use `arun` from async code.
+        """
+
+        async def run() -> AgentResult:
+            try:
+                return await self.arun(question)
+            finally:
+                await close_aiosession()
+
+        return asyncio.run(run())
+
+    async def arun(self, question: str) -> AgentResult:
+        """
+        Runs the agent to completion, in a fork of `conversation`.
+        """
+        start = time.perf_counter()
+        deadline = start + self.max_seconds if self.max_seconds is not None else None
+        c = self.conversation.fork()
+        result = AgentResult(stop_reason="answer", conversation=c)
+        # Tool calls started in this run, keyed on tool and arguments
+        calls: dict[str, asyncio.Task] = {}
+
+        def remaining() -> Optional[float]:
+            return None if deadline is None else max(deadline - time.perf_counter(), 0)
+
+        def finish(stop_reason: StopReason, answer: str | None = None) -> AgentResult:
+            result.stop_reason = stop_reason
+            result.answer = answer
+            result.seconds = time.perf_counter() - start
+            for task in calls.values():
+                task.cancel()
+            return result
+
+        # Tools are fetched for each step below
+        c._add_prompt(prompt=self.prompt.format(input=question), role=ChatRoles.USER)
+        try:
+            while True:
+                step = AgentStep(index=len(result.steps), started_at=time.perf_counter() - start)
+                result.steps.append(step)
+
+                sent = time.perf_counter()
+                functions = await aget_tools()
+                resp: LLMResponse = await asyncio.wait_for(
+                    c._asend(functions=functions), timeout=remaining()
+                )
+                step.llm_seconds = time.perf_counter() - sent
+                step.tokens = (resp.usage or {}).get("total_tokens", 0)
+                result.tokens += step.tokens
+
+                if not resp.has_function_call():
+                    return finish("answer", resp.content)
+
+                if self.max_tokens is not None and result.tokens >= self.max_tokens:
+                    return finish("token_budget")
+                if len(result.steps) > self.max_steps:
+                    return finish("max_steps")
+                task, step.reused = self._start(resp.function_call, calls)
+
+                called = time.perf_counter()
+                step.function_call = await asyncio.wait_for(
+                    asyncio.shield(task), timeout=remaining()
+                )
+                step.tool_seconds = time.perf_counter() - called
+
+                c.add_message(step.function_call.generate_observation())
+        except TimeoutError:
+            return finish("timeout")
+
+    def _start(
+        self, function_call: FunctionCall, calls: dict[str, asyncio.Task]
+    ) -> tuple[asyncio.Task, bool]:
+        # Start the tool call immediately, or reuse an identical call from earlier in the run
+        key = json.dumps([function_call.tool, function_call.args], sort_keys=True, default=str)
+        task = calls.get(key) if self.reuse_calls else None
+        if task is not None:
+            return task, True
+        calls[key] = asyncio.ensure_future(function_call.aexecute())
+        return calls[key], False
@@ -0,0 +1,80 @@
+from collections import Counter
+from functools import lru_cache
+from typing import Iterable, Literal
+from pydantic import BaseModel
+from blacksmith.config.constants import LOGIT_BIAS_LIMIT
+from blacksmith.utils.tokenizer import get_encoder
+
+
+def word_variants(word: str) -> list[str]:
+    """
+    Returns the spellings of `word` that are tokenized separately: leading space and casing.
+    """
+    variants = [
+        f" {word}",
+        f" {word}".lower(),
+        f" {word}".upper(),
+        word[0].upper() + word[1:],
+        " " + word[0].upper() + word[1:],
+    ]
+    return list(dict.fromkeys(variants))
+
+
+class CompiledBias(BaseModel, frozen=True, defer_build=True):
+    """
+    A logit bias compiled from a list of words. Compiled biases can be shared between many `Conversation`s.
+
+    Attributes:
+        model (str): The model the words were tokenized for.
+        bias (dict[int, int]): The token ids and their bias, ready to pass as `logit_bias`.
+        dropped (int): The number of token ids left out to stay within the API limit.
+    """
+
+    model: str | None
+    bias: dict[int, int]
+    dropped: int = 0
+
+
+def compile_bias(
+    words: Iterable[str],
+    model: str | None,
+    value: int = -100,
+    limit: int = LOGIT_BIAS_LIMIT,
+    overflow: Literal["truncate", "error"] = "truncate",
+) -> CompiledBias:
+    """
+    Compiles a list of words into a logit bias for `model`.
+
+    Every variant of every word is tokenized in a single batch, and token ids are ranked by the number
+    of variants they appear in. If there are more than `limit` ids, `overflow="truncate"` keeps the
+    highest ranked ones and `overflow="error"` raises a `ValueError`. Results are memoized.
+
+    Usage:
+    ```
+        banned = compile_bias(moderation_list, model="gpt-3.5-turbo")
+        cfg = Config(model="gpt-3.5-turbo", temperature=0.5, bias=banned.bias)
+    ```
+    """
+    return _compile_bias(tuple(words), model, value, limit, overflow)
+
+
+@lru_cache(maxsize=128)
+def _compile_bias(
+    words: tuple[str, ...], model: str | None, value: int, limit: int, overflow: str
+) -> CompiledBias:
+    variants = list(dict.fromkeys(v for word in words if word for v in word_variants(word)))
+    ranks = Counter(
+        token for tokens in get_encoder(model).encode_batch(variants) for token in set(tokens)
+    )
+
+    if len(ranks) > limit and overflow == "error":
+        raise ValueError(
+            f"Bias has {len(ranks)} tokens, but the API accepts at most {limit}. "
+            "Ban fewer words, or compile with overflow='truncate'."
+        )
+
+    # `most_common` keeps first-seen order for ties
+    tokens = [token for token, _ in ranks.most_common(limit)]
+    return CompiledBias(
+        model=model, bias={token: value for token in tokens}, dropped=len(ranks) - len(tokens)
+    )
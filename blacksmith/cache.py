@@ -0,0 +1,615 @@
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Optional
+from pydantic import BaseModel
+from blacksmith import metrics
+
+
+def request_key(request: dict) -> str:
+    """
+    Returns a canonical hash of a completion request.
+
+    Keys are stable across processes, so they can be shared through a persistent cache.
+    """
+    payload = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class CacheStats(BaseModel, defer_build=True):
+    """
+    Counters reported by a `CompletionCache`.
+
+    Attributes:
+        hits (int): Requests answered from the cache.
+        misses (int): Requests sent to the API.
+        coalesced (int): Requests that waited on an identical in-flight request instead of sending their own.
+        tokens_saved (int): Total tokens of the completions served from the cache or coalesced.
+        miss_seconds (float): Total time spent on requests sent to the API.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    tokens_saved: int = 0
+    miss_seconds: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.coalesced + self.misses
+        return (self.hits + self.coalesced) / total if total else 0.0
+
+    @property
+    def seconds_saved(self) -> float:
+        """
+        Estimated latency saved, assuming every hit would have taken the average miss latency.
+        """
+        if not self.misses:
+            return 0.0
+        return (self.hits + self.coalesced) * self.miss_seconds / self.misses
+
+
+def _total_tokens(value: dict) -> int:
+    return (value.get("usage") or {}).get("total_tokens", 0)
+
+
+class CompletionCache(ABC):
+    """
+    Base class for completion caches.
+
+    Subclasses implement `get` and `set`. Lookups go through `get_or_create`, which also coalesces
+    concurrent identical requests so only one of them reaches the API. The async versions run `get` and
+    `set` in a thread, so that a cache doing I/O does not block the event loop.
+    """
+
+    def __init__(self) -> None:
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._inflight: dict[str, Future] = {}
+        self._ainflight: dict[tuple[int, str], asyncio.Future] = {}
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: dict) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+    async def aget(self, key: str) -> Optional[dict]:
+        """
+        Async version of `get`.
+        """
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value: dict) -> None:
+        """
+        Async version of `set`.
+        """
+        await asyncio.to_thread(self.set, key, value)
+
+    def _record(self, value: dict, field: str) -> None:
+        with self._lock:
+            setattr(self.stats, field, getattr(self.stats, field) + 1)
+            self.stats.tokens_saved += _total_tokens(value)
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """
+        Returns the cached value for `key`, counting a hit if there is one.
+        """
+        value = self.get(key)
+        if value is not None:
+            self._record(value, "hits")
+        return value
+
+    def store(self, key: str, value: dict, seconds: float) -> None:
+        """
+        Caches a value that took `seconds` to create, counting a miss.
+        """
+        self.set(key, value)
+        self._record_miss(seconds)
+
+    async def alookup(self, key: str) -> Optional[dict]:
+        """
+        Async version of `lookup`.
+        """
+        value = await self.aget(key)
+        if value is not None:
+            self._record(value, "hits")
+        return value
+
+    async def astore(self, key: str, value: dict, seconds: float) -> None:
+        """
+        Async version of `store`.
+        """
+        await self.aset(key, value)
+        self._record_miss(seconds)
+
+    def _record_miss(self, seconds: float) -> None:
+        with self._lock:
+            self.stats.misses += 1
+            self.stats.miss_seconds += seconds
+
+    def get_or_create(self, key: str, create: Callable[[], dict]) -> tuple[dict, bool]:
+        """
+        Returns the cached value for `key`, calling `create` on a miss.
+
+        Returns a tuple of the value and whether it was freshly created by this call.
+        """
+        value = self.lookup(key)
+        if value is not None:
+            return value, False
+
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            value = future.result()
+            self._record(value, "coalesced")
+            return value, False
+
+        try:
+            start = time.perf_counter()
+            value = create()
+            self.store(key, value, time.perf_counter() - start)
+            future.set_result(value)
+            return value, True
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def aget_or_create(
+        self, key: str, create: Callable[[], Awaitable[dict]]
+    ) -> tuple[dict, bool]:
+        """
+        Async version of `get_or_create`.
+
+        When the request being waited on is cancelled, its followers look the key up again and the first
+        of them to resume sends the request in its place.
+        """
+        loop = asyncio.get_running_loop()
+        inflight_key = (id(loop), key)
+        while True:
+            value = await self.alookup(key)
+            if value is not None:
+                return value, False
+            future = self._ainflight.get(inflight_key)
+            if future is None:
+                break
+            # Unlike awaiting the future, waiting on it does not raise when the leader is cancelled
+            await asyncio.wait([future])
+            if not future.cancelled():
+                value = future.result()
+                self._record(value, "coalesced")
+                return value, False
+
+        future = self._ainflight[inflight_key] = loop.create_future()
+        # Mark the exception as retrieved when nobody else is waiting on this request
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            start = time.perf_counter()
+            value = await create()
+            await self.astore(key, value, time.perf_counter() - start)
+            future.set_result(value)
+            return value, True
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._ainflight.pop(inflight_key, None)
+
+
+class MemoryCache(CompletionCache):
+    """
+    An in-memory LRU completion cache.
+
+    Attributes:
+        maxsize (int): The maximum number of completions to keep. Defaults to 1024.
+        ttl (Optional[float]): The number of seconds a completion stays valid. Defaults to `None` (no expiry).
+
+    Usage:
+    ```
+        cfg = Config(model="gpt-3.5-turbo", temperature=0, cache=MemoryCache(maxsize=10_000, ttl=3600))
+    ```
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None) -> None:
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # Entries are only held in memory, so the event loop is never blocked for long
+    async def aget(self, key: str) -> Optional[dict]:
+        return self.get(key)
+
+    async def aset(self, key: str, value: dict) -> None:
+        self.set(key, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache(CompletionCache):
+    """
+    A persistent completion cache backed by a SQLite database.
+
+    The database can be shared by several processes on the same machine.
+
+    Attributes:
+        path (str): The path to the database file.
+        ttl (Optional[float]): The number of seconds a completion stays valid. Defaults to `None` (no expiry).
+
+    Usage:
+    ```
+        cfg = Config(model="gpt-3.5-turbo", temperature=0, cache=SQLiteCache(".blacksmith/cache.db"))
+    ```
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = None) -> None:
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at < time.time():
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                return None
+        return json.loads(value)
+
+    def set(self, key: str, value: dict) -> None:
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+
+    def clear(self) -> None:
+        with self._db_lock:
+            self._db.execute("DELETE FROM completions")
+
+
+class TieredCache(CompletionCache):
+    """
+    Chains several caches, checking them in order.
+
+    A hit in a later tier is copied into the earlier tiers, so the usual setup is a `MemoryCache`
+    in front of a `SQLiteCache`.
+
+    Usage:
+    ```
+        cache = TieredCache(MemoryCache(maxsize=1024), SQLiteCache(".blacksmith/cache.db"))
+        cfg = Config(model="gpt-3.5-turbo", temperature=0, cache=cache)
+        ...
+        print(cache.stats)
+    ```
+    """
+
+    def __init__(self, *tiers: CompletionCache) -> None:
+        super().__init__()
+        self.tiers = tiers
+
+    def get(self, key: str) -> Optional[dict]:
+        for i, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for earlier in self.tiers[:i]:
+                    earlier.set(key, value)
+                return value
+        return None
+
+    def set(self, key: str, value: dict) -> None:
+        for tier in self.tiers:
+            tier.set(key, value)
+
+    def clear(self) -> None:
+        for tier in self.tiers:
+            tier.clear()
+
+
+class SemanticCacheStats(BaseModel, defer_build=True):
+    """
+    Counters reported by a `SemanticCache`.
+
+    Attributes:
+        hits (int): Requests answered with the response to a similar earlier request.
+        misses (int): Requests that found no similar earlier request.
+        lookup_seconds (float): Total time spent embedding and searching, over hits and misses.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    lookup_seconds: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def mean_lookup_seconds(self) -> float:
+        total = self.hits + self.misses
+        return self.lookup_seconds / total if total else 0.0
+
+
+class _Partition:
+    """
+    The vectors of the cached requests sharing one context fingerprint, in a contiguous float32 matrix.
+    """
+
+    def __init__(self, np, dim: int) -> None:
+        self.np = np
+        self.matrix = np.empty((16, dim), dtype=np.float32)
+        self.entry_ids: list[int] = []
+        self.positions: dict[int, int] = {}
+
+    def add(self, entry_id: int, vector) -> None:
+        size = len(self.entry_ids)
+        if size == len(self.matrix):
+            matrix = self.np.empty((2 * size, self.matrix.shape[1]), dtype=self.np.float32)
+            matrix[:size] = self.matrix
+            self.matrix = matrix
+        self.matrix[size] = vector
+        self.positions[entry_id] = size
+        self.entry_ids.append(entry_id)
+
+    def remove(self, entry_id: int) -> None:
+        # Move the last row into the hole, so the matrix stays contiguous
+        position, last = self.positions.pop(entry_id), len(self.entry_ids) - 1
+        if position != last:
+            moved = self.entry_ids[last]
+            self.matrix[position] = self.matrix[last]
+            self.entry_ids[position] = moved
+            self.positions[moved] = position
+        self.entry_ids.pop()
+
+    def best(self, vector) -> tuple[Optional[int], float]:
+        if not self.entry_ids:
+            return None, 0.0
+        scores = self.matrix[: len(self.entry_ids)] @ vector
+        i = int(scores.argmax())
+        return self.entry_ids[i], float(scores[i])
+
+
+class _Probe:
+    __slots__ = ("fingerprint", "vector", "value")
+
+    def __init__(self, fingerprint: str, vector, value: Optional[dict]) -> None:
+        self.fingerprint = fingerprint
+        self.vector = vector
+        self.value = value
+
+
+class SemanticCache:
+    """
+    A cache answering requests with the response to an earlier request phrased similarly.
+
+    A request is a hit when everything but its final user message is identical to an earlier request (its
+    context fingerprint: model, settings, functions and history) and the embedding of its final user
+    message has a cosine similarity of at least `threshold` with the earlier one. Requests that do not end
+    with a user message are not cached. Streamed requests are not cached.
+
+    Attributes:
+        threshold (float): The minimum cosine similarity for a hit. Defaults to 0.95.
+        maxsize (int): The maximum number of responses to keep, evicting the least recently used. Defaults to 10,000.
+        ttl (Optional[float]): The number of seconds a response stays valid. Defaults to `None` (no expiry).
+        model (str): The embedding model. Defaults to `DEFAULT_EMBEDDING_MODEL`.
+        embedding_cache (Optional[EmbeddingCache]): A cache for the embeddings of user messages. Defaults to `None`.
+
+    Usage:
+    ```
+        cache = SemanticCache(threshold=0.95, maxsize=10_000, ttl=3600)
+        cfg = Config(model="gpt-3.5-turbo", temperature=0, semantic_cache=cache)
+        ...
+        print(cache.stats.hit_rate, cache.stats.mean_lookup_seconds)
+    ```
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        maxsize: int = 10_000,
+        ttl: Optional[float] = None,
+        model: Optional[str] = None,
+        embedding_cache=None,
+    ) -> None:
+        # Imported here so that numpy is only loaded when a semantic cache is used
+        import numpy
+        from blacksmith.config.constants import DEFAULT_EMBEDDING_MODEL
+
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.model = model or DEFAULT_EMBEDDING_MODEL
+        self.embedding_cache = embedding_cache
+        self.stats = SemanticCacheStats()
+        self._np = numpy
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._partitions: dict[str, _Partition] = {}
+        # entry id -> (fingerprint, expires_at, value), least recently used first
+        self._entries: OrderedDict[int, tuple[str, float, dict]] = OrderedDict()
+
+    @staticmethod
+    def _split(request: dict) -> Optional[tuple[str, str]]:
+        messages = request["messages"]
+        if not messages or messages[-1]["role"] != "user":
+            return None
+        context = {**request, "messages": messages[:-1]}
+        return request_key(context), messages[-1]["content"]
+
+    def _normalize(self, vector):
+        vector = self._np.asarray(vector, dtype=self._np.float32).ravel()
+        norm = self._np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _search(self, fingerprint: str, vector) -> Optional[dict]:
+        with self._lock:
+            partition = self._partitions.get(fingerprint)
+            if partition is None:
+                return None
+            entry_id, score = partition.best(vector)
+            if entry_id is None or score < self.threshold:
+                return None
+            _, expires_at, value = self._entries[entry_id]
+            if expires_at < time.monotonic():
+                self._evict(entry_id)
+                return None
+            self._entries.move_to_end(entry_id)
+            return value
+
+    def _record(self, hit: bool, seconds: float) -> None:
+        with self._lock:
+            if hit:
+                self.stats.hits += 1
+            else:
+                self.stats.misses += 1
+            self.stats.lookup_seconds += seconds
+        metrics.inc("blacksmith_cache_total", cache="semantic", result="hit" if hit else "miss")
+
+    def _evict(self, entry_id: int) -> None:
+        fingerprint, _, _ = self._entries.pop(entry_id)
+        partition = self._partitions[fingerprint]
+        partition.remove(entry_id)
+        if not partition.entry_ids:
+            del self._partitions[fingerprint]
+
+    def _add(self, probe: _Probe, value: dict) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            entry_id, self._next_id = self._next_id, self._next_id + 1
+            partition = self._partitions.get(probe.fingerprint)
+            if partition is None:
+                partition = self._partitions[probe.fingerprint] = _Partition(
+                    self._np, len(probe.vector)
+                )
+            partition.add(entry_id, probe.vector)
+            self._entries[entry_id] = (probe.fingerprint, expires_at, value)
+            while len(self._entries) > self.maxsize:
+                self._evict(next(iter(self._entries)))
+
+    def _probe(self, request: dict, config) -> Optional[_Probe]:
+        from blacksmith.embeddings import embed
+
+        split = self._split(request)
+        if split is None:
+            return None
+        start = time.perf_counter()
+        fingerprint, text = split
+        vector = self._normalize(
+            embed([text], model=self.model, cache=self.embedding_cache, config=config)
+        )
+        value = self._search(fingerprint, vector)
+        self._record(value is not None, time.perf_counter() - start)
+        return _Probe(fingerprint, vector, value)
+
+    async def _aprobe(self, request: dict, config) -> Optional[_Probe]:
+        from blacksmith.embeddings import aembed
+
+        split = self._split(request)
+        if split is None:
+            return None
+        start = time.perf_counter()
+        fingerprint, text = split
+        vector = self._normalize(
+            await aembed([text], model=self.model, cache=self.embedding_cache, config=config)
+        )
+        value = self._search(fingerprint, vector)
+        self._record(value is not None, time.perf_counter() - start)
+        return _Probe(fingerprint, vector, value)
+
+    def get_or_create(
+        self, request: dict, create: Callable[[], tuple[dict, bool]], config
+    ) -> tuple[dict, bool]:
+        """
+        Returns the response to a similar earlier request, calling `create` if there is none.
+
+        `create` returns a response and whether it was freshly created, and the same is returned here.
+        """
+        probe = self._probe(request, config)
+        if probe is not None and probe.value is not None:
+            return probe.value, False
+        value, fresh = create()
+        if probe is not None:
+            self._add(probe, value)
+        return value, fresh
+
+    async def aget_or_create(
+        self, request: dict, create: Callable[[], Awaitable[tuple[dict, bool]]], config
+    ) -> tuple[dict, bool]:
+        """
+        Async version of `get_or_create`.
+        """
+        probe = await self._aprobe(request, config)
+        if probe is not None and probe.value is not None:
+            return probe.value, False
+        value, fresh = await create()
+        if probe is not None:
+            self._add(probe, value)
+        return value, fresh
+
+    def clear(self) -> None:
+        with self._lock:
+            self._partitions.clear()
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -25,6 +25,13 @@ REGISTRY_HEALTH_CHECK_BACKOFF = 1
 
 REGISTRY_CONTAINER_NAME = "tool-registry"
 
+REGISTRY_PORT = 8000
+
+# Keep-alive connections per client to the tool registry, and how concurrent calls are batched
+REGISTRY_POOL_SIZE = 32
+REGISTRY_BATCH_WINDOW = 0.002
+REGISTRY_MAX_BATCH_SIZE = 64
+
 # TODO: Update this to support more types
 TYPE_MAPPINGS = {"str": "string", "int": "integer"}
 
@@ -33,3 +40,25 @@ class ChatRoles(str, Enum):
     SYSTEM = "system"
     USER = "user"
     ASSISTANT = "assistant"
+
+
+# Maximum number of pooled connections held by the shared aiohttp session
+AIOHTTP_POOL_LIMIT = 256
+
+# Maximum number of entries the API accepts in `logit_bias`
+LOGIT_BIAS_LIMIT = 300
+
+# Worker pool sizes for tool execution. `None` uses the number of CPUs for processes.
+TOOL_THREAD_POOL_SIZE = 32
+TOOL_PROCESS_POOL_SIZE = None
+
+# Defaults for packing many items into a single `generate_packed` request
+PACKED_MAX_BATCH_TOKENS = 2000
+PACKED_MAX_BATCH_SIZE = 50
+# Tokens per item for its id and the JSON around it, in the prompt and in the result
+PACKED_ITEM_OVERHEAD = 12
+
+# Embedding defaults. The API accepts at most 2048 inputs per request.
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_MAX_BATCH_SIZE = 2048
+EMBEDDING_MAX_BATCH_TOKENS = 100_000
@@ -19,3 +19,12 @@ Question: {input}
 """
 
 DEFAULT_OBSERVATION = "Observation: '{result}' is the result of calling {tool} with {args}"
+
+DEFAULT_ERROR_OBSERVATION = "Observation: calling {tool} with {args} failed with '{error}'"
+
+DEFAULT_PACKED_PROMPT = """
+Complete the function call with one result for each of the following items, one item per line.
+Copy the id of each item into its result.
+
+{items}
+"""
@@ -1,33 +1,78 @@
 from contextlib import contextmanager
+from contextvars import ContextVar
 import os
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
+from blacksmith.bias import CompiledBias
+from blacksmith.cache import CompletionCache, SemanticCache
+from blacksmith.config.constants import LOGIT_BIAS_LIMIT
+from blacksmith.ratelimit import RateLimiter
+from blacksmith.retry import RetryPolicy
+from blacksmith.router import Router
 from blacksmith.utils.tokenizer import get_encodings
 from typing import Any, Optional, Callable
 
+# Default model settings, read from the environment once and filled in by the first `Config`
+_defaults = {
+    "model": os.getenv("MODEL"),
+    "temperature": float(os.environ["TEMPERATURE"]) if os.getenv("TEMPERATURE") else None,
+    "api_key": os.getenv("OPENAI_API_KEY"),
+}
+
+
+class _Scope:
+    """
+    Model settings for a `model()` block, along with the configurations resolved inside it.
+    """
+
+    def __init__(self, model: str, temperature: float) -> None:
+        self.model = model
+        self.temperature = temperature
+        # id(config) -> (config, its fields when resolved, resolved config)
+        self.resolved: dict[int, tuple["Config", dict, "Config"]] = {}
+
+
+_scope: ContextVar[Optional[_Scope]] = ContextVar("blacksmith_model_scope", default=None)
+
 
 @contextmanager
 def model(model: str, temperature: int):
-    envars = os.environ.copy()
+    """
+    Runs a block of code with a different model and temperature.
+
+    The override is scoped with `contextvars`, so it only applies to the current thread or asyncio task
+    (and tasks created from it), and entering it is O(1).
+    """
+    token = _scope.set(_Scope(model=model, temperature=float(temperature)))
     try:
-        os.environ.update(
-            {"MODEL": model, "TEMPERATURE": str(temperature), "USING_CONTEXT": "true"}
-        )
         yield
     finally:
-        # Restore the original environment variables
-        os.environ.clear()
-        os.environ.update(envars)
+        _scope.reset(token)
+
+
+def using_context() -> bool:
+    """
+    Returns true when called inside a `model()` block.
+    """
+    return _scope.get() is not None
 
 
 class Config(BaseModel):
     """
     Configuration class for LLM calls.
 
+    The first `Config` to set a model, temperature or API key makes it the default for
+    `Conversation`s created without a configuration.
+
     Attributes:
         model (Optional[str]): The name of the LLM model to use.
         temperature (Optional[float]): The temperature to use for LLM sampling.
         api_key (Optional[str]): The API key to use for OpenAI authentication.
         on_completion (Optional[list[Callabe]]): Functions called after a successful completion.
+        cache (Optional[CompletionCache]): A cache for completions. Completion hooks are not called for cached completions.
+        retry (RetryPolicy): How failed or slow requests are retried and hedged. Defaults to 3 attempts with jittered backoff.
+        rate_limit (Optional[RateLimiter]): A client-side limiter for requests and tokens per minute. Defaults to `None`.
+        semantic_cache (Optional[SemanticCache]): A cache answering near-duplicate prompts, checked after an exact `cache` miss. Defaults to `None`.
+        router (Optional[Router]): Spreads requests over several endpoints, each with its own key and model. Defaults to `None`.
 
     Usage:
     ```
@@ -39,35 +84,60 @@ class Config(BaseModel):
     ```
     """
 
-    model: Optional[str] = os.getenv("MODEL")
-    temperature: Optional[float] = os.getenv("TEMPERATURE")
-    api_key: Optional[str] = os.getenv("OPENAI_API_KEY")
+    model_config = ConfigDict(arbitrary_types_allowed=True, defer_build=True)
+
+    model: Optional[str] = _defaults["model"]
+    temperature: Optional[float] = _defaults["temperature"]
+    api_key: Optional[str] = _defaults["api_key"]
     on_completion: Optional[list[Callable]] = []
     bias: Optional[dict] = {}
+    cache: Optional[CompletionCache] = None
+    retry: RetryPolicy = Field(default_factory=RetryPolicy)
+    rate_limit: Optional[RateLimiter] = None
+    semantic_cache: Optional[SemanticCache] = None
+    router: Optional[Router] = None
 
     def model_post_init(self, __context: Any) -> None:
-        if self.model and not os.environ.get("MODEL"):
-            os.environ["MODEL"] = self.model
-        if self.temperature and not os.environ.get("TEMPERATURE"):
-            os.environ["TEMPERATURE"] = str(self.temperature)
-        if self.api_key and not os.environ.get("OPENAI_API_KEY"):
-            os.environ["OPENAI_API_KEY"] = self.api_key
+        for key in ("model", "temperature", "api_key"):
+            if getattr(self, key) is not None and _defaults[key] is None:
+                _defaults[key] = getattr(self, key)
 
     def load(self) -> "Config":
         """
-        Loads the default configuration from environment variables.
+        Loads the default configuration, or the configuration of the enclosing `model()` block.
 
         This method can only be called after a Config object has been previously initialized.
         """
-        try:
-            self.model = os.getenv("MODEL")
-            self.temperature = float(os.getenv("TEMPERATURE"))
-            self.api_key = os.getenv("OPENAI_API_KEY")
-            return self
-        except Exception as e:
+        scope = _scope.get()
+        self.model = scope.model if scope else _defaults["model"]
+        self.temperature = scope.temperature if scope else _defaults["temperature"]
+        self.api_key = _defaults["api_key"]
+        if self.temperature is None:
             raise RuntimeError(
-                f"Failed to load default configuration. Please check that the Config object has been initialized. Error: {e}"
+                "Failed to load default configuration. Please check that the Config object has been initialized."
             )
+        return self
+
+    def resolve(self) -> "Config":
+        """
+        Returns the configuration to use for a request.
+
+        Inside a `model()` block this is a copy with the block's model and temperature, sharing hooks, bias
+        and cache. The copy is reused for the rest of the block, and made again if a field of this
+        configuration is reassigned. Outside of a block, it is this configuration.
+        """
+        scope = _scope.get()
+        if scope is None:
+            return self
+        entry = scope.resolved.get(id(self))
+        # Fields are compared by identity first, so this stays cheap while nothing changed
+        if entry is None or entry[0] is not self or entry[1] != self.__dict__:
+            entry = scope.resolved[id(self)] = (
+                self,
+                dict(self.__dict__),
+                self.model_copy(update={"model": scope.model, "temperature": scope.temperature}),
+            )
+        return entry[2]
 
     def update_bias(self, token: str, value: int) -> None:
         """
@@ -76,3 +146,16 @@ class Config(BaseModel):
         encodings = get_encodings(model=self.model, token=token)
         for token in encodings:
             self.bias.update({token: value})
+
+    def apply_bias(self, compiled: CompiledBias) -> None:
+        """
+        Merges a compiled bias into the bias for this configuration.
+
+        Raises a `ValueError` if the merged bias would go over the API limit.
+        """
+        merged = {**self.bias, **compiled.bias}
+        if len(merged) > LOGIT_BIAS_LIMIT:
+            raise ValueError(
+                f"Bias would have {len(merged)} tokens, but the API accepts at most {LOGIT_BIAS_LIMIT}."
+            )
+        self.bias.update(compiled.bias)
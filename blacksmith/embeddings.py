@@ -0,0 +1,442 @@
+import json
+import base64
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import contextvars
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, Optional, Sequence
+from blacksmith import metrics
+from blacksmith.config.constants import (
+    DEFAULT_EMBEDDING_MODEL,
+    EMBEDDING_MAX_BATCH_SIZE,
+    EMBEDDING_MAX_BATCH_TOKENS,
+)
+from blacksmith.context import Config
+from blacksmith.utils.session import get_aiosession
+from blacksmith.utils.tokenizer import count_tokens
+
+# numpy and openai take a while to import, so they are only imported once texts are embedded
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def embedding_key(model: str, text: str) -> str:
+    """
+    Returns the content hash an embedding is cached under.
+    """
+    return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+
+class EmbeddingCache(ABC):
+    """
+    Base class for embedding caches, keyed on `embedding_key`.
+
+    Subclasses implement `get_many` and `set_many`.
+    """
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def get_many(self, keys: list[str]) -> dict[str, "np.ndarray"]:
+        ...
+
+    @abstractmethod
+    def set_many(self, items: dict[str, "np.ndarray"]) -> None:
+        ...
+
+    def lookup(self, keys: list[str]) -> dict[str, "np.ndarray"]:
+        """
+        Returns the cached embeddings among `keys`, counting hits and misses.
+        """
+        found = self.get_many(keys)
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+
+class MemoryEmbeddingCache(EmbeddingCache):
+    """
+    An in-memory LRU embedding cache.
+
+    Attributes:
+        maxsize (int): The maximum number of embeddings to keep. Defaults to 100,000.
+    """
+
+    def __init__(self, maxsize: int = 100_000) -> None:
+        super().__init__()
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, "np.ndarray"] = OrderedDict()
+
+    def get_many(self, keys: list[str]) -> dict[str, "np.ndarray"]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = vector
+        return found
+
+    def set_many(self, items: dict[str, "np.ndarray"]) -> None:
+        with self._lock:
+            self._entries.update(items)
+            for key in items:
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteEmbeddingCache(EmbeddingCache):
+    """
+    A persistent embedding cache backed by a SQLite database, storing raw float32 vectors.
+
+    Attributes:
+        path (str): The path to the database file.
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.path = path
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+
+    def get_many(self, keys: list[str]) -> dict[str, "np.ndarray"]:
+        import numpy as np
+
+        found = {}
+        with self._db_lock:
+            # Stay below SQLite's default limit on query variables
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def set_many(self, items: dict[str, "np.ndarray"]) -> None:
+        import numpy as np
+
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(v, dtype=np.float32).tobytes()) for key, v in items.items()],
+            )
+
+
+def _batches(texts: list[str], model: str, max_tokens: int, max_size: int) -> Iterator[list[str]]:
+    batch, tokens = [], 0
+    for text in texts:
+        cost = count_tokens(model, text)
+        if batch and (tokens + cost > max_tokens or len(batch) >= max_size):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(text)
+        tokens += cost
+    if batch:
+        yield batch
+
+
+def _decode(response) -> "np.ndarray":
+    import numpy as np
+
+    data = sorted(response["data"], key=lambda d: d["index"])
+    return np.stack(
+        [
+            np.frombuffer(base64.b64decode(d["embedding"]), dtype=np.float32)
+            if isinstance(d["embedding"], str)
+            else np.asarray(d["embedding"], dtype=np.float32)
+            for d in data
+        ]
+    )
+
+
+def _plan(
+    texts: Sequence[str], model: str, cache: Optional[EmbeddingCache]
+) -> tuple[list[str], dict[str, "np.ndarray"], list[str]]:
+    # Deduplicate by content hash and split into cached and missing texts
+    keys = [embedding_key(model, text) for text in texts]
+    unique = dict(zip(keys, texts))
+    found = cache.lookup(list(unique)) if cache is not None else {}
+    missing = [text for key, text in unique.items() if key not in found]
+    return keys, found, missing
+
+
+def _assemble(
+    keys: list[str],
+    found: dict[str, "np.ndarray"],
+    missing: list[str],
+    embedded: list["np.ndarray"],
+    model: str,
+    cache: Optional[EmbeddingCache],
+) -> "np.ndarray":
+    import numpy as np
+
+    fresh = {}
+    if embedded:
+        rows = np.concatenate(embedded)
+        fresh = {embedding_key(model, text): row for text, row in zip(missing, rows)}
+    if cache is not None and fresh:
+        cache.set_many(fresh)
+    vectors = {**found, **fresh}
+    if not keys:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack([vectors[key] for key in keys])
+
+
+def embed(
+    texts: Sequence[str],
+    model: str = DEFAULT_EMBEDDING_MODEL,
+    cache: Optional[EmbeddingCache] = None,
+    max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+    max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE,
+    max_concurrency: int = 8,
+    config: Optional[Config] = None,
+) -> "np.ndarray":
+    """
+    Embeds `texts`, returning a float32 matrix with one row per text.
+
+    Texts are deduplicated and looked up in `cache` by content hash, and the rest are packed into batches
+    of at most `max_batch_tokens` tokens and `max_batch_size` texts, which are sent concurrently.
+
+    Args:
+        texts (Sequence[str]): The texts to embed.
+        model (str): The embedding model. Defaults to `DEFAULT_EMBEDDING_MODEL`.
+        cache (Optional[EmbeddingCache]): A cache for embeddings. Defaults to `None`.
+        max_batch_tokens (int, optional): The token budget of a request. Defaults to `EMBEDDING_MAX_BATCH_TOKENS`.
+        max_batch_size (int, optional): The maximum number of texts in a request. Defaults to `EMBEDDING_MAX_BATCH_SIZE`.
+        max_concurrency (int, optional): The maximum number of concurrent requests. Defaults to 8.
+        config (Optional[Config]): The configuration providing the API key and retry policy. Defaults to the default configuration.
+
+    Usage:
+    ```
+        cache = MemoryEmbeddingCache()
+        vectors = embed(["The Golden Gate Bridge", "Hollywood"], cache=cache)
+        vectors.shape
+        (2, 1536)
+    ```
+    """
+    import openai
+
+    config = (config or Config().load()).resolve()
+    keys, found, missing = _plan(texts, model, cache)
+
+    def create(batch: list[str]) -> "np.ndarray":
+        with metrics.span("embed", model=model):
+            response = config.retry.call(
+                lambda timeout: openai.Embedding.create(
+                    input=batch,
+                    model=model,
+                    api_key=config.api_key,
+                    encoding_format="base64",
+                    request_timeout=timeout,
+                )
+            )
+        metrics.record_usage(model, response.get("usage"))
+        return _decode(response)
+
+    batches = list(_batches(missing, model, max_batch_tokens, max_batch_size))
+    if len(batches) <= 1:
+        embedded = [create(batch) for batch in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as pool:
+            embedded = list(
+                pool.map(lambda batch: contextvars.copy_context().run(create, batch), batches)
+            )
+    return _assemble(keys, found, missing, embedded, model, cache)
+
+
+async def aembed(
+    texts: Sequence[str],
+    model: str = DEFAULT_EMBEDDING_MODEL,
+    cache: Optional[EmbeddingCache] = None,
+    max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+    max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE,
+    max_concurrency: int = 8,
+    config: Optional[Config] = None,
+) -> "np.ndarray":
+    """
+    Async version of `embed`.
+    """
+    import openai
+
+    config = (config or Config().load()).resolve()
+    openai.aiosession.set(get_aiosession())
+    keys, found, missing = _plan(texts, model, cache)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def create(batch: list[str]) -> "np.ndarray":
+        async with semaphore:
+            with metrics.span("embed", model=model):
+                response = await config.retry.acall(
+                    lambda timeout: openai.Embedding.acreate(
+                        input=batch,
+                        model=model,
+                        api_key=config.api_key,
+                        encoding_format="base64",
+                        request_timeout=timeout,
+                    )
+                )
+        metrics.record_usage(model, response.get("usage"))
+        return _decode(response)
+
+    batches = _batches(missing, model, max_batch_tokens, max_batch_size)
+    embedded = await asyncio.gather(*(create(batch) for batch in batches))
+    return _assemble(keys, found, missing, list(embedded), model, cache)
+
+
+def _normalize(vectors: "np.ndarray") -> "np.ndarray":
+    import numpy as np
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class VectorIndex:
+    """
+    An in-process vector index with cosine top-k search.
+
+    Vectors are normalized and kept in one contiguous float32 matrix, so a search is a single matrix
+    product. Indexes saved with `save` can be loaded memory-mapped, so large indexes are paged in from
+    disk on demand and shared between processes.
+
+    Attributes:
+        dim (int): The dimension of the vectors.
+        ids (list): The id of each vector, e.g. the text it embeds.
+
+    Usage:
+    ```
+        index = VectorIndex.from_texts(documents, cache=cache)
+        index.save("docs")
+
+        index = VectorIndex.load("docs")
+        for doc, score in index.search_text("How do I reset my password?", k=3):
+            print(score, doc)
+    ```
+    """
+
+    def __init__(self, dim: int, capacity: int = 1024) -> None:
+        import numpy as np
+
+        self.dim = dim
+        self.ids: list[Any] = []
+        self._matrix = np.empty((capacity, dim), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def vectors(self) -> "np.ndarray":
+        """
+        The normalized vectors, one row per id.
+        """
+        return self._matrix[: len(self.ids)]
+
+    def add(self, vectors: "np.ndarray", ids: Optional[Iterable[Any]] = None) -> None:
+        """
+        Adds vectors to the index. `ids` default to the position of each vector.
+        """
+        import numpy as np
+
+        vectors = _normalize(np.atleast_2d(vectors))
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}")
+        ids = list(ids) if ids is not None else list(range(len(self), len(self) + len(vectors)))
+        if len(ids) != len(vectors):
+            raise ValueError(f"Got {len(ids)} ids for {len(vectors)} vectors")
+
+        size = len(self)
+        if size + len(vectors) > len(self._matrix) or not self._matrix.flags.writeable:
+            # Grow geometrically, which also copies a memory-mapped matrix into memory
+            capacity = max(2 * len(self._matrix), size + len(vectors), 1024)
+            matrix = np.empty((capacity, self.dim), dtype=np.float32)
+            matrix[:size] = self._matrix[:size]
+            self._matrix = matrix
+        self._matrix[size : size + len(vectors)] = vectors
+        self.ids.extend(ids)
+
+    def search(self, queries: "np.ndarray", k: int = 5) -> list[list[tuple[Any, float]]]:
+        """
+        Returns the `k` most similar ids and their cosine similarity for each query, most similar first.
+        """
+        import numpy as np
+
+        queries = _normalize(np.atleast_2d(queries))
+        k = min(k, len(self))
+        if k == 0:
+            return [[] for _ in queries]
+        scores = queries @ self.vectors.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        # Only the k candidates of each query are sorted
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [
+            [(self.ids[i], float(score)) for i, score in zip(row, row_scores)]
+            for row, row_scores in zip(top, top_scores)
+        ]
+
+    def search_text(self, text: str, k: int = 5, **kwargs) -> list[tuple[Any, float]]:
+        """
+        Embeds `text` and searches for it. Keyword arguments are passed to `embed`.
+        """
+        return self.search(embed([text], **kwargs), k=k)[0]
+
+    @classmethod
+    def from_texts(cls, texts: Sequence[str], **kwargs) -> "VectorIndex":
+        """
+        Embeds `texts` and indexes them under their own text. Keyword arguments are passed to `embed`.
+
+        Raises a `ValueError` if `texts` is empty, since the dimension of the index would be unknown.
+        """
+        if not texts:
+            raise ValueError(
+                "Cannot build an index from no texts; create one with `VectorIndex(dim=...)`"
+            )
+        vectors = embed(texts, **kwargs)
+        index = cls(dim=vectors.shape[1], capacity=len(texts))
+        index.add(vectors, ids=texts)
+        return index
+
+    def save(self, path: str) -> None:
+        """
+        Saves the index to `{path}.npy` and its ids to `{path}.ids.json`.
+        """
+        import numpy as np
+
+        np.save(f"{path}.npy", self.vectors)
+        with open(f"{path}.ids.json", "w") as f:
+            json.dump(self.ids, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "VectorIndex":
+        """
+        Loads an index saved with `save`, memory-mapping the vectors unless `mmap` is `False`.
+        """
+        import numpy as np
+
+        matrix = np.load(f"{path}.npy", mmap_mode="r" if mmap else None)
+        with open(f"{path}.ids.json") as f:
+            ids = json.load(f)
+        index = cls(dim=matrix.shape[1], capacity=0)
+        index._matrix, index.ids = matrix, ids
+        return index
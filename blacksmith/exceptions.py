@@ -0,0 +1,42 @@
+class BlacksmithError(Exception):
+    """
+    Base class for errors raised by blacksmith.
+    """
+
+
+class ToolTimeoutError(BlacksmithError, TimeoutError):
+    """
+    Raised when a tool call takes longer than its timeout.
+    """
+
+    def __init__(self, tool: str, timeout: float) -> None:
+        super().__init__(f"{tool} timed out after {timeout}s")
+        self.tool = tool
+        self.timeout = timeout
+
+
+class CompletionError(BlacksmithError):
+    """
+    Raised when a completion request fails.
+
+    Attributes:
+        attempts (int): The number of attempts made.
+        last_error (Exception): The error raised by the last attempt.
+    """
+
+    def __init__(self, message: str, attempts: int, last_error: Exception) -> None:
+        super().__init__(f"{message} after {attempts} attempt(s): {last_error!r}")
+        self.attempts = attempts
+        self.last_error = last_error
+
+
+class RetriesExhaustedError(CompletionError):
+    """
+    Raised when a completion request still fails after the maximum number of attempts.
+    """
+
+
+class DeadlineExceededError(CompletionError, TimeoutError):
+    """
+    Raised when a completion request does not succeed before its deadline.
+    """
@@ -0,0 +1,203 @@
+from collections.abc import MutableSequence
+from typing import Any, Iterable, Iterator, Optional
+from pydantic import BaseModel
+from pydantic_core import core_schema
+from blacksmith.config.constants import ChatRoles
+
+
+class ContextWindow(BaseModel, defer_build=True):
+    """
+    A token budget for the message history of a `Conversation`.
+
+    Before each request, the oldest messages are left out of the request until the rest fit in
+    `max_tokens - reserve_tokens`. The conversation itself keeps every message, so saving it stays
+    append-only. Token counts are computed once per message and kept as a running total, so checking the
+    budget does not re-tokenize the history. The latest message is never left out.
+
+    Attributes:
+        max_tokens (int): The context window of the model.
+        reserve_tokens (int): Tokens kept free for function definitions and the completion. Defaults to 0.
+        keep_system (bool): Never drop system messages. Defaults to `True`.
+        keep_observations (bool): Never drop function call observations. Defaults to `False`.
+
+    Usage:
+    ```
+        c = Conversation(window=ContextWindow(max_tokens=4096, reserve_tokens=512))
+    ```
+    """
+
+    max_tokens: int
+    reserve_tokens: int = 0
+    keep_system: bool = True
+    keep_observations: bool = False
+
+    @property
+    def budget(self) -> int:
+        return self.max_tokens - self.reserve_tokens
+
+    def _keep(self, message) -> bool:
+        if self.keep_system and message.role == ChatRoles.SYSTEM:
+            return True
+        return self.keep_observations and message.is_observation()
+
+    def trim(self, messages: list, total: int, model: str) -> int:
+        """
+        Drops messages in place until `total` fits the budget, and returns the new total.
+        """
+        i = 0
+        while total > self.budget and i < len(messages) - 1:
+            if self._keep(messages[i]):
+                i += 1
+                continue
+            total -= messages.pop(i).count_tokens(model)
+        return total
+
+
+class _Segment:
+    """
+    A run of messages shared by the forks of a conversation, following the segment it extends.
+    """
+
+    __slots__ = ("parent", "messages", "start", "end")
+
+    def __init__(self, parent: Optional["_Segment"], messages: tuple) -> None:
+        self.parent = parent
+        self.messages = messages
+        self.start = parent.end if parent is not None else 0
+        self.end = self.start + len(messages)
+
+
+class MessageHistory(MutableSequence):
+    """
+    The message history of a `Conversation`, shared with its forks.
+
+    A history is a chain of immutable segments shared with other forks, followed by a tail of its own.
+    `fork` moves the tail into a new shared segment, so it costs the messages added since the last fork
+    rather than the whole history. Appending only touches the tail. Editing a shared message first copies
+    the history, so forks never see each other's edits.
+
+    Usage:
+    ```
+        history = MessageHistory([ChatMessage(role=ChatRoles.USER, content="Hi")])
+        branch = history.fork()
+        branch.append(ChatMessage(role=ChatRoles.ASSISTANT, content="Hello!"))
+    ```
+    """
+
+    def __init__(self, messages: Iterable = ()) -> None:
+        self._shared: Optional[_Segment] = None
+        self._tail: list = list(messages)
+
+    def fork(self) -> "MessageHistory":
+        """
+        Returns a copy of the history that shares its messages.
+        """
+        if self._tail:
+            self._shared, self._tail = _Segment(self._shared, tuple(self._tail)), []
+        fork = MessageHistory()
+        fork._shared = self._shared
+        return fork
+
+    @property
+    def _offset(self) -> int:
+        return self._shared.end if self._shared is not None else 0
+
+    def _segments(self) -> list[tuple]:
+        segments, segment = [], self._shared
+        while segment is not None:
+            segments.append(segment.messages)
+            segment = segment.parent
+        segments.reverse()
+        return segments
+
+    def _own(self) -> None:
+        # Copies the shared messages before they are edited
+        if self._shared is not None:
+            self._shared, self._tail = None, list(self)
+
+    def __len__(self) -> int:
+        return self._offset + len(self._tail)
+
+    def __iter__(self) -> Iterator:
+        for messages in self._segments():
+            yield from messages
+        yield from self._tail
+
+    def __getitem__(self, index: int | slice) -> Any:
+        offset = self._offset
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            # Slices of the tail, like the messages added since the last request, skip the shared segments
+            if step == 1 and start >= offset:
+                return self._tail[start - offset : max(stop - offset, 0)]
+            return list(self)[index]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        if index >= offset:
+            return self._tail[index - offset]
+        segment = self._shared
+        while index < segment.start:
+            segment = segment.parent
+        return segment.messages[index - segment.start]
+
+    def _tail_index(self, index: int | slice) -> Optional[int]:
+        # The position in the tail of a message index, or None for shared messages and slices
+        if not isinstance(index, int):
+            return None
+        if index < 0:
+            index += len(self)
+        index -= self._offset
+        return index if 0 <= index < len(self._tail) else None
+
+    def __setitem__(self, index: int | slice, value: Any) -> None:
+        position = self._tail_index(index)
+        if position is None:
+            self._own()
+            position = index
+        self._tail[position] = value
+
+    def __delitem__(self, index: int | slice) -> None:
+        position = self._tail_index(index)
+        if position is None:
+            self._own()
+            position = index
+        del self._tail[position]
+
+    def insert(self, index: int, value: Any) -> None:
+        if index >= len(self):
+            self._tail.append(value)
+            return
+        self._own()
+        self._tail.insert(index, value)
+
+    def append(self, value: Any) -> None:
+        self._tail.append(value)
+
+    def extend(self, values: Iterable) -> None:
+        self._tail.extend(values)
+
+    def clear(self) -> None:
+        self._shared, self._tail = None, []
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (MessageHistory, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"MessageHistory({list(self)!r})"
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: Any, handler: Any) -> core_schema.CoreSchema:
+        # Validated as is, and serialized as a list of messages
+        return core_schema.is_instance_schema(
+            cls,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                list, return_schema=core_schema.list_schema()
+            ),
+        )
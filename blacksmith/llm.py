@@ -1,13 +1,53 @@
-import openai
+import copy
 import json
-from typing import Optional, List, Any
+import asyncio
+import contextvars
+import inspect
+import logging
+import time
+import uuid
+from collections import deque
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import TYPE_CHECKING, Optional, List, Any, AsyncIterator, Iterable, Iterator
 from blacksmith.config.constants import ChatRoles
-from blacksmith.config.prompts import DEFAULT_OBSERVATION
-from blacksmith.config.constants import TYPE_MAPPINGS
-from blacksmith.config.environment import IS_USING_CONTEXT
+from blacksmith.config.prompts import (
+    DEFAULT_ERROR_OBSERVATION,
+    DEFAULT_OBSERVATION,
+    DEFAULT_PACKED_PROMPT,
+)
+from blacksmith.config.constants import (
+    PACKED_ITEM_OVERHEAD,
+    PACKED_MAX_BATCH_SIZE,
+    PACKED_MAX_BATCH_TOKENS,
+    TYPE_MAPPINGS,
+)
 from blacksmith.context import Config
-from blacksmith.tools import use_tool, get_tools
-from pydantic import BaseModel
+from blacksmith.bias import CompiledBias, compile_bias
+from blacksmith import metrics
+from blacksmith.cache import request_key
+from blacksmith.history import ContextWindow, MessageHistory
+from blacksmith.store import ConversationStore
+from blacksmith.exceptions import CompletionError, ToolTimeoutError
+from blacksmith.tools import get_registry, use_tool, ause_tool, get_tools, aget_tools
+from blacksmith.utils.session import get_aiosession
+from blacksmith.utils.tokenizer import (
+    count_tokens,
+    get_encoder,
+    TOKENS_PER_MESSAGE,
+    TOKENS_PER_REPLY,
+)
+from pydantic import BaseModel, Field, PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+# openai takes a while to import, so it is only imported once a request is sent
+if TYPE_CHECKING:
+    from openai.openai_object import OpenAIObject
+
+
+def _credentials(config: Config) -> dict:
+    return {"api_key": config.api_key} if config.api_key is not None else {}
 
 
 # Code from https://github.com/jxnl/instructor
@@ -21,11 +61,19 @@ def _remove_a_key(d, remove_key) -> None:
                 _remove_a_key(d[key], remove_key)
 
 
-class Schema(BaseModel):
+# Function definitions are built once per `Schema` class, and callers get their own copy to modify
+_schema_cache: dict[type, dict] = {}
+
+
+class Schema(BaseModel, defer_build=True):
     # Code from https://github.com/jxnl/instructor
     @classmethod
     @property
     def schema(cls):
+        cached = _schema_cache.get(cls)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
         schema = cls.model_json_schema()
         parameters = {k: v for k, v in schema.items() if k not in ("title", "description")}
         parameters["required"] = sorted(
@@ -35,11 +83,12 @@ class Schema(BaseModel):
         _remove_a_key(parameters, "additionalProperties")
         _remove_a_key(parameters, "title")
 
-        return {
+        _schema_cache[cls] = {
             "name": schema["title"],
             "description": "Complete the function call with the choices given.",
             "parameters": parameters,
         }
+        return copy.deepcopy(_schema_cache[cls])
 
 
 class Choice(Schema):
@@ -64,27 +113,50 @@ class Choice(Schema):
     # We over-ride the `schema()` method from the parent class
     # Unfortunately, this needs to be an instance method as the option type is not known until object instantiation
     def schema(cls):
-        model = cls.model_dump()
-        option_type = TYPE_MAPPINGS[type(model["options"][0]).__name__]
-        return {
-            "name": "Choice",
-            "description": "Complete the function call with the choices given.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "choice": {"type": option_type, "enum": [v for v in model["options"]]}
-                },
-            },
-        }
+        # Keyed on types as well, since e.g. `1 == True`
+        key = tuple((type(option), option) for option in cls.options)
+        try:
+            return copy.deepcopy(_choice_schema(key))
+        except TypeError:
+            # Unhashable options cannot be memoized
+            return _choice_schema.__wrapped__(key)
+
+
+@lru_cache(maxsize=256)
+def _choice_schema(options: tuple[tuple[type, Any], ...]) -> dict:
+    option_type = TYPE_MAPPINGS[options[0][0].__name__]
+    return {
+        "name": "Choice",
+        "description": "Complete the function call with the choices given.",
+        "parameters": {
+            "type": "object",
+            "properties": {"choice": {"type": option_type, "enum": [v for _, v in options]}},
+        },
+    }
+
+
+def _object_schema(obj: Schema) -> tuple[dict, bool]:
+    is_choice = isinstance(obj, Choice)
+    return (obj.schema() if is_choice else obj.schema), is_choice
+
+
+def _parse_generation(resp: "LLMResponse", is_choice: bool) -> dict | str:
+    # `FunctionCall.args` has already been decoded from JSON in `_send`
+    response = resp.function_call.args
+    return response if not is_choice else response["choice"]
+
 
+GENERATE_SYSTEM_PROMPT = "You are a helpful assistant who only has access to a single function."
 
-def generate_from(obj: Schema, query: str) -> dict | str:
+
+def generate_from(obj: Schema, query: str, config: Optional[Config] = None) -> dict | str:
     """
     Generates from a given `Schema` object. This can be used to perform classification tasks, or to generate JSON corresponding to a specific schema.
 
     Args:
         obj (Schema): The class to generate to.
         query (str): The query to generate from.
+        config (Optional[Config]): The configuration to use. Defaults to the default configuration.
 
     Returns:
         dict | str: The response generated by the LLM. This is a dictionary if you pass in a `Schema`, otherwise a string.
@@ -96,15 +168,501 @@ def generate_from(obj: Schema, query: str) -> dict | str:
     "San Francisco"
     ```
     """
-    is_choice = isinstance(obj, Choice)
-    object_schema = obj.schema() if is_choice else obj.schema
+    object_schema, is_choice = _object_schema(obj)
+
+    with metrics.span("generate", schema=object_schema["name"]):
+        c = Conversation(system_prompt=GENERATE_SYSTEM_PROMPT, config=config)
+        resp = c.ask(
+            query, functions=[object_schema], function_call={"name": object_schema["name"]}
+        )
+        return _parse_generation(resp, is_choice)
+
+
+async def agenerate_from(obj: Schema, query: str, config: Optional[Config] = None) -> dict | str:
+    """
+    Async version of `generate_from`.
+
+    Usage:
+    ```
+    cities = Choice(options=["San Francisco", "Los Angeles", "New York City"])
+    await agenerate_from(cities, "The Golden Gate Bridge")
+    "San Francisco"
+    ```
+    """
+    object_schema, is_choice = _object_schema(obj)
+
+    with metrics.span("generate", schema=object_schema["name"]):
+        c = AsyncConversation(system_prompt=GENERATE_SYSTEM_PROMPT, config=config)
+        resp = await c.ask(
+            query, functions=[object_schema], function_call={"name": object_schema["name"]}
+        )
+        return _parse_generation(resp, is_choice)
+
+
+class GenerationResult(BaseModel, defer_build=True):
+    """
+    A class representing the outcome of a single query passed to `generate_many`.
+
+    Attributes:
+        index (int): The position of the query in the input.
+        query (str): The query that was generated from.
+        result (Any): The generated value. `None` if the generation failed.
+        error (Optional[Exception]): The exception raised while generating, if any.
+
+    Methods:
+        ok() -> bool: Returns true if the generation succeeded.
+    """
+
+    index: int
+    query: str
+    result: Any = None
+    error: Optional[Exception] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def ok(self) -> bool:
+        """
+        Returns true if the generation succeeded.
+        """
+        return self.error is None
+
+
+def _generate(
+    object_schema: dict, is_choice: bool, config: Optional[Config], index: int, query: str
+) -> GenerationResult:
+    with metrics.span("generate", schema=object_schema["name"]) as span:
+        try:
+            c = Conversation(system_prompt=GENERATE_SYSTEM_PROMPT, config=config)
+            functions = c._prepare(prompt=query, functions=[object_schema], role=ChatRoles.USER)
+            resp = c._send(functions=functions, function_call={"name": object_schema["name"]})
+            result = _parse_generation(resp, is_choice)
+            return GenerationResult(index=index, query=query, result=result)
+        except Exception as e:
+            span.set_error(e)
+            return GenerationResult(index=index, query=query, error=e)
+
+
+async def _agenerate(
+    object_schema: dict, is_choice: bool, config: Optional[Config], index: int, query: str
+) -> GenerationResult:
+    with metrics.span("generate", schema=object_schema["name"]) as span:
+        try:
+            c = AsyncConversation(system_prompt=GENERATE_SYSTEM_PROMPT, config=config)
+            functions = c._prepare(prompt=query, functions=[object_schema], role=ChatRoles.USER)
+            resp = await c._asend(
+                functions=functions, function_call={"name": object_schema["name"]}
+            )
+            result = _parse_generation(resp, is_choice)
+            return GenerationResult(index=index, query=query, result=result)
+        except Exception as e:
+            span.set_error(e)
+            return GenerationResult(index=index, query=query, error=e)
+
+
+def _in_order(results: Iterator[GenerationResult]) -> Iterator[GenerationResult]:
+    # Buffer results that complete early until every result before them has been yielded
+    buffered, next_index = {}, 0
+    for result in results:
+        buffered[result.index] = result
+        while next_index in buffered:
+            yield buffered.pop(next_index)
+            next_index += 1
+
+
+def generate_many(
+    obj: Schema,
+    queries: Iterable[str],
+    max_concurrency: int = 8,
+    ordered: bool = False,
+    config: Optional[Config] = None,
+) -> Iterator[GenerationResult]:
+    """
+    Runs `generate_from` over many queries on a thread pool, yielding results as they complete.
+
+    The schema is computed once for the whole batch, and `queries` is consumed lazily so that at most
+    `max_concurrency` requests are in flight. Failures are reported per item on the `GenerationResult`
+    instead of stopping the batch.
 
-    c = Conversation(
-        system_prompt="You are a helpful assistant who only has access to a single function."
+    Args:
+        obj (Schema): The class to generate to.
+        queries (Iterable[str]): The queries to generate from.
+        max_concurrency (int, optional): The maximum number of concurrent requests. Defaults to 8.
+        ordered (bool, optional): Yield results in input order instead of completion order. Defaults to `False`.
+        config (Optional[Config]): The configuration to use. Defaults to the default configuration.
+
+    Returns:
+        Iterator[GenerationResult]: The results, one per query.
+
+    Usage:
+    ```
+    cities = Choice(options=["San Francisco", "Los Angeles", "New York City"])
+    for r in generate_many(cities, ["The Golden Gate Bridge", "Hollywood"], max_concurrency=32):
+        print(r.query, r.result if r.ok() else r.error)
+    ```
+    """
+    object_schema, is_choice = _object_schema(obj)
+    jobs = (
+        (_generate, object_schema, is_choice, config, index, query)
+        for index, query in enumerate(queries)
     )
-    resp = c.ask(query, functions=[object_schema], function_call={"name": object_schema["name"]})
-    response = json.loads(resp.function_call.args)
-    return response if not is_choice else response["choice"]
+    results = _run_threaded(jobs, max_concurrency)
+    return _in_order(results) if ordered else results
+
+
+def _run_threaded(
+    jobs: Iterable[tuple], max_concurrency: int, retries: Optional[deque] = None
+) -> Iterator[Any]:
+    # Runs `func(*args)` for each job on a thread pool, yielding results as they complete.
+    # `jobs` is consumed lazily so that at most `max_concurrency` jobs are in flight. Jobs added to
+    # `retries` while results are consumed run first, within the same limit.
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    pending = set()
+    jobs, retries = iter(jobs), retries if retries is not None else deque()
+    try:
+        while True:
+            while len(pending) < max_concurrency:
+                job = retries.popleft() if retries else next(jobs, None)
+                if job is None:
+                    break
+                func, *args = job
+                # Run in a copy of the caller's context, so workers see its `model()` block
+                context = contextvars.copy_context()
+                pending.add(executor.submit(context.run, func, *args))
+            if not pending:
+                return
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def agenerate_many(
+    obj: Schema,
+    queries: Iterable[str],
+    max_concurrency: int = 64,
+    ordered: bool = False,
+    config: Optional[Config] = None,
+) -> AsyncIterator[GenerationResult]:
+    """
+    Async version of `generate_many`, running up to `max_concurrency` requests on the event loop.
+
+    Usage:
+    ```
+    async for r in agenerate_many(cities, queries, max_concurrency=256):
+        print(r.query, r.result)
+    ```
+    """
+    object_schema, is_choice = _object_schema(obj)
+    coros = (
+        _agenerate(object_schema, is_choice, config, index, query)
+        for index, query in enumerate(queries)
+    )
+    results = _arun_concurrently(coros, max_concurrency)
+    async for result in _ain_order(results) if ordered else results:
+        yield result
+
+
+async def _arun_concurrently(
+    coros: Iterable, max_concurrency: int, retries: Optional[deque] = None
+) -> AsyncIterator[Any]:
+    # Runs coroutines with at most `max_concurrency` in flight, yielding results as they complete.
+    # Coroutine functions added to `retries` while results are consumed run first, within the same limit.
+    pending = set()
+    coros, retries = iter(coros), retries if retries is not None else deque()
+    try:
+        while True:
+            while len(pending) < max_concurrency:
+                coro = retries.popleft()() if retries else next(coros, None)
+                if coro is None:
+                    break
+                pending.add(asyncio.ensure_future(coro))
+            if not pending:
+                return
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _ain_order(results: AsyncIterator[GenerationResult]) -> AsyncIterator[GenerationResult]:
+    buffered, next_index = {}, 0
+    async for result in results:
+        buffered[result.index] = result
+        while next_index in buffered:
+            yield buffered.pop(next_index)
+            next_index += 1
+
+
+def _packed_schema(object_schema: dict) -> dict:
+    # An array of results, each holding the fields of `object_schema` plus the id of its item
+    parameters = object_schema["parameters"]
+    return {
+        "name": f"{object_schema['name']}Batch",
+        "description": "Complete the function call with one result for each item.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"id": {"type": "integer"}, **parameters["properties"]},
+                        "required": ["id", *parameters.get("required", [])],
+                    },
+                }
+            },
+            "required": ["results"],
+        },
+    }
+
+
+def _result_tokens(obj: Schema, object_schema: dict, model: str) -> int:
+    # Estimated completion tokens for one result: the longest option for a `Choice`,
+    # or about the size of the schema's properties otherwise
+    if isinstance(obj, Choice):
+        return max(count_tokens(model, json.dumps(option)) for option in obj.options)
+    return count_tokens(model, json.dumps(object_schema["parameters"]["properties"])) // 2
+
+
+def _pack(
+    queries: Iterable[str], model: str, max_tokens: int, max_size: int, per_item: int
+) -> Iterator[list[tuple[int, str]]]:
+    batch, tokens = [], 0
+    for index, query in enumerate(queries):
+        cost = count_tokens(model, query) + per_item
+        if batch and (tokens + cost > max_tokens or len(batch) >= max_size):
+            yield batch
+            batch, tokens = [], 0
+        batch.append((index, query))
+        tokens += cost
+    if batch:
+        yield batch
+
+
+def _unpack(obj: Schema, args: Any, size: int) -> dict[int, Any]:
+    # Maps item ids to valid results, dropping anything skipped, duplicated or malformed
+    results, seen = {}, set()
+    items = args.get("results") if isinstance(args, dict) else None
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict) or not isinstance(item.get("id"), int):
+            continue
+        position = item.pop("id")
+        if not 0 <= position < size or position in seen:
+            results.pop(position, None)
+            continue
+        seen.add(position)
+        if isinstance(obj, Choice):
+            if item.get("choice") in obj.options:
+                results[position] = item["choice"]
+            continue
+        try:
+            (obj if isinstance(obj, type) else type(obj)).model_validate(item)
+        except ValueError:
+            continue
+        results[position] = item
+    return results
+
+
+def _batch_prompt(batch: list[tuple[int, str]]) -> str:
+    items = "\n".join(
+        json.dumps({"id": position, "item": query}) for position, (_, query) in enumerate(batch)
+    )
+    return DEFAULT_PACKED_PROMPT.format(items=items)
+
+
+# The results of a packed batch, and the items to retry on their own
+BatchOutcome = tuple[list[GenerationResult], list[tuple[int, str]]]
+
+
+def _batch_outcome(
+    batch: list[tuple[int, str]], results: dict[int, Any], error: Optional[Exception]
+) -> BatchOutcome:
+    # A failed request fails every item, otherwise the items the model skipped or mangled are retried
+    if error is not None:
+        return [
+            GenerationResult(index=index, query=query, error=error) for index, query in batch
+        ], []
+    done, retry = [], []
+    for position, (index, query) in enumerate(batch):
+        if position in results:
+            done.append(GenerationResult(index=index, query=query, result=results[position]))
+        else:
+            retry.append((index, query))
+    return done, retry
+
+
+def _generate_batch(
+    obj: Schema,
+    packed_schema: dict,
+    config: Optional[Config],
+    batch: list[tuple[int, str]],
+) -> BatchOutcome:
+    with metrics.span("generate", schema=packed_schema["name"]) as span:
+        span.set_attribute("items", len(batch))
+        results, error = {}, None
+        try:
+            c = Conversation(system_prompt=GENERATE_SYSTEM_PROMPT, config=config)
+            functions = c._prepare(
+                prompt=_batch_prompt(batch), functions=[packed_schema], role=ChatRoles.USER
+            )
+            resp = c._send(functions=functions, function_call={"name": packed_schema["name"]})
+            args = resp.function_call.args if resp.function_call is not None else None
+            results = _unpack(obj, args, len(batch))
+        except CompletionError as e:
+            span.set_error(e)
+            error = e
+        except ValueError as e:
+            # A malformed completion, e.g. arguments that are not a JSON object
+            logger.debug("Retrying the items of a malformed %s: %r", packed_schema["name"], e)
+        except Exception as e:
+            logger.exception("Generating a %s failed", packed_schema["name"])
+            span.set_error(e)
+            error = e
+    return _batch_outcome(batch, results, error)
+
+
+async def _agenerate_batch(
+    obj: Schema,
+    packed_schema: dict,
+    config: Optional[Config],
+    batch: list[tuple[int, str]],
+) -> BatchOutcome:
+    with metrics.span("generate", schema=packed_schema["name"]) as span:
+        span.set_attribute("items", len(batch))
+        results, error = {}, None
+        try:
+            c = AsyncConversation(system_prompt=GENERATE_SYSTEM_PROMPT, config=config)
+            functions = c._prepare(
+                prompt=_batch_prompt(batch), functions=[packed_schema], role=ChatRoles.USER
+            )
+            resp = await c._asend(
+                functions=functions, function_call={"name": packed_schema["name"]}
+            )
+            args = resp.function_call.args if resp.function_call is not None else None
+            results = _unpack(obj, args, len(batch))
+        except CompletionError as e:
+            span.set_error(e)
+            error = e
+        except ValueError as e:
+            logger.debug("Retrying the items of a malformed %s: %r", packed_schema["name"], e)
+        except Exception as e:
+            logger.exception("Generating a %s failed", packed_schema["name"])
+            span.set_error(e)
+            error = e
+    return _batch_outcome(batch, results, error)
+
+
+def _packed_batches(
+    obj: Schema,
+    queries: Iterable[str],
+    config: Optional[Config],
+    max_batch_tokens: int,
+    max_batch_size: int,
+) -> tuple[dict, dict, bool, Iterator[list[tuple[int, str]]]]:
+    object_schema, is_choice = _object_schema(obj)
+    model = (config or Config().load()).resolve().model
+    per_item = PACKED_ITEM_OVERHEAD + _result_tokens(obj, object_schema, model)
+    batches = _pack(queries, model, max_batch_tokens, max_batch_size, per_item)
+    return object_schema, _packed_schema(object_schema), is_choice, batches
+
+
+def generate_packed(
+    obj: Schema,
+    queries: Iterable[str],
+    max_batch_tokens: int = PACKED_MAX_BATCH_TOKENS,
+    max_batch_size: int = PACKED_MAX_BATCH_SIZE,
+    max_concurrency: int = 8,
+    ordered: bool = False,
+    config: Optional[Config] = None,
+) -> Iterator[GenerationResult]:
+    """
+    Like `generate_many`, but packs many queries into each request.
+
+    Queries are grouped into batches that fit `max_batch_tokens`, counting each query and its estimated
+    result, and each batch is generated in a single completion against an array version of the schema.
+    Results are validated and mapped back to their queries. Queries the model skipped or answered with an
+    invalid result are retried individually, within the same `max_concurrency`.
+
+    Args:
+        obj (Schema): The class to generate to.
+        queries (Iterable[str]): The queries to generate from.
+        max_batch_tokens (int, optional): The token budget of a batch. Defaults to `PACKED_MAX_BATCH_TOKENS`.
+        max_batch_size (int, optional): The maximum number of queries in a batch. Defaults to `PACKED_MAX_BATCH_SIZE`.
+        max_concurrency (int, optional): The maximum number of concurrent batches. Defaults to 8.
+        ordered (bool, optional): Yield results in input order instead of completion order. Defaults to `False`.
+        config (Optional[Config]): The configuration to use. Defaults to the default configuration.
+
+    Returns:
+        Iterator[GenerationResult]: The results, one per query.
+
+    Usage:
+    ```
+    cities = Choice(options=["San Francisco", "Los Angeles", "New York City"])
+    for r in generate_packed(cities, landmarks, max_batch_tokens=4000):
+        print(r.query, r.result if r.ok() else r.error)
+    ```
+    """
+    object_schema, packed_schema, is_choice, batches = _packed_batches(
+        obj, queries, config, max_batch_tokens, max_batch_size
+    )
+    jobs = ((_generate_batch, obj, packed_schema, config, batch) for batch in batches)
+    # Items to retry on their own run on the same pool as the batches
+    retries = deque()
+
+    def results() -> Iterator[GenerationResult]:
+        for outcome in _run_threaded(jobs, max_concurrency, retries):
+            if isinstance(outcome, GenerationResult):
+                yield outcome
+                continue
+            done, retry = outcome
+            retries.extend(
+                (_generate, object_schema, is_choice, config, index, query)
+                for index, query in retry
+            )
+            yield from done
+
+    return _in_order(results()) if ordered else results()
+
+
+async def agenerate_packed(
+    obj: Schema,
+    queries: Iterable[str],
+    max_batch_tokens: int = PACKED_MAX_BATCH_TOKENS,
+    max_batch_size: int = PACKED_MAX_BATCH_SIZE,
+    max_concurrency: int = 64,
+    ordered: bool = False,
+    config: Optional[Config] = None,
+) -> AsyncIterator[GenerationResult]:
+    """
+    Async version of `generate_packed`.
+    """
+    object_schema, packed_schema, is_choice, batches = _packed_batches(
+        obj, queries, config, max_batch_tokens, max_batch_size
+    )
+    coros = (_agenerate_batch(obj, packed_schema, config, batch) for batch in batches)
+    retries = deque()
+
+    async def results() -> AsyncIterator[GenerationResult]:
+        async for outcome in _arun_concurrently(coros, max_concurrency, retries):
+            if isinstance(outcome, GenerationResult):
+                yield outcome
+                continue
+            done, retry = outcome
+            retries.extend(
+                partial(_agenerate, object_schema, is_choice, config, index, query)
+                for index, query in retry
+            )
+            for result in done:
+                yield result
+
+    async for result in _ain_order(results()) if ordered else results():
+        yield result
 
 
 class ChatMessage(BaseModel):
@@ -115,22 +673,83 @@ class ChatMessage(BaseModel):
         role (`ChatRoles`): The author of the message (system, assistant, or user.)
         content (str): The content of the message.
 
+    Messages are immutable, so that their payload and token count can be cached. Assigning to a field raises
+    a `ValidationError`; replace the message in the history instead.
+
     Usage:
     ```
     c = Conversation()
     message = ChatMessage(role=ChatRoles.USER, content="Hey, how are you?")
     c.add_message(message)
+    c.messages[-1] = message.model_copy(update={"content": "Hey, what's new?"})
     ```
     """
 
     role: ChatRoles
     content: str
 
+    # (encoding name, token count), computed once per message
+    _tokens: Optional[tuple[str, int]] = PrivateAttr(default=None)
+    _observation: bool = PrivateAttr(default=False)
+    # The message as sent to the API, built once per message
+    _payload: Optional[dict] = PrivateAttr(default=None)
+
     class Config:
         use_enum_values = True
+        # Messages are immutable, so their token count and payload can be cached
+        frozen = True
+        defer_build = True
+
+    def count_tokens(self, model: str) -> int:
+        """
+        Returns the number of prompt tokens this message uses with `model`. The count is cached.
+        """
+        encoder = get_encoder(model)
+        if self._tokens is None or self._tokens[0] != encoder.name:
+            self._tokens = (encoder.name, TOKENS_PER_MESSAGE + len(encoder.encode(self.content)))
+        return self._tokens[1]
+
+    def model_copy(self, *, update: Optional[dict] = None, deep: bool = False) -> "ChatMessage":
+        copy = super().model_copy(update=update, deep=deep)
+        if update:
+            # The cached payload and token count describe the original fields
+            copy._tokens = copy._payload = None
+        return copy
+
+    def is_observation(self) -> bool:
+        """
+        Returns true if the message is an observation of a function call result.
+        """
+        return self._observation
 
+    def to_payload(self) -> dict:
+        """
+        Returns the message as sent to the API. The dict is built once and shared by every request.
+        """
+        if self._payload is None:
+            self._payload = {"role": self.role, "content": self.content}
+        return self._payload
+
+    def to_record(self) -> dict:
+        """
+        Returns the message as kept by a `ConversationStore`.
+        """
+        return (
+            {**self.to_payload(), "observation": True} if self._observation else self.to_payload()
+        )
 
-class FunctionCall(BaseModel):
+    @classmethod
+    def from_record(cls, record: dict) -> "ChatMessage":
+        """
+        Rebuilds a message saved with `to_record`, without validating it again.
+        """
+        message = cls.model_construct(role=record["role"], content=record["content"])
+        message._payload = {"role": record["role"], "content": record["content"]}
+        message._observation = record.get("observation", False)
+        return message
+
+
+class FunctionCall(BaseModel, defer_build=True):
     """
     A class representing a function call generated from a LLM call using `Conversation.ask`.
 
@@ -160,18 +779,63 @@ class FunctionCall(BaseModel):
         json = self.model_dump_json(indent=4)
         print(json)
 
-    def execute(self, debug: bool = False):
+    def execute(self, debug: bool = False) -> "FunctionCallResult":
         """
         Execute the function call generated by the language model and return the resulting value.
+        If the tool raises or times out, the error is returned on `FunctionCallResult.error`.
+        """
+        if debug:
+            print(f"Calling {self.tool} with {self.args}", flush=True)
+        try:
+            with metrics.span("tool", tool=self.tool):
+                tool_result = use_tool(tool_name=self.tool, args=self.args)
+        except Exception as e:
+            return self._failed(e, debug=debug)
+        if debug:
+            print("Result of function call:", tool_result, flush=True)
+        return FunctionCallResult(tool=self.tool, args=self.args, result=tool_result)
+
+    async def aexecute(self, debug: bool = False) -> "FunctionCallResult":
         """
+        Async version of `execute`. Synchronous tools run on a thread pool, so the event loop is not blocked.
+        """
+        if debug:
+            print(f"Calling {self.tool} with {self.args}", flush=True)
         try:
-            tool_result = use_tool(tool_name=self.tool, args=self.args)
-            if debug:
-                print(f"Calling {self.tool} with {self.args}", flush=True)
-                print("Result of function call:", tool_result, flush=True)
-            return FunctionCallResult(tool=self.tool, args=self.args, result=tool_result)
+            with metrics.span("tool", tool=self.tool):
+                tool_result = await ause_tool(tool_name=self.tool, args=self.args)
         except Exception as e:
+            return self._failed(e, debug=debug)
+        if debug:
+            print("Result of function call:", tool_result, flush=True)
+        return FunctionCallResult(tool=self.tool, args=self.args, result=tool_result)
+
+    def _failed(self, e: Exception, debug: bool = False) -> "FunctionCallResult":
+        if debug:
             print(f"Error executing {self.tool}: {e}", flush=True)
+        metrics.inc("blacksmith_tool_errors_total", tool=self.tool, error=type(e).__name__)
+        return FunctionCallResult(
+            tool=self.tool,
+            args=self.args,
+            error=ToolError(
+                type=type(e).__name__, message=str(e), timed_out=isinstance(e, ToolTimeoutError)
+            ),
+        )
+
+
+class ToolError(BaseModel, defer_build=True):
+    """
+    A class representing a failed tool call.
+
+    Attributes:
+        type (str): The name of the exception raised by the tool.
+        message (str): The exception message.
+        timed_out (bool): Whether the call was abandoned after the tool's timeout.
+    """
+
+    type: str
+    message: str
+    timed_out: bool = False
 
 
 class FunctionCallResult(FunctionCall):
@@ -182,9 +846,11 @@ class FunctionCallResult(FunctionCall):
 
     Attributes:
         result (Any): The result of the function call.
+        error (Optional[ToolError]): The error raised by the tool, if the call failed.
 
     Methods:
         generate_observation(observation_prompt: str) -> ChatMessage: Generates a ChatMessage as an observation of the result of tool usage.
+        ok() -> bool: Returns true if the call succeeded.
 
     Usage:
     ```
@@ -197,19 +863,53 @@ class FunctionCallResult(FunctionCall):
     """
 
     result: Any = None
+    error: Optional[ToolError] = None
+
+    def ok(self) -> bool:
+        """
+        Returns true if the call succeeded.
+        """
+        return self.error is None
 
     def generate_observation(self, observation_prompt: str = DEFAULT_OBSERVATION) -> ChatMessage:
         """
         Generates a ChatMessage as an observation of the result of tool usage.
         You can override the default observation prompt by passing in an observation_prompt parameter.
+        Failed calls use `DEFAULT_ERROR_OBSERVATION`.
         """
-        return ChatMessage(
-            role=ChatRoles.USER,
-            content=observation_prompt.format(result=self.result, tool=self.tool, args=self.args),
-        )
+        if self.error is not None:
+            content = DEFAULT_ERROR_OBSERVATION.format(
+                error=f"{self.error.type}: {self.error.message}", tool=self.tool, args=self.args
+            )
+        else:
+            content = observation_prompt.format(result=self.result, tool=self.tool, args=self.args)
+        message = ChatMessage(role=ChatRoles.USER, content=content)
+        message._observation = True
+        return message
+
+
+def execute_all(calls: list[FunctionCall], debug: bool = False) -> list[FunctionCallResult]:
+    """
+    Executes several independent function calls concurrently and returns their results in order.
+    Tools running on the tool loop must use `aexecute_all` instead, since this raises `RuntimeError` there.
+
+    Usage:
+    ```
+        results = execute_all([resp.function_call for resp in responses])
+        final_answer = c.continue_from_results(results, stop=True)
+    ```
+    """
+    return get_registry().executor.submit(aexecute_all(calls, debug=debug)).result()
+
+
+async def aexecute_all(calls: list[FunctionCall], debug: bool = False) -> list[FunctionCallResult]:
+    """
+    Async version of `execute_all`.
+    """
+    return list(await asyncio.gather(*(call.aexecute(debug=debug) for call in calls)))
 
 
-class LLMResponse(BaseModel):
+class LLMResponse(BaseModel, defer_build=True):
     """
     Class representing a response from a completion.
     Returned from `Conversation.ask`.
@@ -217,6 +917,7 @@ class LLMResponse(BaseModel):
     Attributes:
         content (str | None): The content of the response. `None` if there is a pending function call.
         function_call (Optional[FunctionCall]): The function call object, if the model wants to perform a function call. Defaults to `None`.
+        usage (Optional[dict]): The token usage reported for the completion. `None` for streamed completions.
 
     Methods:
         execute_function_call() -> `FunctionCallResult`:
@@ -234,6 +935,7 @@ class LLMResponse(BaseModel):
 
     content: str | None
     function_call: Optional[FunctionCall] = None
+    usage: Optional[dict] = None
 
     def execute_function_call(self, debug: bool = False) -> FunctionCallResult:
         """
@@ -243,6 +945,14 @@ class LLMResponse(BaseModel):
             return ValueError("Function call not found.")
         return self.function_call.execute(debug=debug)
 
+    async def aexecute_function_call(self, debug: bool = False) -> FunctionCallResult:
+        """
+        Async version of `execute_function_call`.
+        """
+        if not self.function_call:
+            return ValueError("Function call not found.")
+        return await self.function_call.aexecute(debug=debug)
+
     def has_function_call(self) -> bool:
         """
         Returns true if the `LLMResponse` object contains a function call.
@@ -250,14 +960,197 @@ class LLMResponse(BaseModel):
         return self.function_call is not None
 
 
-class Conversation(BaseModel):
+class _StreamAccumulator:
+    """
+    Assembles streamed completion chunks into a single completion.
+    """
+
+    def __init__(self, start: float) -> None:
+        self.start = start
+        self.time_to_first_token: Optional[float] = None
+        self.id = None
+        self.model = None
+        self.finish_reason = None
+        self.content: list[str] = []
+        self.function_name: Optional[str] = None
+        self.arguments: list[str] = []
+
+    def add(self, chunk) -> Optional[str]:
+        """
+        Adds a chunk and returns its content delta, if any.
+        """
+        self.id = self.id or chunk.get("id")
+        self.model = self.model or chunk.get("model")
+        choice = chunk["choices"][0]
+        self.finish_reason = choice.get("finish_reason") or self.finish_reason
+        delta = choice.get("delta") or {}
+
+        content = delta.get("content")
+        fc = delta.get("function_call")
+        if (content or fc) and self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self.start
+        if fc:
+            self.function_name = fc.get("name") or self.function_name
+            self.arguments.append(fc.get("arguments") or "")
+        if content:
+            self.content.append(content)
+        return content
+
+    def completion(self) -> "OpenAIObject":
+        from openai.openai_object import OpenAIObject
+
+        message = {"role": ChatRoles.ASSISTANT.value, "content": "".join(self.content) or None}
+        if self.function_name:
+            message["function_call"] = {
+                "name": self.function_name,
+                "arguments": "".join(self.arguments),
+            }
+        return OpenAIObject.construct_from(
+            {
+                "id": self.id,
+                "object": "chat.completion",
+                "model": self.model,
+                "choices": [{"index": 0, "message": message, "finish_reason": self.finish_reason}],
+            }
+        )
+
+
+class StreamingResponse:
+    """
+    Class representing a streamed response from a completion.
+    Returned from `Conversation.ask` when `stream=True`.
+
+    Iterating yields content deltas as they arrive. Once the stream is exhausted, the assistant message
+    is added to the conversation, any streamed function call is assembled into `response.function_call`,
+    and completion hooks are called with the aggregated completion. The time to first token is only kept on
+    the stream, so completions cached from a stream do not carry it.
+
+    Attributes:
+        response (LLMResponse | None): The final response. `None` until the stream is exhausted.
+        time_to_first_token (float | None): Seconds from sending the request to the first streamed token.
+
+    Usage:
+    ```
+    stream = c.ask("Tell me a story", stream=True)
+    for delta in stream:
+        print(delta, end="", flush=True)
+    print(stream.time_to_first_token)
+    ```
+    """
+
+    def __init__(
+        self,
+        conversation: "Conversation",
+        config: Config,
+        request: dict,
+        chunks,
+        functions: list[dict],
+        start: float,
+        debug: bool = False,
+        cached: bool = False,
+    ) -> None:
+        self.response: Optional[LLMResponse] = None
+        self._conversation = conversation
+        self._config = config
+        self._request = request
+        self._chunks = chunks
+        self._functions = functions
+        self._debug = debug
+        self._cached = cached
+        self._accumulator = _StreamAccumulator(start)
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        return self._accumulator.time_to_first_token
+
+    def __iter__(self) -> Iterator[str]:
+        for chunk in self._chunks:
+            delta = self._accumulator.add(chunk)
+            if delta:
+                yield delta
+        completion = self._finish()
+        if not self._cached:
+            for f in self._config.on_completion:
+                f(completion)
+
+    def _finish(self) -> "OpenAIObject":
+        completion = self._accumulator.completion()
+        if self._config.cache is not None and not self._cached:
+            self._config.cache.store(*self._cache_entry(completion))
+        return self._parse(completion)
+
+    def _cache_entry(self, completion: "OpenAIObject") -> tuple[str, dict, float]:
+        seconds = time.perf_counter() - self._accumulator.start
+        return request_key(self._request), completion.to_dict_recursive(), seconds
+
+    def _parse(self, completion: "OpenAIObject") -> "OpenAIObject":
+        self.response = self._conversation._parse_completion(
+            completion, functions=self._functions, debug=self._debug
+        )
+        return completion
+
+
+class AsyncStreamingResponse(StreamingResponse):
+    """
+    Async version of `StreamingResponse`. Returned from `AsyncConversation.ask` when `stream=True`.
+
+    Usage:
+    ```
+    stream = await c.ask("Tell me a story", stream=True)
+    async for delta in stream:
+        print(delta, end="", flush=True)
+    ```
+    """
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        async for chunk in self._chunks:
+            delta = self._accumulator.add(chunk)
+            if delta:
+                yield delta
+        completion = await self._afinish()
+        if not self._cached:
+            for f in self._config.on_completion:
+                result = f(completion)
+                if inspect.isawaitable(result):
+                    await result
+
+    async def _afinish(self) -> "OpenAIObject":
+        completion = self._accumulator.completion()
+        if self._config.cache is not None and not self._cached:
+            await self._config.cache.astore(*self._cache_entry(completion))
+        return self._parse(completion)
+
+
+def _cached_stream(completion: dict) -> Iterator[dict]:
+    # Replays a cached completion as a single streamed chunk
+    message = completion["choices"][0]["message"]
+    yield {
+        "id": completion.get("id"),
+        "model": completion.get("model"),
+        "choices": [
+            {
+                "delta": message,
+                "finish_reason": completion["choices"][0].get("finish_reason"),
+            }
+        ],
+    }
+
+
+async def _acached_stream(completion: dict) -> AsyncIterator[dict]:
+    for chunk in _cached_stream(completion):
+        yield chunk
+
+
+class Conversation(BaseModel, defer_build=True):
     """
     Class representing a conversation with a language model.
 
     Attributes:
         system_prompt (Optional[str]): The system prompt to use for the conversation. Defaults to an empty string.
-        messages (Optional[List[ChatMessage]]): A list of `ChatMessage` objects representing the conversation history. Defaults to an empty list.
+        messages (Optional[List[ChatMessage] | MessageHistory]): The `ChatMessage` objects of the conversation history, shared with forks. Defaults to an empty `MessageHistory`.
+        window (Optional[ContextWindow]): A token budget for the message history, applied before each request. Defaults to `None` (unbounded).
         config (Optional[Config]): A `Config` object containing the configuration settings for the language model. Defaults to `None`.
+        id (Optional[str]): The id the conversation is saved under in a `ConversationStore`. Assigned on the first `save` if not set.
 
     Methods:
         ask() -> `LLMResponse`:
@@ -274,7 +1167,23 @@ class Conversation(BaseModel):
 
     config: Optional[Config] = None
     system_prompt: Optional[str] = ""
-    messages: Optional[List[ChatMessage]] = []
+    messages: Optional[List[ChatMessage] | MessageHistory] = Field(default_factory=MessageHistory)
+    window: Optional[ContextWindow] = None
+    id: Optional[str] = None
+
+    # The messages sent by the last windowed request and their token total, taken from the first
+    # `_tracked` messages of `_tracked_list`
+    _window: list = PrivateAttr(default_factory=list)
+    _token_total: int = PrivateAttr(default=0)
+    _tracked: int = PrivateAttr(default=0)
+    _tracked_list: Optional[list] = PrivateAttr(default=None)
+    # Payloads of the first messages of `_payload_list`, extended as messages are appended
+    _payload: list[dict] = PrivateAttr(default_factory=list)
+    _payload_list: Optional[list] = PrivateAttr(default=None)
+    # The first `_saved` messages of `_saved_list` are in the store, ending with `_saved_last`
+    _saved: int = PrivateAttr(default=0)
+    _saved_list: Optional[list] = PrivateAttr(default=None)
+    _saved_last: Optional[ChatMessage] = PrivateAttr(default=None)
 
     def ask(
         self,
@@ -284,13 +1193,33 @@ class Conversation(BaseModel):
         use_functions: bool = True,
         role: ChatRoles = ChatRoles.USER,
         debug: bool = False,
-    ) -> LLMResponse:
+        stream: bool = False,
+    ) -> LLMResponse | StreamingResponse:
         """
         Sends a prompt plus the current message chain to the language model.
         You can change the role by passing in a ChatRoles parameter (defaults to User).
-        Returns a LLMResponse object.
+        Returns a LLMResponse object, or a StreamingResponse of content deltas if `stream` is set.
         """
+        functions = self._prepare(prompt=prompt, functions=functions, role=role)
+        if stream:
+            return self._stream(
+                functions=functions if use_functions else [],
+                function_call=function_call,
+                debug=debug,
+            )
+        return self._send(
+            functions=functions if use_functions else [], function_call=function_call, debug=debug
+        )
+
+    def _prepare(self, prompt: str, functions: list[dict], role: ChatRoles) -> list[dict]:
+        self._add_prompt(prompt=prompt, role=role)
 
+        # default to all available functions
+        if len(functions) == 0:
+            functions = get_tools()
+        return functions
+
+    def _add_prompt(self, prompt: str, role: ChatRoles) -> None:
         # init config
         # this cannot be defaulted since we need `model_post_init` to be called after the first instantiation
         if not self.config:
@@ -299,78 +1228,212 @@ class Conversation(BaseModel):
 
         # init system message
         if self.system_prompt and not self.messages:
-            self.messages = [ChatMessage(role=ChatRoles.SYSTEM, content=self.system_prompt)]
-
-        # default to all available functions
-        if len(functions) == 0:
-            functions = get_tools()
+            self.messages = MessageHistory(
+                [ChatMessage(role=ChatRoles.SYSTEM, content=self.system_prompt)]
+            )
 
         self.add_message(ChatMessage(role=role, content=prompt))
 
-        return self._send(
-            functions=functions if use_functions else [], function_call=function_call, debug=debug
+    def _resolve_config(self) -> Config:
+        return self.config.resolve()
+
+    def _build_request(
+        self, config: Config, functions: list[dict], function_call: str | dict
+    ) -> dict:
+        if self.window is None:
+            messages = self._payload_messages()
+        else:
+            messages = [message.to_payload() for message in self._fit_window(config)]
+
+        request = {
+            "model": config.model,
+            "messages": messages,
+            "temperature": config.temperature,
+        }
+        if functions:
+            request.update(functions=functions, function_call=function_call)
+        else:
+            request.update(logit_bias=config.bias)
+        return request
+
+    def _payload_messages(self) -> list[dict]:
+        messages, payload = self.messages, self._payload
+        # Start over from the cached per-message payloads if the history was replaced or any message in it
+        # edited. Messages cache their payload, so checking every message is an identity check, not a dump
+        if (
+            self._payload_list is not messages
+            or len(payload) > len(messages)
+            or any(message.to_payload() is not sent for message, sent in zip(messages, payload))
+        ):
+            self._payload_list, self._payload = messages, []
+            payload = self._payload
+
+        # Only messages added since the last request are serialized
+        for message in messages[len(payload) :]:
+            payload.append(message.to_payload())
+        # Requests keep their own list, since the history keeps growing after they are sent
+        return list(payload)
+
+    def _fit_window(self, config: Config) -> list[ChatMessage]:
+        # The history keeps every message; only the messages sent are trimmed to the window.
+        # Recount from the cached per-message counts if the history was replaced
+        if self._tracked_list is not self.messages or self._tracked > len(self.messages):
+            self._tracked_list, self._tracked, self._token_total = self.messages, 0, 0
+            self._window = []
+
+        # Only messages added since the last request are tokenized
+        for message in self.messages[self._tracked :]:
+            self._window.append(message)
+            self._token_total += message.count_tokens(config.model)
+
+        self._token_total = self.window.trim(self._window, self._token_total, config.model)
+        self._tracked = len(self.messages)
+        return self._window
+
+    def token_count(self) -> int:
+        """
+        Returns the number of prompt tokens sent from the history by the last request.
+        Only tracked when the `Conversation` has a `ContextWindow`.
+        """
+        return self._token_total
+
+    def _parse_completion(self, completion, functions: list[dict], debug=False) -> LLMResponse:
+        res = completion["choices"][0]["message"].to_dict()
+        usage = completion.get("usage")
+        usage = usage.to_dict() if usage else None
+        if not functions:
+            if res.get("content"):
+                self.add_message(ChatMessage(role=ChatRoles.ASSISTANT, content=res.get("content")))
+            return LLMResponse(content=res.get("content"), usage=usage)
+
+        if debug:
+            print(res)
+
+        fc = res.get("function_call")
+        if fc:
+            fc = fc.to_dict()
+
+        return LLMResponse(
+            content=res.get("content"),
+            function_call=FunctionCall(tool=fc.get("name"), args=json.loads(fc.get("arguments")))
+            if fc
+            else None,
+            usage=usage,
         )
 
     def _send(
         self, functions: list[dict], function_call: str | dict = "auto", debug=False
     ) -> LLMResponse:
-        try:
-            config = (
-                Config(on_completion=self.config.on_completion, bias=self.config.bias).load()
-                if IS_USING_CONTEXT()
-                else self.config
-            )
-            openai.api_key = config.api_key
+        config = self._resolve_config()
 
-            if not functions:
-                completion = openai.ChatCompletion.create(
-                    model=config.model,
-                    messages=[message.model_dump() for message in self.messages],
-                    temperature=config.temperature,
-                    logit_bias=config.bias,
+        with metrics.span("send", model=config.model) as span:
+            with metrics.span("serialize", model=config.model):
+                request = self._build_request(
+                    config, functions=functions, function_call=function_call
                 )
+            completion, fresh = self._complete(config, request)
+            span.set_attribute("cached", not fresh)
 
-                # Process after completion hooks
+            # Process after completion hooks
+            if fresh:
+                metrics.record_usage(config.model, completion.get("usage"))
                 for f in config.on_completion:
                     f(completion)
 
-                res = completion["choices"][0]["message"].to_dict()
-                if res.get("content"):
-                    self.add_message(
-                        ChatMessage(role=ChatRoles.ASSISTANT, content=res.get("content"))
-                    )
-                return LLMResponse(content=res.get("content"))
-
-            completion = openai.ChatCompletion.create(
-                model=config.model,
-                messages=[message.model_dump() for message in self.messages],
-                temperature=config.temperature,
-                functions=functions,
-                function_call=function_call,
-            )
+            with metrics.span("parse", model=config.model):
+                return self._parse_completion(completion, functions=functions, debug=debug)
 
-            # Process after completion hooks
-            for f in config.on_completion:
-                f(completion)
+    def _complete(self, config: Config, request: dict) -> tuple["OpenAIObject", bool]:
+        # Returns the completion for a request and whether it was freshly created rather than cached
+        from openai.openai_object import OpenAIObject
+
+        if config.cache is None and config.semantic_cache is None:
+            return self._create(config, request), True
 
-            res = completion["choices"][0]["message"].to_dict()
-            if debug:
-                print(res)
+        def create() -> tuple[dict, bool]:
+            # Only reached on an exact miss, so repeated requests are never embedded
+            if config.semantic_cache is None:
+                return self._create(config, request).to_dict_recursive(), True
+            return config.semantic_cache.get_or_create(
+                request, lambda: (self._create(config, request).to_dict_recursive(), True), config
+            )
 
-            fc = res.get("function_call")
-            if fc:
-                fc = fc.to_dict()
+        if config.cache is None:
+            value, fresh = create()
+        else:
+            created = []
+
+            def exact() -> dict:
+                value, fresh = create()
+                created.append(fresh)
+                return value
+
+            value, fresh = config.cache.get_or_create(request_key(request), exact)
+            metrics.inc("blacksmith_cache_total", cache="exact", result="miss" if fresh else "hit")
+            fresh = fresh and created[0]
+        return OpenAIObject.construct_from(value), fresh
+
+    def _create(self, config: Config, request: dict, stream: bool = False):
+        import openai
+
+        limiter, router = config.rate_limit, config.router
+        prompt_tokens = (
+            self._estimate_tokens(config, request)
+            if limiter is not None or (router is not None and router.rate_limited)
+            else 0
+        )
 
-            return LLMResponse(
-                content=res.get("content"),
-                function_call=FunctionCall(
-                    tool=fc.get("name"), args=json.loads(fc.get("arguments"))
+        def send(timeout: Optional[float], model: str, credentials: dict):
+            # Credentials are passed with each request, never set on the `openai` module
+            api_key = credentials.get("api_key")
+            if limiter is not None:
+                reserved = limiter.acquire(model, api_key, prompt_tokens)
+            with metrics.span("network", model=model):
+                completion = openai.ChatCompletion.create(
+                    request_timeout=timeout,
+                    stream=stream,
+                    **credentials,
+                    **{**request, "model": model},
                 )
-                if fc
-                else None,
+            if limiter is not None and not stream:
+                limiter.reconcile(model, api_key, reserved, completion.get("usage"))
+            return completion
+
+        def create(timeout: Optional[float]):
+            if router is None:
+                return send(timeout, config.model, _credentials(config))
+            return router.call(
+                lambda e: send(timeout, e.model or config.model, e.credentials(config.api_key)),
+                prompt_tokens,
+                stream,
             )
-        except Exception as e:
-            print(f"Error sending {self.messages}: {e}")
+
+        return config.retry.call(create)
+
+    def _estimate_tokens(self, config: Config, request: dict) -> int:
+        # Message counts are cached on each message, so only new messages are tokenized
+        messages = self.messages if self.window is None else self._window
+        tokens = TOKENS_PER_REPLY + sum(m.count_tokens(config.model) for m in messages)
+        if request.get("functions"):
+            tokens += count_tokens(config.model, json.dumps(request["functions"]))
+        return tokens
+
+    def _stream(
+        self, functions: list[dict], function_call: str | dict = "auto", debug=False
+    ) -> StreamingResponse:
+        config = self._resolve_config()
+
+        request = self._build_request(config, functions=functions, function_call=function_call)
+        start = time.perf_counter()
+        cached = config.cache.lookup(request_key(request)) if config.cache is not None else None
+        chunks = (
+            _cached_stream(cached)
+            if cached is not None
+            else self._create(config, request, stream=True)
+        )
+        return StreamingResponse(
+            self, config, request, chunks, functions, start, debug=debug, cached=cached is not None
+        )
 
     def add_message(self, message: ChatMessage) -> None:
         """
@@ -382,7 +1445,149 @@ class Conversation(BaseModel):
         """
         Clears the chat history.
         """
-        self.messages = []
+        self.messages = MessageHistory()
+
+    def fork(self) -> "Conversation":
+        """
+        Returns a new branch of the conversation that shares its history so far.
+
+        Messages are immutable, so the branch shares the history so far, as a `MessageHistory`, along with
+        the cached payloads and token counts of its messages, and only stores the messages added to it
+        afterwards. Forking costs the messages added since the last fork, not the whole history. Adding
+        messages to either conversation does not affect the other. The branch shares the parent's `config`
+        and is not saved under the parent's id.
+
+        Usage:
+        ```
+            convo = Conversation()
+            convo.ask("Let's plan a trip to Japan.")
+            short, long = convo.fork(), convo.fork()
+            short.ask("Plan a 3 day itinerary.")
+            long.ask("Plan a 3 week itinerary.")
+        ```
+        """
+        if not isinstance(self.messages, MessageHistory):
+            self._adopt(MessageHistory(self.messages))
+        fork = self.model_copy(update={"messages": self.messages.fork(), "id": None})
+        # Private state is copied shallowly. The request payload is rebuilt from the cached payloads of the
+        # messages on the branch's first request, and the window, bounded by its budget, is copied
+        fork._payload, fork._payload_list = [], None
+        if self._tracked_list is self.messages:
+            fork._tracked_list, fork._window = fork.messages, list(self._window)
+        else:
+            fork._tracked_list, fork._tracked, fork._token_total, fork._window = None, 0, 0, []
+        fork._saved, fork._saved_list, fork._saved_last = 0, None, None
+        return fork
+
+    def _adopt(self, messages: MessageHistory) -> None:
+        # Replaces the history with an equal one, keeping the state tracking it
+        previous, self.messages = self.messages, messages
+        if self._payload_list is previous:
+            self._payload_list = messages
+        if self._tracked_list is previous:
+            self._tracked_list = messages
+        if self._saved_list is previous:
+            self._saved_list = messages
+
+    def fan_out(
+        self, prompt: str, k: int, max_concurrency: Optional[int] = None, **kwargs
+    ) -> list["ForkResult"]:
+        """
+        Asks `prompt` on `k` forks of the conversation in parallel and returns the result of each branch.
+
+        Keyword arguments are passed to `ask`. Identical requests are answered once by a `CompletionCache`,
+        so configure branches without a cache, or with a temperature above 0, to sample different answers.
+
+        Usage:
+        ```
+            convo = Conversation()
+            results = convo.fan_out("Suggest a name for a coffee shop.", k=5)
+            names = [r.response.content for r in results if r.ok()]
+        ```
+        """
+        forks = [self.fork() for _ in range(k)]
+
+        def ask(index: int) -> ForkResult:
+            result = ForkResult(index=index, conversation=forks[index])
+            try:
+                result.response = forks[index].ask(prompt, **kwargs)
+            except Exception as e:
+                result.error = e
+            return result
+
+        with ThreadPoolExecutor(max_workers=max_concurrency or k) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, ask, i) for i in range(k)]
+            return [future.result() for future in futures]
+
+    def save(self, store: ConversationStore) -> str:
+        """
+        Saves the conversation to `store` and returns its id.
+
+        Only messages added since the last save or load are written, so the stored log is append-only. A
+        `ContextWindow` only trims the messages sent, never the history. If the history was cleared or
+        replaced in the meantime, the stored conversation is replaced instead.
+
+        Usage:
+        ```
+            store = SQLiteStore(".blacksmith/conversations.db")
+            conversation_id = convo.save(store)
+            ...
+            convo = Conversation.load(conversation_id, store)
+        ```
+        """
+        # A new id has nothing stored under it yet
+        if self.id is None:
+            self.id = uuid.uuid4().hex
+            self._saved_list, self._saved, self._saved_last = self.messages, 0, None
+
+        messages, saved = self.messages, self._saved
+        if (
+            self._saved_list is messages
+            and len(messages) >= saved
+            and (saved == 0 or messages[saved - 1] is self._saved_last)
+        ):
+            if len(messages) > saved:
+                store.append(self.id, [message.to_record() for message in messages[saved:]])
+        else:
+            store.replace(self.id, [message.to_record() for message in messages])
+        self._mark_saved()
+        return self.id
+
+    def _mark_saved(self) -> None:
+        self._saved_list, self._saved = self.messages, len(self.messages)
+        self._saved_last = self.messages[-1] if self.messages else None
+
+    @classmethod
+    def load(cls, conversation_id: str, store: ConversationStore, **kwargs) -> "Conversation":
+        """
+        Loads a conversation saved with `save`. Keyword arguments, like `config` or `window`, are passed to the constructor.
+
+        Raises:
+            KeyError: If `store` has no conversation with this id.
+        """
+        records = store.load(conversation_id)
+        if records is None:
+            raise KeyError(conversation_id)
+        return cls._from_records(conversation_id, records, **kwargs)
+
+    @classmethod
+    def load_many(
+        cls, conversation_ids: Iterable[str], store: ConversationStore, **kwargs
+    ) -> dict[str, "Conversation"]:
+        """
+        Loads several conversations in one batch, skipping unknown ids.
+        """
+        return {
+            conversation_id: cls._from_records(conversation_id, records, **kwargs)
+            for conversation_id, records in store.load_many(conversation_ids).items()
+        }
+
+    @classmethod
+    def _from_records(cls, conversation_id: str, records: list[dict], **kwargs) -> "Conversation":
+        messages = MessageHistory(ChatMessage.from_record(record) for record in records)
+        conversation = cls(id=conversation_id, messages=messages, **kwargs)
+        conversation._mark_saved()
+        return conversation
 
     def continue_from_result(self, fcr: FunctionCallResult, stop: bool = False):
         """
@@ -406,6 +1611,21 @@ class Conversation(BaseModel):
         functions = [] if stop else get_tools()
         return self._send(functions=functions)
 
+    def continue_from_results(self, results: list[FunctionCallResult], stop: bool = False):
+        """
+        Adds an observation for each function call result and sends a single request to the LLM.
+
+        Usage:
+        ```
+            results = execute_all(calls)
+            final_answer = conversation.continue_from_results(results, stop=True)
+        ```
+        """
+        for fcr in results:
+            self.add_message(fcr.generate_observation())
+        functions = [] if stop else get_tools()
+        return self._send(functions=functions)
+
     def with_config(self, config: Config) -> None:
         """
         Sets the configuration for a `Conversation`.
@@ -421,18 +1641,6 @@ class Conversation(BaseModel):
             self.config.load()
         self.config.on_completion.append(func)
 
-    def _update_all_possibilites(self, word: str, value: int):
-        possibilites = [
-            lambda t: f" {t}",
-            lambda t: f" {t}".lower(),
-            lambda t: f" {t}".upper(),
-            lambda t: t[0].upper() + t[1:],
-            lambda t: " " + t[0].upper() + t[1:],
-        ]
-
-        for possible in possibilites:
-            self.update_bias(token=possible(word), value=value)
-
     def ban_word(self, word: str) -> None:
         """
         Prevents occurrences of a word in the generated output.
@@ -446,7 +1654,26 @@ class Conversation(BaseModel):
             cities = c.ask("What are a few cities in California?")
         ```
         """
-        self._update_all_possibilites(word, -100)
+        self.ban_words([word])
+
+    def ban_words(self, words: list[str]) -> CompiledBias:
+        """
+        Prevents occurrences of any of `words` in the generated output.
+
+        All words are tokenized in a single batch. Raises a `ValueError` if the combined bias of the
+        `Conversation` would go over the API limit.
+
+        Usage:
+        ```
+            c = Conversation()
+            c.ban_words(["San Francisco", "Los Angeles"])
+        ```
+        """
+        if not self.config:
+            self.config = Config().load()
+        compiled = compile_bias(words, model=self.config.model, overflow="error")
+        self.config.apply_bias(compiled)
+        return compiled
 
     def update_bias(self, token: str, value: int) -> None:
         """
@@ -455,3 +1682,244 @@ class Conversation(BaseModel):
         if not self.config:
             self.config = Config().load()
         self.config.update_bias(token=token, value=value)
+
+
+class ForkResult(BaseModel, defer_build=True):
+    """
+    A class representing the outcome of one branch of `Conversation.fan_out`.
+
+    Attributes:
+        index (int): The position of the branch.
+        conversation (Conversation): The forked conversation, holding the prompt and the response.
+        response (Optional[LLMResponse]): The response. `None` if the request failed.
+        error (Optional[Exception]): The exception raised while asking, if any.
+
+    Methods:
+        ok() -> bool: Returns true if the request succeeded.
+    """
+
+    index: int
+    conversation: Conversation
+    response: Optional[LLMResponse] = None
+    error: Optional[Exception] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def ok(self) -> bool:
+        """
+        Returns true if the request succeeded.
+        """
+        return self.error is None
+
+
+class AsyncConversation(Conversation):
+    """
+    Class representing a conversation with a language model, using the asyncio client.
+
+    Inherits from `Conversation`. `ask` and `continue_from_result` are coroutines, and all requests
+    share a pooled HTTP session per event loop, so many completions can be in flight at once.
+    Completion hooks may be regular functions or coroutines.
+
+    Usage:
+    ```
+        conversation = AsyncConversation()
+        response = await conversation.ask("Hello, how are you?")
+
+        # Many conversations on a single event loop
+        responses = await asyncio.gather(*(AsyncConversation().ask(q) for q in questions))
+    ```
+    """
+
+    async def ask(
+        self,
+        prompt: str,
+        functions: list[dict] = [],
+        function_call: str | dict = "auto",
+        use_functions: bool = True,
+        role: ChatRoles = ChatRoles.USER,
+        debug: bool = False,
+        stream: bool = False,
+    ) -> LLMResponse | AsyncStreamingResponse:
+        """
+        Sends a prompt plus the current message chain to the language model.
+        You can change the role by passing in a ChatRoles parameter (defaults to User).
+        Returns a LLMResponse object, or an AsyncStreamingResponse of content deltas if `stream` is set.
+        """
+        functions = await self._aprepare(prompt=prompt, functions=functions, role=role)
+        if stream:
+            return await self._astream(
+                functions=functions if use_functions else [],
+                function_call=function_call,
+                debug=debug,
+            )
+        return await self._asend(
+            functions=functions if use_functions else [], function_call=function_call, debug=debug
+        )
+
+    async def _aprepare(self, prompt: str, functions: list[dict], role: ChatRoles) -> list[dict]:
+        self._add_prompt(prompt=prompt, role=role)
+
+        # Fetched here, so that remote registries connect without blocking the event loop
+        if len(functions) == 0:
+            functions = await aget_tools()
+        return functions
+
+    async def _asend(
+        self, functions: list[dict], function_call: str | dict = "auto", debug=False
+    ) -> LLMResponse:
+        import openai
+
+        config = self._resolve_config()
+        openai.aiosession.set(get_aiosession())
+
+        with metrics.span("send", model=config.model) as span:
+            with metrics.span("serialize", model=config.model):
+                request = self._build_request(
+                    config, functions=functions, function_call=function_call
+                )
+            completion, fresh = await self._acomplete(config, request)
+            span.set_attribute("cached", not fresh)
+
+            # Process after completion hooks
+            if fresh:
+                metrics.record_usage(config.model, completion.get("usage"))
+                for f in config.on_completion:
+                    result = f(completion)
+                    if inspect.isawaitable(result):
+                        await result
+
+            with metrics.span("parse", model=config.model):
+                return self._parse_completion(completion, functions=functions, debug=debug)
+
+    async def _acomplete(self, config: Config, request: dict) -> tuple["OpenAIObject", bool]:
+        from openai.openai_object import OpenAIObject
+
+        if config.cache is None and config.semantic_cache is None:
+            return await self._acreate(config, request), True
+
+        async def create() -> tuple[dict, bool]:
+            async def acreate() -> tuple[dict, bool]:
+                return (await self._acreate(config, request)).to_dict_recursive(), True
+
+            # Only reached on an exact miss, so repeated requests are never embedded
+            if config.semantic_cache is None:
+                return await acreate()
+            return await config.semantic_cache.aget_or_create(request, acreate, config)
+
+        if config.cache is None:
+            value, fresh = await create()
+        else:
+            created = []
+
+            async def exact() -> dict:
+                value, fresh = await create()
+                created.append(fresh)
+                return value
+
+            value, fresh = await config.cache.aget_or_create(request_key(request), exact)
+            metrics.inc("blacksmith_cache_total", cache="exact", result="miss" if fresh else "hit")
+            fresh = fresh and created[0]
+        return OpenAIObject.construct_from(value), fresh
+
+    async def _acreate(self, config: Config, request: dict, stream: bool = False):
+        import openai
+
+        limiter, router = config.rate_limit, config.router
+        prompt_tokens = (
+            self._estimate_tokens(config, request)
+            if limiter is not None or (router is not None and router.rate_limited)
+            else 0
+        )
+
+        async def send(timeout: Optional[float], model: str, credentials: dict):
+            api_key = credentials.get("api_key")
+            if limiter is not None:
+                reserved = await limiter.aacquire(model, api_key, prompt_tokens)
+            with metrics.span("network", model=model):
+                completion = await openai.ChatCompletion.acreate(
+                    request_timeout=timeout,
+                    stream=stream,
+                    **credentials,
+                    **{**request, "model": model},
+                )
+            if limiter is not None and not stream:
+                await limiter.areconcile(model, api_key, reserved, completion.get("usage"))
+            return completion
+
+        async def create(timeout: Optional[float]):
+            if router is None:
+                return await send(timeout, config.model, _credentials(config))
+            return await router.acall(
+                lambda e: send(timeout, e.model or config.model, e.credentials(config.api_key)),
+                prompt_tokens,
+                stream,
+            )
+
+        return await config.retry.acall(create)
+
+    async def _astream(
+        self, functions: list[dict], function_call: str | dict = "auto", debug=False
+    ) -> AsyncStreamingResponse:
+        import openai
+
+        config = self._resolve_config()
+        openai.aiosession.set(get_aiosession())
+
+        request = self._build_request(config, functions=functions, function_call=function_call)
+        start = time.perf_counter()
+        cached = (
+            await config.cache.alookup(request_key(request)) if config.cache is not None else None
+        )
+        chunks = (
+            _acached_stream(cached)
+            if cached is not None
+            else await self._acreate(config, request, stream=True)
+        )
+        return AsyncStreamingResponse(
+            self, config, request, chunks, functions, start, debug=debug, cached=cached is not None
+        )
+
+    async def continue_from_result(self, fcr: FunctionCallResult, stop: bool = False):
+        """
+        Generates an observation from a function call result and sends another request to the LLM.
+
+        Usage:
+        ```
+            result = resp.execute_function_call()
+            final_answer = await conversation.continue_from_result(result, stop=True)
+        ```
+        """
+        observation = fcr.generate_observation()
+        self.add_message(observation)
+        functions = [] if stop else await aget_tools()
+        return await self._asend(functions=functions)
+
+    async def continue_from_results(self, results: list[FunctionCallResult], stop: bool = False):
+        """
+        Adds an observation for each function call result and sends a single request to the LLM.
+        """
+        for fcr in results:
+            self.add_message(fcr.generate_observation())
+        functions = [] if stop else await aget_tools()
+        return await self._asend(functions=functions)
+
+    async def fan_out(
+        self, prompt: str, k: int, max_concurrency: Optional[int] = None, **kwargs
+    ) -> list[ForkResult]:
+        """
+        Async version of `fan_out`. All branches run on the current event loop.
+        """
+        forks = [self.fork() for _ in range(k)]
+        semaphore = asyncio.Semaphore(max_concurrency or k)
+
+        async def ask(index: int) -> ForkResult:
+            result = ForkResult(index=index, conversation=forks[index])
+            async with semaphore:
+                try:
+                    result.response = await forks[index].ask(prompt, **kwargs)
+                except Exception as e:
+                    result.error = e
+            return result
+
+        return list(await asyncio.gather(*(ask(i) for i in range(k))))
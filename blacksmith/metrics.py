@@ -0,0 +1,334 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Help text for the metrics recorded by blacksmith
+_HELP = {
+    "blacksmith_phase_seconds": "Time spent in each phase of a request or tool call.",
+    "blacksmith_tokens_total": "Tokens used by completions sent to the API.",
+    "blacksmith_cache_total": "Completion and tool cache lookups by cache and result.",
+    "blacksmith_retries_total": "Completion attempts retried, by error.",
+    "blacksmith_hedges_total": "Hedged completion requests sent.",
+    "blacksmith_ratelimit_wait_seconds_total": "Time spent waiting on the client-side rate limiter.",
+    "blacksmith_tool_errors_total": "Tool calls that raised or timed out.",
+    "blacksmith_failovers_total": "Requests failed over to another endpoint, by failed endpoint.",
+}
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    A cumulative histogram with fixed buckets, in the style of Prometheus.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns the upper bound of the bucket holding the `q` quantile.
+        """
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("blacksmith_span", default=None)
+
+
+class Span:
+    """
+    A timed operation, exported in the shape of an OpenTelemetry span.
+
+    Spans nest through `contextvars`, so spans started inside another span (including in threads started
+    with a copied context and in asyncio tasks) share its trace and record it as their parent.
+    """
+
+    __slots__ = (
+        "_metrics",
+        "_start",
+        "_token",
+        "name",
+        "labels",
+        "attributes",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start_time",
+        "end_time",
+        "duration",
+        "error",
+    )
+
+    def __init__(self, metrics: "Metrics", name: str, labels: dict[str, str]) -> None:
+        self._metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.attributes: dict[str, Any] = dict(labels)
+        self.error: Optional[str] = None
+
+    def __enter__(self) -> "Span":
+        parent = _current_span.get()
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_time = time.time_ns()
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.duration = time.perf_counter() - self._start
+        self.end_time = self.start_time + int(self.duration * 1e9)
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.set_error(exc)
+        self._metrics._finish(self)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, e: BaseException) -> None:
+        self.error = f"{type(e).__name__}: {e}"
+
+    def to_otel(self) -> dict:
+        """
+        Returns the span in the OpenTelemetry JSON format.
+        """
+        return {
+            "name": f"blacksmith.{self.name}",
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "startTimeUnixNano": self.start_time,
+            "endTimeUnixNano": self.end_time,
+            "attributes": [
+                {"key": key, "value": {"stringValue": str(value)}}
+                for key, value in self.attributes.items()
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+
+
+class _NoopSpan:
+    """
+    Stands in for a `Span` while metrics are disabled.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_error(self, e: BaseException) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Metrics:
+    """
+    Collects counters, latency histograms and spans.
+
+    Every finished span is observed in the `blacksmith_phase_seconds` histogram, labelled with its phase
+    and the labels it was started with.
+
+    Attributes:
+        buckets (tuple[float, ...]): The latency histogram buckets, in seconds. Defaults to `DEFAULT_BUCKETS`.
+        max_spans (int): The number of finished spans kept for `export_spans`. Defaults to 10,000.
+
+    Usage:
+    ```
+        metrics = blacksmith.metrics.enable()
+        metrics.on_span(lambda span: print(span.name, span.duration))
+        ...
+        print(metrics.to_prometheus())
+    ```
+    """
+
+    def __init__(
+        self, buckets: tuple[float, ...] = DEFAULT_BUCKETS, max_spans: int = 10_000
+    ) -> None:
+        self.buckets = buckets
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.histograms: dict[tuple[str, Labels], Histogram] = {}
+        self.spans: deque[Span] = deque(maxlen=max_spans)
+        self.exporters: list[Callable[[Span], None]] = []
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def span(self, name: str, **labels: str) -> Span:
+        return Span(self, name, labels)
+
+    def on_span(self, func: Callable[[Span], None]) -> None:
+        """
+        Registers a function called with every finished span, e.g. to forward spans to a tracing backend.
+        """
+        self.exporters.append(func)
+
+    def _finish(self, span: Span) -> None:
+        self.observe("blacksmith_phase_seconds", span.duration, phase=span.name, **span.labels)
+        self.spans.append(span)
+        for export in self.exporters:
+            export(span)
+
+    def histogram(self, name: str, **labels: str) -> Optional[Histogram]:
+        return self.histograms.get((name, _labels(labels)))
+
+    def counter(self, name: str, **labels: str) -> float:
+        return self.counters.get((name, _labels(labels)), 0)
+
+    def export_spans(self, clear: bool = True) -> list[dict]:
+        """
+        Returns the finished spans in the OpenTelemetry JSON format, oldest first.
+        """
+        with self._lock:
+            spans = list(self.spans)
+            if clear:
+                self.spans.clear()
+        return [span.to_otel() for span in spans]
+
+    def to_prometheus(self) -> str:
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+
+        lines, described = [], set()
+
+        def describe(name: str, kind: str) -> None:
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), histogram in histograms:
+            describe(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else str(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.spans.clear()
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+# The active collector. `None` while metrics are disabled, which keeps instrumentation to a single check.
+_metrics: Optional[Metrics] = None
+
+
+def enable(metrics: Optional[Metrics] = None) -> Metrics:
+    """
+    Starts collecting metrics, returning the collector.
+    """
+    global _metrics
+    _metrics = metrics or _metrics or Metrics()
+    return _metrics
+
+
+def disable() -> None:
+    """
+    Stops collecting metrics.
+    """
+    global _metrics
+    _metrics = None
+
+
+def get_metrics() -> Optional[Metrics]:
+    return _metrics
+
+
+def span(name: str, **labels: str) -> Span | _NoopSpan:
+    """
+    Returns a span for `name`, or a no-op span while metrics are disabled.
+    """
+    metrics = _metrics
+    if metrics is None:
+        return _NOOP_SPAN
+    return Span(metrics, name, labels)
+
+
+def inc(name: str, value: float = 1, **labels: str) -> None:
+    metrics = _metrics
+    if metrics is not None:
+        metrics.inc(name, value, **labels)
+
+
+def record_usage(model: str, usage: Optional[dict]) -> None:
+    """
+    Counts the prompt and completion tokens of a completion.
+    """
+    metrics = _metrics
+    if metrics is None or not usage:
+        return
+    metrics.inc(
+        "blacksmith_tokens_total", usage.get("prompt_tokens", 0), model=model, type="prompt"
+    )
+    metrics.inc(
+        "blacksmith_tokens_total", usage.get("completion_tokens", 0), model=model, type="completion"
+    )
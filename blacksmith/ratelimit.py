@@ -0,0 +1,416 @@
+import json
+import time
+import asyncio
+import fcntl
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+from pydantic import BaseModel
+from blacksmith import metrics
+
+# Buckets are (requests, tokens, updated_at): the budget left in each bucket and when it was last refilled
+Bucket = tuple[float, float, float]
+
+
+class RateLimit(BaseModel, defer_build=True):
+    """
+    A requests-per-minute and tokens-per-minute budget.
+
+    Both budgets refill continuously. `burst` is the fraction of a minute's budget that can be spent at
+    once, so the default of 0.1 spreads a budget of 600 RPM over the minute instead of sending 600 requests
+    in the first second and waiting out the rest of it on 429s.
+
+    Attributes:
+        rpm (Optional[int]): Requests per minute. Defaults to `None` (no limit).
+        tpm (Optional[int]): Tokens per minute. Defaults to `None` (no limit).
+        burst (float): The fraction of a minute's budget that can be spent at once. Defaults to 0.1.
+    """
+
+    rpm: Optional[int] = None
+    tpm: Optional[int] = None
+    burst: float = 0.1
+
+    def capacity(self) -> tuple[float, float]:
+        return (
+            max((self.rpm or 0) * self.burst, 1),
+            max((self.tpm or 0) * self.burst, 1),
+        )
+
+
+def _take(
+    bucket: Optional[Bucket], limit: RateLimit, requests: int, tokens: int, now: float
+) -> tuple[Bucket, float]:
+    """
+    Refills `bucket` up to `now` and takes `requests` and `tokens` from it if there is enough budget.
+
+    Returns the new bucket and the number of seconds to wait before trying again, which is 0 if the
+    budget was taken.
+    """
+    max_requests, max_tokens = limit.capacity()
+    if bucket is None:
+        bucket = (max_requests, max_tokens, now)
+    level_requests, level_tokens, updated_at = bucket
+    elapsed = max(now - updated_at, 0)
+    if limit.rpm is not None:
+        level_requests = min(level_requests + elapsed * limit.rpm / 60, max_requests)
+    if limit.tpm is not None:
+        level_tokens = min(level_tokens + elapsed * limit.tpm / 60, max_tokens)
+
+    # Requests larger than the bucket go through once it is full, leaving it in debt
+    wait = 0.0
+    if limit.rpm is not None and level_requests < min(requests, max_requests):
+        wait = max(wait, (min(requests, max_requests) - level_requests) * 60 / limit.rpm)
+    if limit.tpm is not None and level_tokens < min(tokens, max_tokens):
+        wait = max(wait, (min(tokens, max_tokens) - level_tokens) * 60 / limit.tpm)
+    if wait:
+        return (level_requests, level_tokens, now), wait
+    if limit.rpm is not None:
+        level_requests -= requests
+    if limit.tpm is not None:
+        level_tokens -= tokens
+    return (level_requests, level_tokens, now), 0.0
+
+
+def _refund(bucket: Optional[Bucket], limit: RateLimit, tokens: int) -> Optional[Bucket]:
+    if bucket is None:
+        return None
+    level_requests, level_tokens, updated_at = bucket
+    return level_requests, min(level_tokens + tokens, limit.capacity()[1]), updated_at
+
+
+class RateLimitBackend(ABC):
+    """
+    Base class for the storage behind a `RateLimiter`.
+
+    Subclasses implement `take` and `refund` atomically, so a backend can be shared by every thread,
+    process or machine sending with the same API key. The async versions run them in a thread, so that a
+    backend doing I/O does not block the event loop.
+    """
+
+    @abstractmethod
+    def take(self, key: str, limit: RateLimit, requests: int, tokens: int) -> float:
+        """
+        Takes `requests` and `tokens` from the bucket at `key`, returning 0 on success or the number of
+        seconds to wait before trying again.
+        """
+
+    @abstractmethod
+    def refund(self, key: str, limit: RateLimit, tokens: int) -> None:
+        """
+        Returns `tokens` to the bucket at `key`. Negative values take more tokens.
+        """
+
+    async def atake(self, key: str, limit: RateLimit, requests: int, tokens: int) -> float:
+        """
+        Async version of `take`.
+        """
+        return await asyncio.to_thread(self.take, key, limit, requests, tokens)
+
+    async def arefund(self, key: str, limit: RateLimit, tokens: int) -> None:
+        """
+        Async version of `refund`.
+        """
+        await asyncio.to_thread(self.refund, key, limit, tokens)
+
+
+class MemoryBackend(RateLimitBackend):
+    """
+    Keeps buckets in memory. Shared by the threads and tasks of one process.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._buckets: dict[str, Bucket] = {}
+
+    def take(self, key: str, limit: RateLimit, requests: int, tokens: int) -> float:
+        with self._lock:
+            self._buckets[key], wait = _take(
+                self._buckets.get(key), limit, requests, tokens, time.time()
+            )
+            return wait
+
+    def refund(self, key: str, limit: RateLimit, tokens: int) -> None:
+        with self._lock:
+            bucket = _refund(self._buckets.get(key), limit, tokens)
+            if bucket is not None:
+                self._buckets[key] = bucket
+
+    # Buckets are only held in memory, so the event loop is never blocked for long
+    async def atake(self, key: str, limit: RateLimit, requests: int, tokens: int) -> float:
+        return self.take(key, limit, requests, tokens)
+
+    async def arefund(self, key: str, limit: RateLimit, tokens: int) -> None:
+        self.refund(key, limit, tokens)
+
+
+class FileBackend(RateLimitBackend):
+    """
+    Keeps buckets in a JSON file guarded by a file lock. Shared by the processes of one machine.
+
+    Attributes:
+        path (str): The path to the state file. A lock file is created next to it.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock_path = f"{path}.lock"
+
+    def _update(self, key: str, update) -> float:
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.path) as f:
+                        buckets = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    buckets = {}
+                bucket, wait = update(tuple(buckets[key]) if key in buckets else None)
+                if bucket is not None:
+                    buckets[key] = bucket
+                    with open(self.path, "w") as f:
+                        json.dump(buckets, f)
+                return wait
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def take(self, key: str, limit: RateLimit, requests: int, tokens: int) -> float:
+        return self._update(key, lambda bucket: _take(bucket, limit, requests, tokens, time.time()))
+
+    def refund(self, key: str, limit: RateLimit, tokens: int) -> None:
+        self._update(key, lambda bucket: (_refund(bucket, limit, tokens), 0.0))
+
+
+# Redis port of `_take` and `_refund`. KEYS[1] is the bucket; ARGV is
+# now, rpm, tpm, max requests, max tokens, requests, tokens (0 for no limit), and a refund flag.
+_REDIS_SCRIPT = """
+local now, rpm, tpm = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local max_requests, max_tokens = tonumber(ARGV[4]), tonumber(ARGV[5])
+local requests, tokens, refund = tonumber(ARGV[6]), tonumber(ARGV[7]), ARGV[8] == "1"
+local bucket = redis.call("HMGET", KEYS[1], "requests", "tokens", "updated_at")
+if not bucket[3] then
+    if refund then return "0" end
+    bucket = {max_requests, max_tokens, now}
+end
+local level_requests, level_tokens = tonumber(bucket[1]), tonumber(bucket[2])
+if refund then
+    level_tokens = math.min(level_tokens + tokens, max_tokens)
+    redis.call("HSET", KEYS[1], "tokens", level_tokens)
+    return "0"
+end
+local elapsed = math.max(now - tonumber(bucket[3]), 0)
+if rpm > 0 then level_requests = math.min(level_requests + elapsed * rpm / 60, max_requests) end
+if tpm > 0 then level_tokens = math.min(level_tokens + elapsed * tpm / 60, max_tokens) end
+local wait = 0
+if rpm > 0 and level_requests < math.min(requests, max_requests) then
+    wait = math.max(wait, (math.min(requests, max_requests) - level_requests) * 60 / rpm)
+end
+if tpm > 0 and level_tokens < math.min(tokens, max_tokens) then
+    wait = math.max(wait, (math.min(tokens, max_tokens) - level_tokens) * 60 / tpm)
+end
+if wait == 0 and rpm > 0 then level_requests = level_requests - requests end
+if wait == 0 and tpm > 0 then level_tokens = level_tokens - tokens end
+redis.call("HSET", KEYS[1], "requests", level_requests, "tokens", level_tokens, "updated_at", now)
+redis.call("EXPIRE", KEYS[1], 3600)
+return tostring(wait)
+"""
+
+
+class RedisBackend(RateLimitBackend):
+    """
+    Keeps buckets in Redis, updated atomically with a Lua script. Shared by every machine using the server.
+
+    Attributes:
+        url (str): The Redis URL. Defaults to "redis://localhost:6379/0".
+        prefix (str): The prefix for bucket keys. Defaults to "blacksmith:ratelimit:".
+
+    Usage:
+    ```
+        limiter = RateLimiter(default=RateLimit(rpm=3_500, tpm=90_000), backend=RedisBackend("redis://redis:6379/0"))
+    ```
+    """
+
+    def __init__(
+        self, url: str = "redis://localhost:6379/0", prefix: str = "blacksmith:ratelimit:"
+    ) -> None:
+        import redis
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(_REDIS_SCRIPT)
+
+    def _call(self, key: str, limit: RateLimit, requests: int, tokens: int, refund: bool) -> float:
+        max_requests, max_tokens = limit.capacity()
+        wait = self._script(
+            keys=[self.prefix + key],
+            args=[
+                time.time(),
+                limit.rpm or 0,
+                limit.tpm or 0,
+                max_requests,
+                max_tokens,
+                requests,
+                tokens,
+                int(refund),
+            ],
+        )
+        return float(wait)
+
+    def take(self, key: str, limit: RateLimit, requests: int, tokens: int) -> float:
+        return self._call(key, limit, requests, tokens, refund=False)
+
+    def refund(self, key: str, limit: RateLimit, tokens: int) -> None:
+        self._call(key, limit, 0, tokens, refund=True)
+
+
+class RateLimitStats(BaseModel, defer_build=True):
+    """
+    Counters reported by a `RateLimiter`.
+
+    Attributes:
+        requests (int): Requests let through.
+        waits (int): Requests that had to wait for budget.
+        wait_seconds (float): Total time spent waiting for budget.
+        estimated_tokens (int): Total tokens reserved before sending.
+        actual_tokens (int): Total tokens reported by the API for reconciled requests.
+    """
+
+    requests: int = 0
+    waits: int = 0
+    wait_seconds: float = 0.0
+    estimated_tokens: int = 0
+    actual_tokens: int = 0
+
+
+class RateLimiter:
+    """
+    A client-side token-bucket limiter for requests and tokens per minute.
+
+    Every request reserves its estimated prompt tokens plus `completion_tokens` before it is sent, and the
+    reservation is corrected with the `usage` of the response. Streamed responses carry no `usage`, so
+    their reservation stands. Each model and API key pair has its own bucket, so one limiter can be shared by
+    configurations using different keys.
+
+    A budget is looked up by `(model, api_key)`, then by `(None, api_key)` for any model of that key, then
+    by model name, falling back to `default`.
+
+    Attributes:
+        limits (dict[str | tuple[Optional[str], str], RateLimit]): Budgets by model name, `(model, api_key)`
+            or `(None, api_key)`.
+        default (Optional[RateLimit]): The budget for requests matching no entry in `limits`. Defaults to `None` (no limit).
+        backend (RateLimitBackend): Where budgets are kept. Defaults to a `MemoryBackend`.
+        completion_tokens (int): Tokens reserved for the completion until the actual usage is known. Defaults to 256.
+
+    Usage:
+    ```
+        limiter = RateLimiter(
+            limits={
+                "gpt-4": RateLimit(rpm=200, tpm=40_000),
+                (None, "sk-free-tier"): RateLimit(rpm=3, tpm=40_000),
+            },
+            default=RateLimit(rpm=3_500, tpm=90_000),
+            backend=FileBackend("/tmp/blacksmith-ratelimit.json"),
+        )
+        cfg = Config(model="gpt-4", temperature=0.1, rate_limit=limiter)
+    ```
+    """
+
+    def __init__(
+        self,
+        limits: Optional[dict[str | tuple[Optional[str], str], RateLimit]] = None,
+        default: Optional[RateLimit] = None,
+        backend: Optional[RateLimitBackend] = None,
+        completion_tokens: int = 256,
+    ) -> None:
+        self.limits = limits or {}
+        self.default = default
+        self.backend = backend or MemoryBackend()
+        self.completion_tokens = completion_tokens
+        self.stats = RateLimitStats()
+        self._lock = threading.Lock()
+
+    def limit_for(self, model: str, api_key: Optional[str] = None) -> Optional[RateLimit]:
+        """
+        Returns the budget for requests to `model` with `api_key`, or `None` if they are not limited.
+        """
+        if api_key is not None:
+            limit = self.limits.get((model, api_key)) or self.limits.get((None, api_key))
+            if limit is not None:
+                return limit
+        return self.limits.get(model, self.default)
+
+    @staticmethod
+    def _key(model: str, api_key: Optional[str]) -> str:
+        # Never store the API key itself
+        digest = hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+        return f"{digest}:{model}"
+
+    def _record(self, tokens: int, waited: float) -> None:
+        with self._lock:
+            self.stats.requests += 1
+            self.stats.estimated_tokens += tokens
+            if waited:
+                self.stats.waits += 1
+                self.stats.wait_seconds += waited
+        if waited:
+            metrics.inc("blacksmith_ratelimit_wait_seconds_total", waited)
+
+    def acquire(self, model: str, api_key: Optional[str], prompt_tokens: int) -> int:
+        """
+        Blocks until there is budget for one request, returning the number of tokens reserved.
+        """
+        limit = self.limit_for(model, api_key)
+        tokens = prompt_tokens + self.completion_tokens
+        if limit is None:
+            return tokens
+        waited = 0.0
+        while wait := self.backend.take(self._key(model, api_key), limit, 1, tokens):
+            time.sleep(wait)
+            waited += wait
+        self._record(tokens, waited)
+        return tokens
+
+    async def aacquire(self, model: str, api_key: Optional[str], prompt_tokens: int) -> int:
+        """
+        Async version of `acquire`.
+        """
+        limit = self.limit_for(model, api_key)
+        tokens = prompt_tokens + self.completion_tokens
+        if limit is None:
+            return tokens
+        waited = 0.0
+        while wait := await self.backend.atake(self._key(model, api_key), limit, 1, tokens):
+            await asyncio.sleep(wait)
+            waited += wait
+        self._record(tokens, waited)
+        return tokens
+
+    def reconcile(
+        self, model: str, api_key: Optional[str], reserved: int, usage: Optional[dict]
+    ) -> None:
+        """
+        Corrects a reservation with the token usage reported in the response.
+        """
+        limit = self.limit_for(model, api_key)
+        if limit is None or not usage or "total_tokens" not in usage:
+            return
+        with self._lock:
+            self.stats.actual_tokens += usage["total_tokens"]
+        if usage["total_tokens"] != reserved:
+            self.backend.refund(self._key(model, api_key), limit, reserved - usage["total_tokens"])
+
+    async def areconcile(
+        self, model: str, api_key: Optional[str], reserved: int, usage: Optional[dict]
+    ) -> None:
+        """
+        Async version of `reconcile`.
+        """
+        limit = self.limit_for(model, api_key)
+        if limit is None or not usage or "total_tokens" not in usage:
+            return
+        with self._lock:
+            self.stats.actual_tokens += usage["total_tokens"]
+        if usage["total_tokens"] != reserved:
+            await self.backend.arefund(
+                self._key(model, api_key), limit, reserved - usage["total_tokens"]
+            )
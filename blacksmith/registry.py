@@ -0,0 +1,448 @@
+"""
+A tool registry served over HTTP, so tools can run on their own machines and scale separately from the
+workers driving the language model.
+
+Usage:
+```
+    # On the registry: serve the tools defined in `my_tools`
+    python -m blacksmith.registry my_tools --port 8000
+
+    # On the workers
+    from blacksmith.registry import RemoteToolRegistry
+    from blacksmith.tools import set_registry
+
+    set_registry(RemoteToolRegistry("http://tool-registry:8000"))
+```
+"""
+import time
+import asyncio
+import argparse
+import importlib
+import threading
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Optional
+from weakref import WeakKeyDictionary
+from blacksmith.config.constants import (
+    REGISTRY_BATCH_WINDOW,
+    REGISTRY_CONTAINER_NAME,
+    REGISTRY_HEALTH_CHECK_BACKOFF,
+    REGISTRY_HEALTH_CHECK_LIMIT,
+    REGISTRY_HEALTH_CHECK_RETRIES,
+    REGISTRY_MAX_BATCH_SIZE,
+    REGISTRY_POOL_SIZE,
+    REGISTRY_PORT,
+)
+from blacksmith.exceptions import BlacksmithError, ToolTimeoutError
+from blacksmith.tools import ToolRegistry, get_registry
+from blacksmith.utils.session import get_aiosession
+
+if TYPE_CHECKING:
+    from fastapi import FastAPI
+
+DEFAULT_REGISTRY_URL = f"http://{REGISTRY_CONTAINER_NAME}:{REGISTRY_PORT}"
+
+
+class RemoteToolError(BlacksmithError):
+    """
+    Raised when a tool raised on the registry.
+
+    Attributes:
+        tool (str): The name of the tool.
+        type (str): The name of the exception raised by the tool.
+    """
+
+    def __init__(self, tool: str, type: str, message: str) -> None:
+        super().__init__(f"{type}: {message}")
+        self.tool = tool
+        self.type = type
+
+
+class RegistryUnavailableError(BlacksmithError, ConnectionError):
+    """
+    Raised when the registry does not respond to health checks.
+    """
+
+
+async def _call(registry: ToolRegistry, call: dict) -> dict:
+    if call["tool"] not in registry.specs:
+        return {"error": {"type": "KeyError", "message": f"Unknown tool {call['tool']!r}"}}
+    try:
+        return {"result": await registry.ause_tool(call["tool"], call.get("args") or {})}
+    except ToolTimeoutError as e:
+        error = {"type": type(e).__name__, "message": str(e), "timeout": e.timeout}
+    except Exception as e:
+        error = {"type": type(e).__name__, "message": str(e)}
+    return {"error": error}
+
+
+def create_app(registry: Optional[ToolRegistry] = None) -> "FastAPI":
+    """
+    Creates an app serving the tools of `registry`, by default the tools registered with `@tool`.
+
+    Endpoints:
+        GET /health: Whether the registry is up, and how many tools it serves.
+        GET /tools: The function definitions of every tool.
+        POST /call: Runs one call, `{"tool": ..., "args": {...}}`.
+        POST /batch: Runs several calls concurrently, `{"calls": [...]}`, returning results in order.
+    """
+    from fastapi import FastAPI
+    from fastapi.encoders import jsonable_encoder
+
+    registry = registry or get_registry()
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "tools": len(registry.tools)}
+
+    @app.get("/tools")
+    async def tools():
+        return {"tools": registry.get_tools()}
+
+    @app.post("/call")
+    async def call(body: dict):
+        return jsonable_encoder(await _call(registry, body))
+
+    @app.post("/batch")
+    async def batch(body: dict):
+        results = await asyncio.gather(*(_call(registry, c) for c in body["calls"]))
+        return jsonable_encoder({"results": results})
+
+    return app
+
+
+def serve(modules: list[str], host: str = "0.0.0.0", port: int = REGISTRY_PORT) -> None:
+    """
+    Imports `modules`, registering the tools they define, and serves them.
+    """
+    import uvicorn
+
+    for module in modules:
+        importlib.import_module(module)
+    uvicorn.run(create_app(), host=host, port=port, log_level="warning")
+
+
+class RemoteToolRegistry(ToolRegistry):
+    """
+    A client for a tool registry served with `serve`.
+
+    Tool definitions are fetched once, on first use, after the registry passes a health check. Calls go
+    over pooled keep-alive connections. A call made while no other call is pending is sent right away,
+    and otherwise waits `batch_window` seconds for concurrent calls, which are sent together in one
+    request. Requests that cannot reach the registry are retried after another health check.
+
+    Tools registered locally with `@tool` while this registry is active run in-process, alongside the
+    remote ones.
+
+    Health checks are attempted `REGISTRY_HEALTH_CHECK_RETRIES` times, each with a timeout of
+    `REGISTRY_HEALTH_CHECK_LIMIT` seconds, backing off exponentially from `REGISTRY_HEALTH_CHECK_BACKOFF`
+    seconds.
+
+    Attributes:
+        url (str): The registry URL. Defaults to the registry container on the Docker network.
+        batch_window (float): How long to collect concurrent calls into a batch, in seconds. Defaults to 0.002.
+        max_batch_size (int): The maximum number of calls per request. Defaults to 64.
+        timeout (Optional[float]): The time a request to the registry may take, in seconds. Defaults to `None`.
+
+    Usage:
+    ```
+        set_registry(RemoteToolRegistry("http://tool-registry:8000"))
+        c = Conversation()
+        resp = c.ask("What is the weather in Paris?")
+        resp.execute_function_call()
+    ```
+    """
+
+    def __init__(
+        self,
+        url: str = DEFAULT_REGISTRY_URL,
+        batch_window: float = REGISTRY_BATCH_WINDOW,
+        max_batch_size: int = REGISTRY_MAX_BATCH_SIZE,
+        timeout: Optional[float] = None,
+    ) -> None:
+        super().__init__()
+        self.url = url.rstrip("/")
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self.remote_tools: dict[str, dict] = {}
+        self._connected = False
+        self._connect_lock = threading.Lock()
+        self._aconnecting: WeakKeyDictionary = WeakKeyDictionary()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+        # Remote calls in progress, which tell whether a new call should wait for others to batch with
+        self._active = 0
+        self._pending: Optional[list[tuple[dict, Future]]] = None
+        self._apending: WeakKeyDictionary = WeakKeyDictionary()
+        # Flushes in progress, referenced until they finish so they are not garbage collected
+        self._aflushing: set[asyncio.Task] = set()
+
+    @property
+    def session(self):
+        # Imported here, since only clients need requests
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        with self._session_lock:
+            if self._session is None:
+                self._session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=REGISTRY_POOL_SIZE)
+                self._session.mount("http://", adapter)
+                self._session.mount("https://", adapter)
+            return self._session
+
+    def health_check(self) -> None:
+        """
+        Waits until the registry responds, raising `RegistryUnavailableError` if it never does.
+        """
+        import requests
+
+        for attempt in range(REGISTRY_HEALTH_CHECK_RETRIES):
+            try:
+                response = self.session.get(
+                    f"{self.url}/health", timeout=REGISTRY_HEALTH_CHECK_LIMIT
+                )
+                if response.ok:
+                    return
+            except requests.RequestException:
+                pass
+            if attempt < REGISTRY_HEALTH_CHECK_RETRIES - 1:
+                time.sleep(REGISTRY_HEALTH_CHECK_BACKOFF * 2**attempt)
+        raise RegistryUnavailableError(f"Tool registry at {self.url} is unavailable.")
+
+    async def ahealth_check(self) -> None:
+        """
+        Async version of `health_check`.
+        """
+        import aiohttp
+
+        session = get_aiosession()
+        timeout = aiohttp.ClientTimeout(total=REGISTRY_HEALTH_CHECK_LIMIT)
+        for attempt in range(REGISTRY_HEALTH_CHECK_RETRIES):
+            try:
+                async with session.get(f"{self.url}/health", timeout=timeout) as response:
+                    if response.status < 400:
+                        return
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            if attempt < REGISTRY_HEALTH_CHECK_RETRIES - 1:
+                await asyncio.sleep(REGISTRY_HEALTH_CHECK_BACKOFF * 2**attempt)
+        raise RegistryUnavailableError(f"Tool registry at {self.url} is unavailable.")
+
+    def _set_remote_tools(self, tools: list[dict]) -> None:
+        # Call with `_connect_lock` held
+        self.remote_tools = {t["name"]: t for t in tools}
+        # Tools registered locally take precedence
+        for name, definition in self.remote_tools.items():
+            if name not in self.specs:
+                self.tools[name] = definition
+        self.version += 1
+        self._connected = True
+
+    def connect(self, refresh: bool = False) -> None:
+        """
+        Checks the registry is up and fetches its tool definitions. Only the first call does any work,
+        unless `refresh` is set.
+        """
+        if self._connected and not refresh:
+            return
+        with self._connect_lock:
+            if self._connected and not refresh:
+                return
+            self.health_check()
+            response = self.session.get(f"{self.url}/tools", timeout=self.timeout)
+            response.raise_for_status()
+            self._set_remote_tools(response.json()["tools"])
+
+    async def _aconnect(self) -> None:
+        import aiohttp
+
+        await self.ahealth_check()
+        async with get_aiosession().get(
+            f"{self.url}/tools", timeout=aiohttp.ClientTimeout(total=self.timeout)
+        ) as response:
+            response.raise_for_status()
+            tools = (await response.json())["tools"]
+        with self._connect_lock:
+            self._set_remote_tools(tools)
+
+    async def aconnect(self, refresh: bool = False) -> None:
+        """
+        Async version of `connect`. Concurrent calls on an event loop share one connection attempt.
+        """
+        if self._connected and not refresh:
+            return
+        loop = asyncio.get_running_loop()
+        task = self._aconnecting.get(loop)
+        if task is None:
+            task = self._aconnecting[loop] = loop.create_task(self._aconnect())
+            # Later calls check `_connected`, and retry if this attempt failed
+            task.add_done_callback(lambda _: self._aconnecting.pop(loop, None))
+        await asyncio.shield(task)
+
+    def get_tools(self) -> list[dict]:
+        self.connect()
+        return super().get_tools()
+
+    async def aget_tools(self) -> list[dict]:
+        await self.aconnect()
+        return ToolRegistry.get_tools(self)
+
+    @staticmethod
+    def _result(call: dict, response: dict) -> Any:
+        error = response.get("error")
+        if error is None:
+            return response["result"]
+        if error["type"] == "ToolTimeoutError":
+            raise ToolTimeoutError(call["tool"], error["timeout"])
+        raise RemoteToolError(call["tool"], error["type"], error["message"])
+
+    def _post_batch(self, calls: list[dict]) -> list[dict]:
+        import requests
+
+        self.connect()
+        for attempt in range(2):
+            try:
+                response = self.session.post(
+                    f"{self.url}/batch", json={"calls": calls}, timeout=self.timeout
+                )
+                response.raise_for_status()
+                return response.json()["results"]
+            except requests.ConnectionError:
+                # The registry may have restarted: wait for it, then try once more
+                if attempt:
+                    raise
+                self.health_check()
+
+    @staticmethod
+    def _settle(batch: list[tuple[dict, Future | asyncio.Future]], results: list[dict]) -> None:
+        # Calls the registry returned no result for fail, rather than waiting forever
+        for i, (call, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i < len(results):
+                future.set_result(results[i])
+            else:
+                future.set_exception(
+                    RemoteToolError(
+                        call["tool"],
+                        "RegistryError",
+                        f"The registry returned {len(results)} results for {len(batch)} calls",
+                    )
+                )
+
+    def _flush(self, batch: list[tuple[dict, Future]]) -> None:
+        try:
+            results = self._post_batch([call for call, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self._settle(batch, results)
+
+    def use_tool(self, tool_name, args):
+        if tool_name in self.specs:
+            return super().use_tool(tool_name, args)
+        call, future = {"tool": tool_name, "args": args}, Future()
+        with self._batch_lock:
+            self._active += 1
+            alone = self._active == 1
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = []
+            batch.append((call, future))
+            if len(batch) >= self.max_batch_size or alone:
+                # Later calls start a new batch
+                self._pending = None
+
+        try:
+            if leader:
+                # The first call of a batch waits for others to join if calls are pending, then sends them
+                if not alone:
+                    time.sleep(self.batch_window)
+                    with self._batch_lock:
+                        if self._pending is batch:
+                            self._pending = None
+                self._flush(batch)
+            return self._result(call, future.result())
+        finally:
+            with self._batch_lock:
+                self._active -= 1
+
+    async def _apost_batch(self, calls: list[dict]) -> list[dict]:
+        import aiohttp
+
+        session = get_aiosession()
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        for attempt in range(2):
+            try:
+                async with session.post(
+                    f"{self.url}/batch", json={"calls": calls}, timeout=timeout
+                ) as response:
+                    response.raise_for_status()
+                    return (await response.json())["results"]
+            except aiohttp.ClientConnectionError:
+                if attempt:
+                    raise
+                await self.ahealth_check()
+
+    async def _aflush(self, batch: list[tuple[dict, asyncio.Future]]) -> None:
+        try:
+            results = await self._apost_batch([call for call, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self._settle(batch, results)
+
+    def _aflush_pending(self, loop: asyncio.AbstractEventLoop) -> None:
+        batch = self._apending.pop(loop, None)
+        if batch:
+            task = loop.create_task(self._aflush(batch))
+            self._aflushing.add(task)
+            task.add_done_callback(self._aflushing.discard)
+
+    async def ause_tool(self, tool_name, args):
+        if tool_name in self.specs:
+            return await super().ause_tool(tool_name, args)
+        await self.aconnect()
+        loop = asyncio.get_running_loop()
+        call, future = {"tool": tool_name, "args": args}, loop.create_future()
+        with self._batch_lock:
+            self._active += 1
+            alone = self._active == 1
+        try:
+            batch = self._apending.get(loop)
+            if batch is None:
+                batch = self._apending[loop] = []
+                # Without other calls pending, only calls made in the same loop iteration are batched
+                if alone:
+                    loop.call_soon(self._aflush_pending, loop)
+                else:
+                    loop.call_later(self.batch_window, self._aflush_pending, loop)
+            batch.append((call, future))
+            if len(batch) >= self.max_batch_size:
+                self._aflush_pending(loop)
+            return self._result(call, await future)
+        finally:
+            with self._batch_lock:
+                self._active -= 1
+
+    def close(self) -> None:
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the tools defined in some modules.")
+    parser.add_argument("modules", nargs="+", help="Modules defining tools with @tool")
+    parser.add_argument("--host", default="0.0.0.0", help="The interface to listen on")
+    parser.add_argument("--port", type=int, default=REGISTRY_PORT, help="The port to listen on")
+    args = parser.parse_args()
+    serve(args.modules, host=args.host, port=args.port)
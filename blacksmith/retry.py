@@ -0,0 +1,291 @@
+import time
+import asyncio
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional, TypeVar
+from pydantic import BaseModel, PrivateAttr
+from blacksmith import metrics
+from blacksmith.exceptions import CompletionError, DeadlineExceededError, RetriesExhaustedError
+
+if TYPE_CHECKING:
+    from tenacity import RetryCallState
+
+T = TypeVar("T")
+
+
+@lru_cache(maxsize=None)
+def retryable_errors() -> tuple[type[Exception], ...]:
+    """
+    Returns the errors worth retrying: rate limits, timeouts, connection errors and server errors.
+    """
+    # Imported on first use, to keep `import blacksmith` fast
+    import openai
+
+    return (
+        openai.error.RateLimitError,
+        openai.error.ServiceUnavailableError,
+        openai.error.APIConnectionError,
+        openai.error.Timeout,
+        openai.error.TryAgain,
+    )
+
+
+# Duplicates of hedged requests are sent from their own threads, while the first request blocks its caller
+_hedge_lock = threading.Lock()
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    with _hedge_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(thread_name_prefix="blacksmith-hedge")
+        return _hedge_pool
+
+
+def is_retryable(e: BaseException) -> bool:
+    import openai
+
+    if isinstance(e, retryable_errors()):
+        return True
+    # Server errors are raised as `APIError`, with or without a status
+    return isinstance(e, openai.error.APIError) and (e.http_status or 500) >= 500
+
+
+def retry_after(e: BaseException) -> Optional[float]:
+    """
+    Returns the number of seconds the server asked us to wait, if any.
+    """
+    headers = getattr(e, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class RetryPolicy(BaseModel, defer_build=True):
+    """
+    How completion requests are retried and hedged.
+
+    Retries use exponential backoff, with full jitter by default, and wait at least as long as the
+    `Retry-After` header asks. Hedging sends a duplicate request once the first one has been outstanding
+    for longer than `hedge_after` seconds, or the `hedge_quantile` of recent latencies once enough have
+    been observed. Async requests use whichever finishes first. Synchronous requests send the first
+    request from the calling thread, so they wait for it and use the duplicate if it fails.
+
+    Attributes:
+        max_attempts (int): The maximum number of attempts per request. Defaults to 3.
+        initial_backoff (float): The backoff before the first retry, in seconds. Defaults to 0.5.
+        max_backoff (float): The maximum backoff between attempts, in seconds. Defaults to 30.
+        jitter (bool): Randomize backoff to avoid synchronized retries. Defaults to `True`.
+        deadline (Optional[float]): The total time a request may take across attempts, in seconds. Defaults to `None`.
+        request_timeout (Optional[float]): The time a single attempt may take, in seconds. Defaults to `None`.
+        hedge (bool): Send hedged requests. Defaults to `False`.
+        hedge_after (Optional[float]): A fixed hedging threshold, in seconds. Defaults to `None` (use the latency quantile).
+        hedge_quantile (float): The latency quantile used as the hedging threshold. Defaults to 0.95.
+        hedge_min_samples (int): Latencies to observe before hedging on the quantile. Defaults to 20.
+
+    Usage:
+    ```
+        cfg = Config(
+            model="gpt-3.5-turbo",
+            temperature=0.1,
+            retry=RetryPolicy(max_attempts=5, deadline=60, hedge=True),
+        )
+    ```
+    """
+
+    max_attempts: int = 3
+    initial_backoff: float = 0.5
+    max_backoff: float = 30
+    jitter: bool = True
+    deadline: Optional[float] = None
+    request_timeout: Optional[float] = None
+    hedge: bool = False
+    hedge_after: Optional[float] = None
+    hedge_quantile: float = 0.95
+    hedge_min_samples: int = 20
+
+    _latencies: deque = PrivateAttr(default_factory=lambda: deque(maxlen=500))
+
+    def observe(self, seconds: float) -> None:
+        """
+        Records the latency of a successful attempt.
+        """
+        self._latencies.append(seconds)
+
+    def hedge_threshold(self) -> Optional[float]:
+        """
+        Returns how long to wait before sending a hedged request, or `None` to not hedge.
+        """
+        if not self.hedge:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(int(len(latencies) * self.hedge_quantile), len(latencies) - 1)]
+
+    def _wait(self, retry_state: "RetryCallState") -> float:
+        from tenacity import wait_exponential, wait_random_exponential
+
+        backoff = (wait_random_exponential if self.jitter else wait_exponential)(
+            multiplier=self.initial_backoff, max=self.max_backoff
+        )(retry_state)
+        server = retry_after(retry_state.outcome.exception()) or 0
+        wait_for = max(backoff, server)
+        if self.deadline is not None:
+            # Never sleep past the deadline
+            wait_for = min(wait_for, max(self._remaining(retry_state), 0))
+        return wait_for
+
+    def _remaining(self, retry_state: "RetryCallState") -> float:
+        return self.deadline - (time.monotonic() - retry_state.start_time)
+
+    @staticmethod
+    def _before_sleep(retry_state: "RetryCallState") -> None:
+        error = type(retry_state.outcome.exception()).__name__
+        metrics.inc("blacksmith_retries_total", error=error)
+
+    def _stop(self):
+        from tenacity import stop_after_attempt, stop_after_delay
+
+        stop = stop_after_attempt(self.max_attempts)
+        if self.deadline is not None:
+            stop = stop | stop_after_delay(self.deadline)
+        return stop
+
+    def _attempt_timeout(self, start: float) -> Optional[float]:
+        if self.deadline is None:
+            return self.request_timeout
+        remaining = self.deadline - (time.monotonic() - start)
+        if remaining <= 0:
+            raise TimeoutError("Deadline exceeded")
+        return remaining if self.request_timeout is None else min(remaining, self.request_timeout)
+
+    def _error(self, attempts: int, start: float, e: Exception) -> CompletionError:
+        if self.deadline is not None and time.monotonic() - start >= self.deadline:
+            return DeadlineExceededError("Deadline exceeded", attempts, e)
+        if is_retryable(e):
+            return RetriesExhaustedError("Request failed", attempts, e)
+        return CompletionError("Request failed", attempts, e)
+
+    def call(self, create: Callable[[Optional[float]], T]) -> T:
+        """
+        Calls `create` with the timeout for the attempt until it succeeds, raising a `CompletionError` if it does not.
+        """
+        from tenacity import Retrying, retry_if_exception
+
+        start = time.monotonic()
+        retrying = Retrying(
+            stop=self._stop(),
+            wait=self._wait,
+            retry=retry_if_exception(is_retryable),
+            before_sleep=self._before_sleep,
+            reraise=True,
+        )
+        try:
+            for attempt in retrying:
+                with attempt:
+                    return self._hedged(create, self._attempt_timeout(start))
+        except Exception as e:
+            raise self._error(retrying.statistics.get("attempt_number", 1), start, e) from e
+
+    async def acall(self, create: Callable[[Optional[float]], Awaitable[T]]) -> T:
+        """
+        Async version of `call`.
+        """
+        from tenacity import AsyncRetrying, retry_if_exception
+
+        start = time.monotonic()
+        retrying = AsyncRetrying(
+            stop=self._stop(),
+            wait=self._wait,
+            retry=retry_if_exception(is_retryable),
+            before_sleep=self._before_sleep,
+            reraise=True,
+        )
+        try:
+            async for attempt in retrying:
+                with attempt:
+                    return await self._ahedged(create, self._attempt_timeout(start))
+        except Exception as e:
+            raise self._error(retrying.statistics.get("attempt_number", 1), start, e) from e
+
+    def _hedged(self, create: Callable[[Optional[float]], T], timeout: Optional[float]) -> T:
+        threshold = self.hedge_threshold()
+        started = time.perf_counter()
+        if threshold is None:
+            result = create(timeout)
+            self.observe(time.perf_counter() - started)
+            return result
+
+        # The first request runs on this thread, and only the duplicate is sent from the pool
+        finished = threading.Event()
+        context = contextvars.copy_context()
+
+        def duplicate() -> Optional[tuple[T, float]]:
+            # The threshold counts from when the first request started, not from when this job was picked up
+            if finished.wait(max(threshold - (time.perf_counter() - started), 0)):
+                return None
+            metrics.inc("blacksmith_hedges_total")
+            sent = time.perf_counter()
+            result = context.run(create, timeout)
+            return result, time.perf_counter() - sent
+
+        hedge = _get_hedge_pool().submit(duplicate)
+        try:
+            result = create(timeout)
+        except Exception:
+            finished.set()
+            # Fall back to the duplicate if it was sent, raising its error if it fails too
+            outcome = None if hedge.cancel() else hedge.result()
+            if outcome is None:
+                raise
+            result, seconds = outcome
+            self.observe(seconds)
+            return result
+        finished.set()
+        self.observe(time.perf_counter() - started)
+        return result
+
+    async def _ahedged(
+        self, create: Callable[[Optional[float]], Awaitable[T]], timeout: Optional[float]
+    ) -> T:
+        threshold = self.hedge_threshold()
+        if threshold is None:
+            sent = time.perf_counter()
+            result = await create(timeout)
+            self.observe(time.perf_counter() - sent)
+            return result
+
+        async def attempt() -> tuple[T, float]:
+            sent = time.perf_counter()
+            result = await create(timeout)
+            return result, time.perf_counter() - sent
+
+        pending = {asyncio.ensure_future(attempt())}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=threshold)
+            if not done:
+                metrics.inc("blacksmith_hedges_total")
+                pending.add(asyncio.ensure_future(attempt()))
+            # Use the first request to succeed, or the last error if both fail
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded or not pending:
+                    result, seconds = (succeeded or list(done))[0].result()
+                    self.observe(seconds)
+                    return result
+        finally:
+            for task in pending:
+                task.cancel()
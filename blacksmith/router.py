@@ -0,0 +1,387 @@
+import time
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional, TypeVar
+from pydantic import BaseModel
+from blacksmith import metrics
+from blacksmith.ratelimit import RateLimit, RateLimiter
+from blacksmith.retry import is_retryable
+
+T = TypeVar("T")
+
+
+class Endpoint(BaseModel, defer_build=True):
+    """
+    A deployment completions can be sent to: an API base URL, a key and a model.
+
+    Attributes:
+        name (Optional[str]): The name used in statistics and metrics. Defaults to the model and base URL.
+        model (Optional[str]): The model to request. Defaults to `None` (the model of the `Config`).
+        api_key (Optional[str]): The API key. Defaults to `None` (the key of the `Config`, if any, else the key set in `openai`).
+        api_base (Optional[str]): The API base URL, for compatible endpoints. Defaults to `None` (OpenAI).
+        api_type (Optional[str]): "open_ai" or "azure". Defaults to `None` (the type set in `openai`).
+        api_version (Optional[str]): The API version, for Azure deployments. Defaults to `None`.
+        deployment_id (Optional[str]): The deployment name, for Azure deployments. Defaults to `None`.
+        max_concurrency (Optional[int]): The maximum number of requests in flight. Defaults to `None` (no limit).
+        rate_limit (Optional[RateLimit]): A requests and tokens per minute budget. Defaults to `None` (no limit).
+    """
+
+    name: Optional[str] = None
+    model: Optional[str] = None
+    api_key: Optional[str] = None
+    api_base: Optional[str] = None
+    api_type: Optional[str] = None
+    api_version: Optional[str] = None
+    deployment_id: Optional[str] = None
+    max_concurrency: Optional[int] = None
+    rate_limit: Optional[RateLimit] = None
+
+    def credentials(self, api_key: Optional[str] = None) -> dict[str, str]:
+        """
+        Returns the arguments that send a request to this endpoint, leaving out unset ones.
+
+        `api_key` is used when the endpoint has no key of its own.
+        """
+        fields = ("api_key", "api_base", "api_type", "api_version", "deployment_id")
+        credentials = {f: getattr(self, f) for f in fields if getattr(self, f) is not None}
+        if "api_key" not in credentials and api_key is not None:
+            credentials["api_key"] = api_key
+        return credentials
+
+
+class EndpointStats(BaseModel, defer_build=True):
+    """
+    The state of an endpoint, as seen by a `Router`.
+
+    Attributes:
+        name (str): The endpoint name.
+        latency (Optional[float]): The moving average of successful request latencies, in seconds.
+        error_rate (float): The moving average of the failure rate, decayed since the last failure.
+        inflight (int): Requests in flight.
+        requests (int): Requests sent.
+        errors (int): Requests that failed and were failed over.
+    """
+
+    name: str
+    latency: Optional[float]
+    error_rate: float
+    inflight: int
+    requests: int
+    errors: int
+
+
+class _EndpointState:
+    def __init__(self, name: str, endpoint: Endpoint) -> None:
+        self.name = name
+        self.endpoint = endpoint
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.error_at = 0.0
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self.limiter = RateLimiter(default=endpoint.rate_limit) if endpoint.rate_limit else None
+
+    def available(self) -> bool:
+        cap = self.endpoint.max_concurrency
+        return cap is None or self.inflight < cap
+
+
+class Router:
+    """
+    Spreads completion requests over several endpoints, e.g. API keys, Azure deployments or compatible
+    servers, and fails over between them.
+
+    Each request goes to the endpoint with the lowest expected latency: the moving average of its latency,
+    scaled by the requests it already has in flight and by its recent error rate. Endpoints at their
+    `max_concurrency` are skipped, and requests wait for a slot when every endpoint is busy. A request that
+    fails with a retryable or authentication error is sent to the next best endpoint. Once every endpoint
+    has failed, the last error is raised to the `RetryPolicy`, which backs off and tries again. Streamed
+    requests keep their slot until the stream is exhausted or closed.
+
+    Endpoints that have not served a request yet are assumed to be as fast as the fastest one, so they are
+    tried early. The error rate of an endpoint halves every `recovery` seconds without errors, so
+    endpoints that failed are tried again once they may have recovered.
+
+    Attributes:
+        endpoints (list[Endpoint]): The endpoints to route to.
+        alpha (float): The weight of the latest sample in the moving averages. Defaults to 0.2.
+        recovery (float): The half-life of the error rate, in seconds. Defaults to 30.
+
+    Usage:
+    ```
+        router = Router([
+            Endpoint(name="primary", api_key="sk-...", max_concurrency=64),
+            Endpoint(name="secondary", api_key="sk-...", rate_limit=RateLimit(rpm=3_500, tpm=90_000)),
+            Endpoint(
+                name="azure",
+                api_type="azure",
+                api_base="https://example.openai.azure.com",
+                api_version="2023-07-01-preview",
+                api_key="...",
+                deployment_id="gpt-35-turbo",
+            ),
+        ])
+        cfg = Config(model="gpt-3.5-turbo", temperature=0.1, router=router)
+        ...
+        print(router.stats())
+    ```
+    """
+
+    def __init__(self, endpoints: list[Endpoint], alpha: float = 0.2, recovery: float = 30) -> None:
+        if not endpoints:
+            raise ValueError("A router needs at least one endpoint.")
+        self.endpoints = endpoints
+        self.alpha = alpha
+        self.recovery = recovery
+        self._states = [
+            _EndpointState(e.name or f"{e.model or 'default'}@{e.api_base or 'default'}#{i}", e)
+            for i, e in enumerate(endpoints)
+        ]
+        # Reentrant, as streams that are dropped without being closed release their slot when collected
+        self._lock = threading.RLock()
+        self._released = threading.Condition(self._lock)
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @property
+    def rate_limited(self) -> bool:
+        """
+        Whether any endpoint has a rate limit, which needs the estimated size of each request.
+        """
+        return any(s.limiter is not None for s in self._states)
+
+    def _error_rate(self, state: _EndpointState, now: float) -> float:
+        if not state.error_rate:
+            return 0.0
+        return state.error_rate * 0.5 ** ((now - state.error_at) / self.recovery)
+
+    def _score(self, state: _EndpointState, fastest: float, now: float) -> float:
+        latency = state.latency if state.latency is not None else fastest
+        success = max(1 - self._error_rate(state, now), 0.01)
+        return latency * (state.inflight + 1) / success
+
+    def _pick(self, tried: set[int]) -> tuple[Optional[int], bool]:
+        """
+        Reserves a slot on the best endpoint not in `tried`.
+
+        Returns its index, or `None` and whether an untried endpoint may free up. Call with the lock held.
+        """
+        candidates = [i for i in range(len(self._states)) if i not in tried]
+        available = [i for i in candidates if self._states[i].available()]
+        if not available:
+            return None, bool(candidates)
+        now = time.monotonic()
+        latencies = [s.latency for s in self._states if s.latency is not None]
+        fastest = min(latencies) if latencies else 1.0
+        best = min(available, key=lambda i: self._score(self._states[i], fastest, now))
+        state = self._states[best]
+        state.inflight += 1
+        state.requests += 1
+        return best, True
+
+    def _acquire(self, tried: set[int]) -> Optional[int]:
+        with self._lock:
+            while True:
+                index, pending = self._pick(tried)
+                if index is not None or not pending:
+                    return index
+                self._released.wait()
+
+    async def _aacquire(self, tried: set[int]) -> Optional[int]:
+        while True:
+            with self._lock:
+                index, pending = self._pick(tried)
+                if index is not None or not pending:
+                    return index
+                loop = asyncio.get_running_loop()
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            await waiter
+
+    def _release(self, index: int, latency: Optional[float], failed: bool) -> None:
+        # `latency` is `None` for requests that failed for reasons unrelated to the endpoint
+        state = self._states[index]
+        with self._lock:
+            state.inflight -= 1
+            now = time.monotonic()
+            if failed:
+                state.errors += 1
+                state.error_rate = self._error_rate(state, now) * (1 - self.alpha) + self.alpha
+                state.error_at = now
+            elif latency is not None:
+                state.error_rate = self._error_rate(state, now) * (1 - self.alpha)
+                state.error_at = now
+                state.latency = (
+                    latency
+                    if state.latency is None
+                    else state.latency * (1 - self.alpha) + latency * self.alpha
+                )
+            self._released.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(lambda w=waiter: w.done() or w.set_result(None))
+
+    @staticmethod
+    def _fails_over(e: Exception) -> bool:
+        import openai
+
+        return is_retryable(e) or isinstance(
+            e, (openai.error.AuthenticationError, openai.error.PermissionError)
+        )
+
+    def call(self, create: Callable[[Endpoint], T], tokens: int = 0, stream: bool = False) -> T:
+        """
+        Calls `create` with the best endpoint, failing over to the next best one on endpoint errors.
+
+        `tokens` is the estimated size of the request, for endpoints with a rate limit. With `stream`,
+        the endpoint is released once the returned stream is exhausted or closed.
+        """
+        tried: set[int] = set()
+        error: Optional[Exception] = None
+        while True:
+            index = self._acquire(tried)
+            if index is None:
+                raise error
+            state = self._states[index]
+            tried.add(index)
+            start = time.perf_counter()
+            try:
+                if state.limiter is not None:
+                    reserved = state.limiter.acquire(state.name, None, tokens)
+                    start = time.perf_counter()
+                result = create(state.endpoint)
+            except Exception as e:
+                failed = self._fails_over(e)
+                self._release(index, None, failed)
+                if not failed:
+                    raise
+                metrics.inc("blacksmith_failovers_total", endpoint=state.name)
+                error = e
+                continue
+            if stream:
+                return _Stream(self, index, result, start)
+            self._release(index, time.perf_counter() - start, False)
+            if state.limiter is not None:
+                state.limiter.reconcile(state.name, None, reserved, _usage(result))
+            return result
+
+    async def acall(
+        self, create: Callable[[Endpoint], Awaitable[T]], tokens: int = 0, stream: bool = False
+    ) -> T:
+        """
+        Async version of `call`.
+        """
+        tried: set[int] = set()
+        error: Optional[Exception] = None
+        while True:
+            index = await self._aacquire(tried)
+            if index is None:
+                raise error
+            state = self._states[index]
+            tried.add(index)
+            start = time.perf_counter()
+            try:
+                if state.limiter is not None:
+                    reserved = await state.limiter.aacquire(state.name, None, tokens)
+                    start = time.perf_counter()
+                result = await create(state.endpoint)
+            except Exception as e:
+                failed = self._fails_over(e)
+                self._release(index, None, failed)
+                if not failed:
+                    raise
+                metrics.inc("blacksmith_failovers_total", endpoint=state.name)
+                error = e
+                continue
+            if stream:
+                return _AsyncStream(self, index, result, start)
+            self._release(index, time.perf_counter() - start, False)
+            if state.limiter is not None:
+                await state.limiter.areconcile(state.name, None, reserved, _usage(result))
+            return result
+
+    def stats(self) -> list[EndpointStats]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                EndpointStats(
+                    name=s.name,
+                    latency=s.latency,
+                    error_rate=self._error_rate(s, now),
+                    inflight=s.inflight,
+                    requests=s.requests,
+                    errors=s.errors,
+                )
+                for s in self._states
+            ]
+
+
+def _usage(result: Any) -> Optional[dict]:
+    return result.get("usage") if hasattr(result, "get") else None
+
+
+class _Stream:
+    """
+    Wraps a streamed completion, holding the slot of its endpoint until the stream is exhausted, fails
+    or is closed.
+    """
+
+    def __init__(self, router: Router, index: int, chunks, start: float) -> None:
+        self._router = router
+        self._index = index
+        self._chunks = chunks
+        self._start = start
+        self._done = False
+
+    def _finish(self, error: Optional[BaseException] = None) -> None:
+        if self._done:
+            return
+        self._done = True
+        if error is None:
+            self._router._release(self._index, time.perf_counter() - self._start, False)
+        else:
+            failed = isinstance(error, Exception) and self._router._fails_over(error)
+            self._router._release(self._index, None, failed)
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self) -> Any:
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            self._finish()
+            raise
+        except BaseException as e:
+            self._finish(e)
+            raise
+
+    def close(self) -> None:
+        self._finish()
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+
+    def __del__(self) -> None:
+        self._finish()
+
+
+class _AsyncStream(_Stream):
+    def __aiter__(self) -> AsyncIterator:
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            self._finish()
+            raise
+        except BaseException as e:
+            self._finish(e)
+            raise
+
+    async def aclose(self) -> None:
+        self._finish()
+        aclose = getattr(self._chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
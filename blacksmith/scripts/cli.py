@@ -0,0 +1,298 @@
+"""
+The `blacksmith` command line.
+
+`blacksmith run` sends every job of a JSONL file to the model, a bounded number at a time, and appends a
+result line per job to an output JSONL. Jobs are read as they are needed, so the input is never loaded
+into memory. Jobs with a result in the output are skipped, so an interrupted run resumes where it
+stopped when started again with the same arguments.
+
+Usage:
+```
+    blacksmith run prompts.jsonl -o results.jsonl --model gpt-3.5-turbo --concurrency 16
+    blacksmith run reviews.jsonl -o labels.jsonl --options positive,negative,neutral
+    blacksmith run users.jsonl -o users.out.jsonl --schema my_app.schemas:User
+    blacksmith run requests.jsonl -o answers.jsonl --id-field request_id --template $'{title}\\n\\n{body}'
+```
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import importlib
+from typing import Any, Iterator, Optional, TextIO
+from blacksmith import metrics
+from blacksmith.context import Config
+from blacksmith.retry import RetryPolicy
+from blacksmith.llm import AsyncConversation, Choice, Schema, agenerate_from
+from blacksmith.utils.session import close_aiosession
+
+# Latency buckets of the live summary, in seconds
+SUMMARY_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 7.5, 10, 15, 20, 30, 60, 120)
+
+
+class RunSummary:
+    """
+    Throughput, latency and token usage of a run, printed as it progresses.
+
+    Latency quantiles are the upper bounds of fixed buckets, so memory does not grow with the run.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.skipped = 0
+        self.done = 0
+        self.failed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency = metrics.Histogram(SUMMARY_BUCKETS)
+
+    def record(self, latency: float, failed: bool) -> None:
+        if failed:
+            self.failed += 1
+        else:
+            self.done += 1
+            self.latency.observe(latency)
+
+    def record_usage(self, completion: Any) -> None:
+        usage = completion.get("usage") or {}
+        self.prompt_tokens += usage.get("prompt_tokens", 0)
+        self.completion_tokens += usage.get("completion_tokens", 0)
+
+    def line(self) -> str:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        tokens = self.prompt_tokens + self.completion_tokens
+        latency = (
+            f"p50 {self.latency.quantile(0.5):g}s p95 {self.latency.quantile(0.95):g}s"
+            if self.latency.count
+            else "p50 - p95 -"
+        )
+        return (
+            f"[{elapsed:7.1f}s] done {self.done} failed {self.failed} skipped {self.skipped} | "
+            f"{(self.done + self.failed) / elapsed:.2f} jobs/s | {latency} | "
+            f"tokens {self.prompt_tokens} in {self.completion_tokens} out "
+            f"({tokens / elapsed:.0f}/s)"
+        )
+
+
+def read_jobs(path: str, id_field: str) -> Iterator[tuple[str, dict]]:
+    """
+    Yields the id and body of every job in a JSONL file, one line at a time.
+
+    Jobs without an `id_field` are identified by their line number. Lines may also be bare JSON strings,
+    which are used as the prompt.
+    """
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{number}: invalid JSON ({e})") from None
+            if not isinstance(job, dict):
+                job = {"prompt": job}
+            yield str(job.get(id_field, number)), job
+
+
+def read_completed(path: str) -> set[str]:
+    """
+    Returns the ids of the jobs with a result in an output JSONL. Jobs that failed are not included, so
+    they are retried. A line cut short by an interrupted run is ignored.
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and "id" in record and "error" not in record:
+                completed.add(str(record["id"]))
+    return completed
+
+
+def open_output(path: str) -> TextIO:
+    """
+    Opens an output JSONL for appending, ending a line cut short by an interrupted run first.
+    """
+    out = open(path, "a+")
+    if out.tell():
+        out.seek(out.tell() - 1)
+        if out.read(1) != "\n":
+            out.write("\n")
+    return out
+
+
+def load_schema(target: str) -> Schema:
+    """
+    Imports a `Schema` from a "module:attribute" path.
+    """
+    module, _, attribute = target.partition(":")
+    if not attribute:
+        raise ValueError(f"Expected a schema as 'module:attribute', got {target!r}.")
+    return getattr(importlib.import_module(module), attribute)
+
+
+def render_prompt(job: dict, args: argparse.Namespace) -> str:
+    if args.template is not None:
+        return args.template.format(**job)
+    if args.prompt_field not in job:
+        raise KeyError(
+            f"Job has no {args.prompt_field!r} field; pass --prompt-field or --template."
+        )
+    return str(job[args.prompt_field])
+
+
+async def run_job(
+    job: dict, args: argparse.Namespace, config: Config, schema: Optional[Schema]
+) -> dict:
+    """
+    Runs one job, returning its result line (without the id).
+
+    Jobs with an `options` list, or every job when `--options` or `--schema` is passed, are generated with
+    `agenerate_from`. Other jobs are sent as a single prompt, after an optional system prompt.
+    """
+    prompt = render_prompt(job, args)
+    options = job.get("options") or args.options
+    if options:
+        return {"result": await agenerate_from(Choice(options=options), prompt, config=config)}
+    if schema is not None:
+        return {"result": await agenerate_from(schema, prompt, config=config)}
+
+    c = AsyncConversation(system_prompt=job.get("system", args.system), config=config)
+    resp = await c.ask(prompt, use_functions=False)
+    return {"response": resp.content, "usage": resp.usage}
+
+
+async def run(args: argparse.Namespace) -> int:
+    """
+    Runs every job of `args.input` not yet in `args.output`. Returns the number of jobs that failed.
+    """
+    schema = load_schema(args.schema) if args.schema else None
+    completed = read_completed(args.output)
+    summary = RunSummary()
+    # Unset options fall back to the defaults read from the environment
+    defaults = {"model": args.model, "temperature": args.temperature}
+    config = Config(
+        **{k: v for k, v in defaults.items() if v is not None},
+        retry=RetryPolicy(max_attempts=args.retries),
+        on_completion=[summary.record_usage],
+    )
+    # Bounded, so the input is read only as fast as jobs are started
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency * 2)
+
+    async def produce() -> None:
+        for id, job in read_jobs(args.input, args.id_field):
+            if id in completed:
+                summary.skipped += 1
+                continue
+            # Duplicated ids run once
+            completed.add(id)
+            await queue.put((id, job))
+        for _ in range(args.concurrency):
+            await queue.put(None)
+
+    async def work(out: TextIO) -> None:
+        while (item := await queue.get()) is not None:
+            id, job = item
+            start = time.perf_counter()
+            try:
+                record = {"id": id, **await run_job(job, args, config, schema)}
+            except Exception as e:
+                record = {"id": id, "error": f"{type(e).__name__}: {e}"}
+            latency = time.perf_counter() - start
+            summary.record(latency, "error" in record)
+            record["latency"] = round(latency, 4)
+            # Written and flushed as soon as a job finishes, so an interrupted run loses no results
+            out.write(json.dumps(record, default=str) + "\n")
+            out.flush()
+
+    async def report() -> None:
+        while True:
+            await asyncio.sleep(args.progress_interval)
+            print(summary.line(), file=sys.stderr, flush=True)
+
+    reporter = asyncio.create_task(report()) if args.progress_interval > 0 else None
+    try:
+        with open_output(args.output) as out:
+            await asyncio.gather(produce(), *(work(out) for _ in range(args.concurrency)))
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+        print(summary.line(), file=sys.stderr, flush=True)
+        await close_aiosession()
+    return summary.failed
+
+
+def _options(value: str) -> list[str]:
+    return [o.strip() for o in value.split(",") if o.strip()]
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="blacksmith", description="The blacksmith command line.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser(
+        "run",
+        help="Run a JSONL file of prompts or generation jobs",
+        description=__doc__.split("\n\n")[1].strip(),
+    )
+    run_parser.add_argument("input", help="The JSONL file of jobs")
+    run_parser.add_argument("-o", "--output", required=True, help="The JSONL file of results")
+    run_parser.add_argument("-c", "--concurrency", type=int, default=8, help="Jobs in flight")
+    run_parser.add_argument("--model", default=None, help="The model. Defaults to $MODEL")
+    run_parser.add_argument(
+        "--temperature", type=float, default=None, help="The temperature. Defaults to $TEMPERATURE"
+    )
+    run_parser.add_argument("--retries", type=int, default=3, help="Attempts per completion")
+    run_parser.add_argument("--system", default="", help="The system prompt of prompt jobs")
+    run_parser.add_argument("--id-field", default="id", help="The field identifying a job")
+    run_parser.add_argument("--prompt-field", default="prompt", help="The field holding the prompt")
+    run_parser.add_argument(
+        "--template",
+        default=None,
+        help="A format string over the job fields, e.g. '{title}: {body}'",
+    )
+    run_parser.add_argument(
+        "--options", type=_options, default=None, help="Comma-separated options to classify into"
+    )
+    run_parser.add_argument(
+        "--schema", default=None, help="A Schema to generate, as 'module:attribute'"
+    )
+    run_parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=5,
+        help="Seconds between summaries, 0 to only print the last one",
+    )
+    args = parser.parse_args(argv)
+
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    # Checked up front, rather than sending every job without a model or temperature
+    defaults = Config()
+    missing = [
+        f"--{name} (or ${name.upper()})"
+        for name in ("model", "temperature")
+        if getattr(args, name) is None and getattr(defaults, name) is None
+    ]
+    if missing:
+        parser.error(f"the following settings are required: {', '.join(missing)}")
+
+    try:
+        failed = asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print(
+            f"Interrupted. Results so far are in {args.output}; run the same command to resume.",
+            file=sys.stderr,
+        )
+        return 130
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+import os
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Iterable, Optional
+from urllib.parse import quote, unquote
+
+# Maximum number of ids per `IN (...)` query, below SQLite's default variable limit
+_SQLITE_BATCH_SIZE = 500
+
+
+class ConversationStore(ABC):
+    """
+    Base class for conversation stores.
+
+    Conversations are kept as append-only logs of message records, the dicts sent to the API plus an
+    `observation` flag, keyed by conversation id. Subclasses implement `append`, `replace`, `load_many` and
+    `delete`.
+    """
+
+    @abstractmethod
+    def append(self, conversation_id: str, records: list[dict]) -> None:
+        """
+        Appends records to the end of a conversation, creating it if needed.
+        """
+
+    @abstractmethod
+    def replace(self, conversation_id: str, records: list[dict]) -> None:
+        """
+        Replaces every record of a conversation, e.g. after the history was cleared.
+        """
+
+    @abstractmethod
+    def load_many(self, conversation_ids: Iterable[str]) -> dict[str, list[dict]]:
+        """
+        Returns the records of several conversations, skipping unknown ids.
+        """
+
+    def load(self, conversation_id: str) -> Optional[list[dict]]:
+        """
+        Returns the records of a conversation, or `None` if it does not exist.
+        """
+        return self.load_many([conversation_id]).get(conversation_id)
+
+    @abstractmethod
+    def delete(self, conversation_id: str) -> None:
+        ...
+
+
+class SQLiteStore(ConversationStore):
+    """
+    A conversation store backed by a SQLite database.
+
+    Each message is a row, so saving a turn inserts only the new messages. The database can be shared by
+    several processes on the same machine.
+
+    Attributes:
+        path (str): The path to the database file.
+
+    Usage:
+    ```
+        store = SQLiteStore(".blacksmith/conversations.db")
+    ```
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages "
+            "(conversation_id TEXT NOT NULL, seq INTEGER NOT NULL, record TEXT NOT NULL, "
+            "PRIMARY KEY (conversation_id, seq)) WITHOUT ROWID"
+        )
+
+    def _insert(self, conversation_id: str, start: int, records: list[dict]) -> None:
+        self._db.executemany(
+            "INSERT INTO messages (conversation_id, seq, record) VALUES (?, ?, ?)",
+            [(conversation_id, start + i, json.dumps(r)) for i, r in enumerate(records)],
+        )
+
+    def append(self, conversation_id: str, records: list[dict]) -> None:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                (start,) = self._db.execute(
+                    "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE conversation_id = ?",
+                    (conversation_id,),
+                ).fetchone()
+                self._insert(conversation_id, start, records)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def replace(self, conversation_id: str, records: list[dict]) -> None:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "DELETE FROM messages WHERE conversation_id = ?", (conversation_id,)
+                )
+                self._insert(conversation_id, 0, records)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def load_many(self, conversation_ids: Iterable[str]) -> dict[str, list[dict]]:
+        ids = list(dict.fromkeys(conversation_ids))
+        loaded: dict[str, list[dict]] = {}
+        with self._lock:
+            for i in range(0, len(ids), _SQLITE_BATCH_SIZE):
+                batch = ids[i : i + _SQLITE_BATCH_SIZE]
+                rows = self._db.execute(
+                    "SELECT conversation_id, record FROM messages "
+                    f"WHERE conversation_id IN ({','.join('?' * len(batch))}) "
+                    "ORDER BY conversation_id, seq",
+                    batch,
+                ).fetchall()
+                for conversation_id, record in rows:
+                    loaded.setdefault(conversation_id, []).append(json.loads(record))
+        return loaded
+
+    def delete(self, conversation_id: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+
+
+class JSONLStore(ConversationStore):
+    """
+    A conversation store keeping one JSON Lines file per conversation in a directory.
+
+    Saving a turn appends the new messages to the file in a single write. Replacing a conversation appends
+    a reset marker, so files are never rewritten in place.
+
+    Attributes:
+        directory (str): The directory holding the files. Created if needed.
+
+    Usage:
+    ```
+        store = JSONLStore(".blacksmith/conversations")
+    ```
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, conversation_id: str) -> str:
+        return os.path.join(self.directory, quote(conversation_id, safe="") + ".jsonl")
+
+    def _write(self, conversation_id: str, lines: list[dict]) -> None:
+        data = "".join(json.dumps(line) + "\n" for line in lines)
+        fd = os.open(self._path(conversation_id), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data.encode())
+        finally:
+            os.close(fd)
+
+    def append(self, conversation_id: str, records: list[dict]) -> None:
+        self._write(conversation_id, records)
+
+    def replace(self, conversation_id: str, records: list[dict]) -> None:
+        self._write(conversation_id, [{"reset": True}] + records)
+
+    def load_many(self, conversation_ids: Iterable[str]) -> dict[str, list[dict]]:
+        loaded: dict[str, list[dict]] = {}
+        for conversation_id in conversation_ids:
+            try:
+                with open(self._path(conversation_id)) as f:
+                    records = []
+                    for line in f:
+                        record = json.loads(line)
+                        if record.get("reset"):
+                            records = []
+                        else:
+                            records.append(record)
+            except FileNotFoundError:
+                continue
+            loaded[conversation_id] = records
+        return loaded
+
+    def delete(self, conversation_id: str) -> None:
+        try:
+            os.remove(self._path(conversation_id))
+        except FileNotFoundError:
+            pass
+
+    def ids(self) -> list[str]:
+        """
+        Returns the ids of every stored conversation.
+        """
+        return [
+            unquote(name[: -len(".jsonl")])
+            for name in os.listdir(self.directory)
+            if name.endswith(".jsonl")
+        ]
+
+
+class RedisStore(ConversationStore):
+    """
+    A conversation store keeping each conversation in a Redis list.
+
+    Saving a turn pushes the new messages, and `load_many` fetches every conversation in one round trip.
+
+    Attributes:
+        url (str): The Redis URL. Defaults to "redis://localhost:6379/0".
+        prefix (str): The prefix for conversation keys. Defaults to "blacksmith:conversation:".
+        ttl (Optional[int]): The number of seconds a conversation is kept after its last save. Defaults to `None` (forever).
+
+    Usage:
+    ```
+        store = RedisStore("redis://localhost:6379/0", ttl=7 * 24 * 3600)
+    ```
+    """
+
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        prefix: str = "blacksmith:conversation:",
+        ttl: Optional[int] = None,
+    ) -> None:
+        import redis
+
+        self.prefix = prefix
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url)
+
+    def _push(self, conversation_id: str, records: list[dict], reset: bool) -> None:
+        key = self.prefix + conversation_id
+        pipe = self._client.pipeline(transaction=True)
+        if reset:
+            pipe.delete(key)
+        if records:
+            pipe.rpush(key, *(json.dumps(r) for r in records))
+        if self.ttl is not None:
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def append(self, conversation_id: str, records: list[dict]) -> None:
+        self._push(conversation_id, records, reset=False)
+
+    def replace(self, conversation_id: str, records: list[dict]) -> None:
+        self._push(conversation_id, records, reset=True)
+
+    def load_many(self, conversation_ids: Iterable[str]) -> dict[str, list[dict]]:
+        ids = list(dict.fromkeys(conversation_ids))
+        pipe = self._client.pipeline(transaction=False)
+        for conversation_id in ids:
+            pipe.exists(self.prefix + conversation_id)
+            pipe.lrange(self.prefix + conversation_id, 0, -1)
+        results = pipe.execute()
+        return {
+            conversation_id: [json.loads(r) for r in records]
+            for conversation_id, exists, records in zip(ids, results[::2], results[1::2])
+            if exists
+        }
+
+    def delete(self, conversation_id: str) -> None:
+        self._client.delete(self.prefix + conversation_id)
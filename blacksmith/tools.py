@@ -1,40 +1,361 @@
 import json
+import asyncio
+import inspect
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Coroutine, Literal, Optional
+from pydantic import BaseModel
+from blacksmith import metrics
+from blacksmith.cache import (
+    CacheStats,
+    CompletionCache,
+    MemoryCache,
+    SQLiteCache,
+    TieredCache,
+    request_key,
+)
+from blacksmith.config.constants import TOOL_THREAD_POOL_SIZE, TOOL_PROCESS_POOL_SIZE
+from blacksmith.exceptions import ToolTimeoutError
 from blacksmith.utils.tools import tool_to_json_func
 
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+ToolKind = Literal["sync", "async", "cpu"]
+
+
+class ToolCache(BaseModel, defer_build=True):
+    """
+    How the results of a tool are memoized.
+
+    Calls are keyed on a canonical hash of the tool name and arguments, or of whatever `key` returns for the
+    arguments. Concurrent identical calls share one execution, and calls that raise are not cached.
+
+    Attributes:
+        maxsize (int): The maximum number of results to keep in memory, evicting the least recently used. Defaults to 1024.
+        ttl (Optional[float]): The number of seconds a result stays valid. Defaults to `None` (no expiry).
+        key (Optional[Callable[[dict], Any]]): Maps the arguments to the cache key. Defaults to `None` (all arguments).
+        path (Optional[str]): A SQLite database persisting results across processes. Results must be
+            JSON-serializable. Defaults to `None` (memory only).
+
+    Usage:
+    ```
+        @tool(
+            name="Search",
+            description="Searches the knowledge base",
+            params={"query": "The search query"},
+            cache=ToolCache(maxsize=10_000, ttl=3600, key=lambda args: args["query"].lower()),
+        )
+        def search(query: str):
+            ...
+    ```
+    """
+
+    maxsize: int = 1024
+    ttl: Optional[float] = None
+    key: Optional[Callable[[dict], Any]] = None
+    path: Optional[str] = None
+
+    def build(self) -> CompletionCache:
+        memory = MemoryCache(maxsize=self.maxsize, ttl=self.ttl)
+        if self.path is None:
+            return memory
+        return TieredCache(memory, SQLiteCache(self.path, ttl=self.ttl))
+
+
+class ToolSpec(BaseModel, defer_build=True, arbitrary_types_allowed=True):
+    """
+    How a registered tool is executed.
+
+    Attributes:
+        func (Callable): The tool function.
+        kind (ToolKind): "sync" tools run on a thread pool, "async" tools on an event loop, and
+            "cpu" tools on a process pool.
+        timeout (Optional[float]): The number of seconds a call may take. Defaults to `None` (no limit).
+        cache (Optional[CompletionCache]): The cache memoizing results. Defaults to `None` (no caching).
+        cache_key (Optional[Callable[[dict], Any]]): Maps the arguments to the cache key. Defaults to `None`.
+    """
+
+    func: Callable
+    kind: ToolKind = "sync"
+    timeout: Optional[float] = None
+    cache: Optional[CompletionCache] = None
+    cache_key: Optional[Callable[[dict], Any]] = None
+
+
+class ToolExecutor:
+    """
+    Runs tools on managed worker pools. Pools are created on first use.
+
+    Timed out calls are abandoned rather than interrupted, since threads cannot be cancelled.
+    Synchronous tools without a timeout run inline on the caller's thread.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._processes: Optional["ProcessPoolExecutor"] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+
+    @property
+    def threads(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(
+                    max_workers=TOOL_THREAD_POOL_SIZE, thread_name_prefix="blacksmith-tool"
+                )
+            return self._threads
+
+    @property
+    def processes(self) -> "ProcessPoolExecutor":
+        with self._lock:
+            if self._processes is None:
+                # Imported here, since process pools pull in multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                self._processes = ProcessPoolExecutor(max_workers=TOOL_PROCESS_POOL_SIZE)
+            return self._processes
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        # Event loop on a background thread, for running async tools from synchronous code
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever, name="blacksmith-tool-loop", daemon=True
+                )
+                self._loop_thread.start()
+            return self._loop
+
+    def submit(self, coro: Coroutine) -> Future:
+        """
+        Schedules a coroutine on the tool loop from synchronous code.
+
+        Raises `RuntimeError` when called from the tool loop itself, since blocking on the result there would
+        deadlock. Async tools should await the coroutine instead.
+        """
+        loop = self.loop
+        if threading.current_thread() is self._loop_thread:
+            coro.close()
+            raise RuntimeError(
+                "cannot wait for the tool loop from one of its own tools; await the async version instead"
+            )
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+    def run(self, name: str, spec: ToolSpec, args: dict) -> Any:
+        """
+        Runs a tool from synchronous code, raising `ToolTimeoutError` if it takes longer than its timeout.
+        """
+        if spec.kind == "async":
+            future = self.submit(spec.func(**args))
+        elif spec.kind == "cpu":
+            future = self.processes.submit(spec.func, **args)
+        elif spec.timeout is None:
+            return spec.func(**args)
+        else:
+            future = self.threads.submit(spec.func, **args)
+
+        try:
+            return future.result(timeout=spec.timeout)
+        except TimeoutError:
+            # The tool itself may raise `TimeoutError`
+            if future.done():
+                raise
+            future.cancel()
+            raise ToolTimeoutError(name, spec.timeout)
+
+    async def arun(self, name: str, spec: ToolSpec, args: dict) -> Any:
+        """
+        Runs a tool from the running event loop, raising `ToolTimeoutError` if it takes longer than its timeout.
+        """
+        if spec.kind == "async":
+            task = asyncio.ensure_future(spec.func(**args))
+        else:
+            pool = self.processes if spec.kind == "cpu" else self.threads
+            task = asyncio.get_running_loop().run_in_executor(pool, partial(spec.func, **args))
+
+        try:
+            done, _ = await asyncio.wait({task}, timeout=spec.timeout)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if not done:
+            task.cancel()
+            raise ToolTimeoutError(name, spec.timeout)
+        return task.result()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._threads is not None:
+                self._threads.shutdown(wait=False, cancel_futures=True)
+            if self._processes is not None:
+                self._processes.shutdown(wait=False, cancel_futures=True)
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+            self._threads = self._processes = self._loop = self._loop_thread = None
+
 
 class ToolRegistry:
     def __init__(self) -> None:
         self.tools = {}
         self.funcs = {}
+        self.specs = {}
+        self.executor = ToolExecutor()
+        # Incremented on every registration, invalidating the prebuilt tool list
+        self.version = 0
+        self._tool_list = []
+        self._tool_list_version = 0
 
-    def register_tool(self, name, func, description, params):
+    def register_tool(self, name, func, description, params, kind=None, timeout=None, cache=None):
         try:
             tool_json_str = tool_to_json_func(
                 name=name, description=description, func=func, params_desc=params
             )
-            self.tools[name] = tool_json_str
+            if kind is None:
+                kind = "async" if inspect.iscoroutinefunction(func) else "sync"
+            if cache is True:
+                cache = ToolCache()
+            self.tools[name] = json.loads(tool_json_str)
             self.funcs[name] = func
+            self.specs[name] = ToolSpec(
+                func=func,
+                kind=kind,
+                timeout=timeout,
+                cache=cache.build() if cache else None,
+                cache_key=cache.key if cache else None,
+            )
+            self.version += 1
         except Exception as e:
             print(f"Error registering {name}: {e}")
 
-    def get_tools(self) -> list[str]:
-        return [json.loads(v) for v in self.tools.values()]
+    def get_tools(self) -> list[dict]:
+        """
+        Returns the function definitions of all registered tools.
+        The list is shared between callers and rebuilt only after a new tool is registered.
+        """
+        if self._tool_list_version != self.version:
+            self._tool_list = list(self.tools.values())
+            self._tool_list_version = self.version
+        return self._tool_list
+
+    async def aget_tools(self) -> list[dict]:
+        """
+        Async version of `get_tools`.
+        """
+        return self.get_tools()
+
+    @staticmethod
+    def _cache_key(tool_name: str, spec: ToolSpec, args: dict) -> str:
+        key = spec.cache_key(args) if spec.cache_key is not None else args
+        return request_key({"tool": tool_name, "key": key})
+
+    @staticmethod
+    def _count(tool_name: str, fresh: bool) -> None:
+        metrics.inc(
+            "blacksmith_cache_total",
+            cache="tool",
+            tool=tool_name,
+            result="miss" if fresh else "hit",
+        )
 
     def use_tool(self, tool_name, args):
-        func = self.funcs[tool_name]
-        return func(**args)
+        spec = self.specs[tool_name]
+        if spec.cache is None:
+            return self.executor.run(tool_name, spec, args)
+        # Results are wrapped, so that tools returning `None` are cached too
+        value, fresh = spec.cache.get_or_create(
+            self._cache_key(tool_name, spec, args),
+            lambda: {"result": self.executor.run(tool_name, spec, args)},
+        )
+        self._count(tool_name, fresh)
+        return value["result"]
+
+    async def ause_tool(self, tool_name, args):
+        spec = self.specs[tool_name]
+        if spec.cache is None:
+            return await self.executor.arun(tool_name, spec, args)
+
+        async def create() -> dict:
+            return {"result": await self.executor.arun(tool_name, spec, args)}
+
+        value, fresh = await spec.cache.aget_or_create(
+            self._cache_key(tool_name, spec, args), create
+        )
+        self._count(tool_name, fresh)
+        return value["result"]
+
+    def cache_stats(self) -> dict[str, CacheStats]:
+        """
+        Returns the cache statistics of every tool with a cache, keyed on tool name.
+        """
+        return {
+            name: spec.cache.stats for name, spec in self.specs.items() if spec.cache is not None
+        }
+
+    def clear_cache(self, tool_name: Optional[str] = None) -> None:
+        """
+        Clears the cached results of a tool, or of every tool.
+        """
+        for name, spec in self.specs.items():
+            if spec.cache is not None and tool_name in (None, name):
+                spec.cache.clear()
 
 
 registry = ToolRegistry()
 
 
-def tool(name, description, params):
+def tool(
+    name: str,
+    description: str,
+    params: dict,
+    kind: Optional[ToolKind] = None,
+    timeout: Optional[float] = None,
+    cache: bool | ToolCache = False,
+):
+    """
+    Registers a function as a tool the language model can call.
+
+    Args:
+        name (str): The name of the tool.
+        description (str): A description of what the tool does.
+        params (dict): A description of each parameter.
+        kind (Optional[ToolKind]): "sync", "async" or "cpu". Defaults to "async" for coroutine functions, otherwise "sync".
+            "cpu" tools run in a separate process, so they must be defined at module level.
+        timeout (Optional[float]): The number of seconds a call may take. Defaults to `None` (no limit).
+        cache (bool | ToolCache): Memoize results, with `True` using the default `ToolCache`. Only use this for
+            tools that return the same result for the same arguments. Defaults to `False`.
+    """
+
     def decorator(func):
-        registry.register_tool(name=name, func=func, description=description, params=params)
+        registry.register_tool(
+            name=name,
+            func=func,
+            description=description,
+            params=params,
+            kind=kind,
+            timeout=timeout,
+            cache=cache,
+        )
+        return func
 
     return decorator
 
 
+def get_registry() -> ToolRegistry:
+    return registry
+
+
+def set_registry(new: ToolRegistry) -> None:
+    """
+    Replaces the registry used by `@tool`, `use_tool` and `get_tools`, e.g. with a `RemoteToolRegistry`.
+    """
+    global registry
+    registry = new
+
+
 def use_tool(tool_name: str, args: dict):
     """
     Make an API request to a tool.
@@ -44,5 +365,26 @@ def use_tool(tool_name: str, args: dict):
     return registry.use_tool(tool_name=tool_name, args=args)
 
 
+async def ause_tool(tool_name: str, args: dict):
+    """
+    Async version of `use_tool`.
+    """
+    return await registry.ause_tool(tool_name=tool_name, args=args)
+
+
 def get_tools():
     return registry.get_tools()
+
+
+async def aget_tools():
+    """
+    Async version of `get_tools`.
+    """
+    return await registry.aget_tools()
+
+
+def tool_cache_stats() -> dict[str, CacheStats]:
+    """
+    Returns the cache statistics of every tool with a cache, keyed on tool name.
+    """
+    return registry.cache_stats()
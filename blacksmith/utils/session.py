@@ -0,0 +1,33 @@
+import asyncio
+from typing import TYPE_CHECKING
+from weakref import WeakKeyDictionary
+from blacksmith.config.constants import AIOHTTP_POOL_LIMIT
+
+if TYPE_CHECKING:
+    import aiohttp
+
+# One pooled session per event loop, since aiohttp sessions cannot be shared across loops
+_sessions: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def get_aiosession() -> "aiohttp.ClientSession":
+    """
+    Returns the pooled `aiohttp.ClientSession` for the running event loop, creating it on first use.
+    """
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=AIOHTTP_POOL_LIMIT))
+        _sessions[loop] = session
+    return session
+
+
+async def close_aiosession() -> None:
+    """
+    Closes the pooled session for the running event loop. Call this before the loop shuts down.
+    """
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
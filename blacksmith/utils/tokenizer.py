@@ -1,6 +1,67 @@
-import tiktoken
+import os
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, Optional
+
+if TYPE_CHECKING:
+    import tiktoken
+
+# Fallback encoding for models tiktoken does not know about
+DEFAULT_ENCODING = "cl100k_base"
+
+# Tokens added by the chat format around every message, and to prime the reply
+# https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+
+@lru_cache(maxsize=None)
+def get_encoder(model: str | None) -> "tiktoken.Encoding":
+    """
+    Returns the tiktoken encoding for `model`. Encoders are loaded on first use and cached.
+    """
+    # Imported here, since tiktoken and its BPE files take a while to load
+    import tiktoken
+
+    if model is None:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
 
 
 def get_encodings(model: str, token: str) -> list[int]:
-    enc = tiktoken.encoding_for_model(model)
-    return enc.encode(token)
+    return get_encoder(model).encode(token)
+
+
+def count_tokens(model: str, text: str) -> int:
+    return len(get_encoder(model).encode(text))
+
+
+def warm_tokenizers(models: Iterable[Optional[str]], cache_dir: Optional[str] = None) -> None:
+    """
+    Loads the encoders for `models` ahead of time.
+
+    tiktoken downloads the BPE file of an encoding on first use and caches it in `TIKTOKEN_CACHE_DIR`.
+    Warming the tokenizers while building an image, with the same `cache_dir` set at runtime, lets
+    environments without network access count tokens.
+
+    Usage:
+    ```
+        python -m blacksmith.utils.tokenizer --cache-dir /opt/tiktoken gpt-3.5-turbo gpt-4
+    ```
+    """
+    if cache_dir is not None:
+        os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+    for model in models:
+        get_encoder(model)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Download and cache tiktoken encoders.")
+    parser.add_argument("models", nargs="*", default=[None], help="Models to load encoders for")
+    parser.add_argument("--cache-dir", default=None, help="Directory for the BPE files")
+    args = parser.parse_args()
+    warm_tokenizers(args.models, cache_dir=args.cache_dir)
@@ -0,0 +1,250 @@
+"""
+Fixtures shared by the test suite.
+
+Requests never leave the process: `openai_api` replaces the chat-completions and embeddings endpoints of
+the `openai` client with `FakeOpenAI`, and tokenizers are replaced with `FakeEncoding`, which counts one
+token per word so that token budgets are easy to reason about.
+"""
+import json
+import time
+import asyncio
+import hashlib
+from typing import Any, Callable
+import pytest
+from blacksmith import metrics
+from blacksmith.context import Config
+from blacksmith.tools import ToolRegistry, get_registry, set_registry
+from blacksmith.utils import tokenizer
+
+
+class FakeEncoding:
+    """
+    A tokenizer with one token per whitespace-separated word.
+    """
+
+    name = "fake"
+
+    def encode(self, text: str, **kwargs) -> list[int]:
+        return [self._token(word) for word in text.split()]
+
+    def encode_batch(self, texts: list[str], **kwargs) -> list[list[int]]:
+        return [self.encode(text) for text in texts]
+
+    def encode_ordinary(self, text: str) -> list[int]:
+        return self.encode(text)
+
+    @staticmethod
+    def _token(word: str) -> int:
+        return int(hashlib.sha256(word.encode()).hexdigest()[:6], 16)
+
+
+def fake_completion(request: dict) -> dict:
+    """
+    Answers a chat-completions request: calls the forced or first function with arguments filled in from
+    its schema, or echoes the last message.
+    """
+    functions = request.get("functions")
+    if functions:
+        function_call = request.get("function_call")
+        name = function_call["name"] if isinstance(function_call, dict) else functions[0]["name"]
+        function = next(f for f in functions if f["name"] == name)
+        args = {}
+        for key, prop in function["parameters"].get("properties", {}).items():
+            if "enum" in prop:
+                args[key] = prop["enum"][0]
+            elif prop.get("type") == "array":
+                args[key] = []
+            elif prop.get("type") == "integer":
+                args[key] = 1
+            else:
+                args[key] = "x"
+        message = {
+            "role": "assistant",
+            "content": None,
+            "function_call": {"name": name, "arguments": json.dumps(args)},
+        }
+    else:
+        message = {"role": "assistant", "content": "echo: " + request["messages"][-1]["content"]}
+    prompt_tokens = sum(len(m["content"].split()) for m in request["messages"])
+    return {
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "model": request.get("model"),
+        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": 2,
+            "total_tokens": prompt_tokens + 2,
+        },
+    }
+
+
+def fake_chunks(completion: dict) -> list[dict]:
+    """
+    Splits a completion into streamed chunks, one per word of content or 3 characters of arguments.
+    """
+    message = completion["choices"][0]["message"]
+    chunks = [{"role": "assistant"}]
+    if message.get("content"):
+        chunks += [{"content": word + " "} for word in message["content"].split(" ")]
+    if message.get("function_call"):
+        call = message["function_call"]
+        chunks.append({"function_call": {"name": call["name"], "arguments": ""}})
+        arguments = call["arguments"]
+        chunks += [
+            {"function_call": {"arguments": arguments[i : i + 3]}}
+            for i in range(0, len(arguments), 3)
+        ]
+    return [
+        {
+            "id": completion["id"],
+            "model": completion["model"],
+            "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+        }
+        for delta in chunks
+    ] + [{"id": completion["id"], "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}]
+
+
+class FakeOpenAI:
+    """
+    Records requests sent to the `openai` client and answers them.
+
+    Attributes:
+        calls (list[dict]): The keyword arguments of every chat-completions request.
+        embedding_calls (list[dict]): The keyword arguments of every embeddings request.
+        handler (Callable[[dict], dict]): Builds the completion for a request. Defaults to `fake_completion`.
+        delay (float): Seconds each request takes.
+        errors (list[Exception]): Raised by the next requests, in order, before any completion is returned.
+    """
+
+    def __init__(self) -> None:
+        self.calls: list[dict] = []
+        self.embedding_calls: list[dict] = []
+        self.handler: Callable[[dict], dict] = fake_completion
+        self.delay = 0.0
+        self.errors: list[Exception] = []
+
+    def _respond(self, kwargs: dict) -> Any:
+        from openai.openai_object import OpenAIObject
+
+        self.calls.append(kwargs)
+        if self.errors:
+            raise self.errors.pop(0)
+        request = {k: v for k, v in kwargs.items() if k not in ("request_timeout", "stream")}
+        completion = self.handler(request)
+        if kwargs.get("stream"):
+            return [OpenAIObject.construct_from(c) for c in fake_chunks(completion)]
+        return OpenAIObject.construct_from(completion)
+
+    def create(self, **kwargs) -> Any:
+        if self.delay:
+            time.sleep(self.delay)
+        response = self._respond(kwargs)
+        return iter(response) if kwargs.get("stream") else response
+
+    async def acreate(self, **kwargs) -> Any:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        response = self._respond(kwargs)
+        if not kwargs.get("stream"):
+            return response
+
+        async def chunks():
+            for chunk in response:
+                yield chunk
+
+        return chunks()
+
+    @staticmethod
+    def embedding(text: str, dim: int = 8) -> list[float]:
+        """
+        Returns the deterministic embedding of `text`.
+        """
+        digest = hashlib.sha256(text.encode()).digest()
+        return [b / 255 for b in digest[:dim]]
+
+    def _embed(self, kwargs: dict) -> Any:
+        from openai.openai_object import OpenAIObject
+
+        self.embedding_calls.append(kwargs)
+        inputs = kwargs["input"]
+        return OpenAIObject.construct_from(
+            {
+                "data": [
+                    {"index": i, "embedding": self.embedding(text)} for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+            }
+        )
+
+    def embed(self, **kwargs) -> Any:
+        return self._embed(kwargs)
+
+    async def aembed(self, **kwargs) -> Any:
+        return self._embed(kwargs)
+
+
+@pytest.fixture(autouse=True)
+def fake_encoding(monkeypatch):
+    import tiktoken
+
+    def encoding_for_model(model: str) -> FakeEncoding:
+        return FakeEncoding()
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", encoding_for_model)
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: FakeEncoding())
+    tokenizer.get_encoder.cache_clear()
+    yield
+    tokenizer.get_encoder.cache_clear()
+
+
+@pytest.fixture
+def openai_api(monkeypatch) -> FakeOpenAI:
+    import openai
+
+    api = FakeOpenAI()
+    monkeypatch.setattr(openai.ChatCompletion, "create", api.create)
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", api.acreate)
+    monkeypatch.setattr(openai.Embedding, "create", api.embed)
+    monkeypatch.setattr(openai.Embedding, "acreate", api.aembed)
+    return api
+
+
+@pytest.fixture
+def config() -> Config:
+    return Config(model="gpt-3.5-turbo", temperature=0, api_key="sk-test")
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    # Each test registers its tools on a fresh registry
+    previous, fresh = get_registry(), ToolRegistry()
+    set_registry(fresh)
+    yield fresh
+    set_registry(previous)
+    fresh.executor.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def no_metrics():
+    yield
+    metrics.disable()
+
+
+@pytest.fixture
+def arun() -> Callable[[Any], Any]:
+    """
+    Runs a coroutine on a fresh event loop, closing the pooled HTTP session before the loop shuts down.
+    """
+    from blacksmith.utils.session import close_aiosession
+
+    def run(coro) -> Any:
+        async def main():
+            try:
+                return await coro
+            finally:
+                await close_aiosession()
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,108 @@
+import json
+import asyncio
+import pytest
+from blacksmith.agent import Agent
+from blacksmith.llm import AsyncConversation
+from blacksmith.tools import tool
+
+
+@pytest.fixture
+def double(registry):
+    calls = []
+
+    @tool(name="double", description="Doubles a number", params={"x": "The number"})
+    async def double(x: int):
+        calls.append(x)
+        await asyncio.sleep(0.01)
+        return x * 2
+
+    return calls
+
+
+def call_tool_then_answer(calls: int):
+    """
+    Returns a completion handler that calls `double` with x=2 `calls` times, then answers.
+    """
+    requests = []
+
+    def handler(request: dict) -> dict:
+        requests.append(request)
+        if len(requests) <= calls:
+            message = {
+                "role": "assistant",
+                "content": None,
+                "function_call": {"name": "double", "arguments": json.dumps({"x": 2})},
+            }
+        else:
+            message = {"role": "assistant", "content": "4"}
+        return {
+            "id": "chatcmpl-test",
+            "choices": [{"message": message}],
+            "usage": {"total_tokens": 10},
+        }
+
+    return handler
+
+
+def test_agents_run_tools_until_the_model_answers(openai_api, config, double):
+    openai_api.handler = call_tool_then_answer(2)
+
+    result = Agent(conversation=AsyncConversation(config=config)).run("What is 2 * 2?")
+
+    assert (result.answer, result.stop_reason, result.tokens) == ("4", "answer", 30)
+    assert [s.function_call.result if s.function_call else None for s in result.steps] == [
+        4,
+        4,
+        None,
+    ]
+    assert double == [2, 2]
+    assert not any(s.reused for s in result.steps)
+
+
+def test_each_run_starts_from_the_agent_conversation(openai_api, config, double):
+    openai_api.handler = call_tool_then_answer(1)
+    agent = Agent(conversation=AsyncConversation(system_prompt="Be brief.", config=config))
+
+    first = agent.run("What is 2 * 2?")
+    openai_api.handler = call_tool_then_answer(0)
+    second = agent.run("What is 3 * 3?")
+
+    assert (first.answer, second.answer) == ("4", "4")
+    assert len(agent.conversation.messages) == 0
+    assert [m.role for m in first.conversation.messages] == ["system", "user", "user"]
+    # The second run does not see the first run's question or observation
+    assert [m["role"] for m in openai_api.calls[-1]["messages"]] == ["system", "user"]
+    assert "3 * 3" in openai_api.calls[-1]["messages"][1]["content"]
+
+
+def test_agents_can_reuse_identical_tool_calls(openai_api, config, double):
+    openai_api.handler = call_tool_then_answer(2)
+
+    agent = Agent(conversation=AsyncConversation(config=config), reuse_calls=True)
+    result = agent.run("What is 2 * 2?")
+
+    assert result.answer == "4"
+    assert double == [2]
+    assert [s.reused for s in result.steps] == [False, True, False]
+
+
+@pytest.mark.parametrize(
+    "limits, stop_reason",
+    [({"max_steps": 1}, "max_steps"), ({"max_tokens": 15}, "token_budget")],
+)
+def test_agents_stop_when_a_budget_runs_out(openai_api, config, double, limits, stop_reason):
+    openai_api.handler = call_tool_then_answer(5)
+
+    result = Agent(conversation=AsyncConversation(config=config), **limits).run("q")
+
+    assert result.stop_reason == stop_reason
+    assert result.answer is None
+
+
+def test_agents_stop_at_the_deadline(openai_api, config, double):
+    openai_api.handler = call_tool_then_answer(100)
+    openai_api.delay = 0.02
+
+    result = Agent(conversation=AsyncConversation(config=config), max_seconds=0.1).run("q")
+
+    assert result.stop_reason == "timeout"
@@ -0,0 +1,44 @@
+import pytest
+from blacksmith.tools import tool
+from benchmarks.run import benchmarks, compare, run_async, run_sync
+
+
+@pytest.fixture
+def suites(config, registry):
+    @tool(name="lookup", description="Looks a word up", params={"word": "The word"})
+    def lookup(word: str):
+        return word
+
+    return benchmarks(config, [4])
+
+
+@pytest.mark.parametrize("name", ["ask", "ask_stream", "long_history_4"])
+def test_request_suites_send_no_functions(openai_api, suites, name):
+    sync_fn, async_fn = suites[name]
+
+    run_sync(sync_fn, requests=2, concurrency=2)
+    run_async(async_fn, requests=2, concurrency=2)
+
+    assert len(openai_api.calls) == 4
+    assert not any("functions" in call for call in openai_api.calls)
+
+
+def test_runs_report_latencies_and_errors():
+    def fn(i: int):
+        if i % 2:
+            raise ValueError(i)
+
+    latencies, errors, seconds = run_sync(fn, requests=4, concurrency=2)
+
+    assert (len(latencies), errors) == (2, 2)
+    assert seconds >= 0
+
+
+def test_compare_reports_p50_regressions():
+    def results(p50: float) -> dict:
+        return {"results": [{"benchmark": "ask", "mode": "sync", "concurrency": 1, "p50": p50}]}
+
+    assert compare(results(0.0105), results(0.01), threshold=0.1) == []
+    assert compare(results(0.012), results(0.01), threshold=0.1) == [
+        "ask (sync, concurrency 1): p50 10.00ms -> 12.00ms (+20%)"
+    ]
@@ -0,0 +1,54 @@
+import pytest
+from blacksmith.bias import compile_bias, word_variants
+from blacksmith.config.constants import LOGIT_BIAS_LIMIT
+from blacksmith.llm import Conversation
+from tests.conftest import FakeEncoding
+
+
+def token(word: str) -> int:
+    return FakeEncoding._token(word)
+
+
+def test_variants_cover_spacing_and_casing():
+    assert word_variants("cat") == [" cat", " CAT", "Cat", " Cat"]
+    assert word_variants("Cat") == [" Cat", " cat", " CAT", "Cat"]
+
+
+def test_tokens_shared_by_more_variants_rank_first():
+    compiled = compile_bias(["San Francisco"], model="gpt-3.5-turbo", limit=2)
+
+    # "San" and "Francisco" appear in two variants, the lower and upper case spellings in one each
+    assert compiled.bias == {token("San"): -100, token("Francisco"): -100}
+    assert compiled.dropped == 4
+
+
+def test_compiled_biases_are_memoized():
+    words = ["cat", "dog"]
+    assert compile_bias(words, model="gpt-3.5-turbo") is compile_bias(words, "gpt-3.5-turbo")
+    assert compile_bias(words, model="gpt-4", value=-50).bias[token("cat")] == -50
+
+
+def test_overflowing_biases_raise_or_truncate():
+    with pytest.raises(ValueError, match="at most 3"):
+        compile_bias(["cat", "dog"], model="gpt-3.5-turbo", limit=3, overflow="error")
+
+    compiled = compile_bias(["cat", "dog"], model="gpt-3.5-turbo", limit=3)
+    assert (len(compiled.bias), compiled.dropped) == (3, 3)
+
+
+def test_banned_words_are_sent_as_logit_bias(openai_api, config):
+    c = Conversation(config=config)
+    c.ban_words(["cat"])
+    c.ask("Hello", use_functions=False)
+
+    assert openai_api.calls[0]["logit_bias"] == {token(t): -100 for t in ("cat", "CAT", "Cat")}
+
+
+def test_banning_too_many_words_leaves_the_bias_unchanged(config):
+    c = Conversation(config=config)
+    c.ban_words(["cat"])
+    words = [f"word{i}" for i in range(LOGIT_BIAS_LIMIT)]
+
+    with pytest.raises(ValueError, match=str(LOGIT_BIAS_LIMIT)):
+        c.ban_words(words)
+    assert len(c.config.bias) == 3
@@ -0,0 +1,242 @@
+import time
+import asyncio
+import threading
+import pytest
+from blacksmith.cache import (
+    CompletionCache,
+    MemoryCache,
+    SemanticCache,
+    SQLiteCache,
+    TieredCache,
+    request_key,
+)
+from blacksmith.llm import AsyncConversation, Conversation
+
+
+def completion(n: int = 0) -> dict:
+    return {"id": f"c{n}", "usage": {"total_tokens": 10}}
+
+
+def test_request_keys_ignore_key_order():
+    assert request_key({"a": 1, "b": [1, 2]}) == request_key({"b": [1, 2], "a": 1})
+    assert request_key({"a": 1}) != request_key({"a": 2})
+
+
+def test_completion_cache_is_abstract():
+    with pytest.raises(TypeError):
+        CompletionCache()
+
+
+def test_memory_cache_evicts_the_least_recently_used():
+    cache = MemoryCache(maxsize=2)
+    cache.set("a", completion(1))
+    cache.set("b", completion(2))
+    cache.get("a")
+    cache.set("c", completion(3))
+
+    assert cache.get("b") is None
+    assert cache.get("a") == completion(1)
+    assert len(cache) == 2
+
+
+def test_memory_cache_expires_entries():
+    cache = MemoryCache(ttl=0.01)
+    cache.set("a", completion())
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_sqlite_cache_round_trip(tmp_path):
+    path = str(tmp_path / "cache.db")
+    SQLiteCache(path).set("a", completion())
+
+    cache = SQLiteCache(path)
+    assert cache.get("a") == completion()
+    cache.clear()
+    assert cache.get("a") is None
+
+
+class ThreadRecordingCache(SQLiteCache):
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.threads = set()
+
+    def get(self, key):
+        self.threads.add(threading.get_ident())
+        return super().get(key)
+
+    def set(self, key, value):
+        self.threads.add(threading.get_ident())
+        super().set(key, value)
+
+
+def test_async_lookups_keep_sqlite_io_off_the_event_loop(tmp_path, arun):
+    cache = ThreadRecordingCache(str(tmp_path / "cache.db"))
+
+    async def create():
+        return completion()
+
+    async def main():
+        first = await cache.aget_or_create("k", create)
+        second = await cache.aget_or_create("k", create)
+        return first, second, threading.get_ident()
+
+    first, second, loop_thread = arun(main())
+
+    assert (first, second) == ((completion(), True), (completion(), False))
+    assert cache.threads and loop_thread not in cache.threads
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+
+def test_tiered_cache_copies_hits_into_earlier_tiers(tmp_path):
+    memory, sqlite = MemoryCache(), SQLiteCache(str(tmp_path / "cache.db"))
+    sqlite.set("a", completion())
+
+    assert TieredCache(memory, sqlite).get("a") == completion()
+    assert memory.get("a") == completion()
+
+
+def test_concurrent_identical_requests_are_sent_once():
+    cache, calls, results = MemoryCache(), [], []
+
+    def create():
+        calls.append(1)
+        time.sleep(0.05)
+        return completion()
+
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_create("k", create)))
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert sorted(fresh for _, fresh in results) == [False] * 7 + [True]
+    assert cache.stats.misses == 1
+    assert cache.stats.coalesced == 7
+    assert cache.stats.tokens_saved == 70
+
+
+def test_async_followers_share_the_leaders_result(arun):
+    cache, calls = MemoryCache(), []
+
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return completion()
+
+    async def main():
+        return await asyncio.gather(*(cache.aget_or_create("k", create) for _ in range(5)))
+
+    results = arun(main())
+
+    assert len(calls) == 1
+    assert [fresh for _, fresh in results] == [True, False, False, False, False]
+    assert cache.get("k") == completion()
+
+
+def test_async_followers_get_the_leaders_error(arun):
+    cache = MemoryCache()
+
+    async def create():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        return await asyncio.gather(
+            *(cache.aget_or_create("k", create) for _ in range(3)), return_exceptions=True
+        )
+
+    assert [type(r) for r in arun(main())] == [ValueError] * 3
+
+
+def test_async_followers_take_over_when_the_leader_is_cancelled(arun):
+    cache, calls = MemoryCache(), []
+
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return completion(len(calls))
+
+    async def main():
+        leader = asyncio.create_task(cache.aget_or_create("k", create))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(cache.aget_or_create("k", create)) for _ in range(3)]
+        await asyncio.sleep(0.005)
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        assert leader.cancelled()
+        return results
+
+    results = arun(main())
+
+    assert len(calls) == 2
+    assert [value for value, _ in results] == [completion(2)] * 3
+    assert [fresh for _, fresh in results] == [True, False, False]
+
+
+def test_cancelling_a_follower_leaves_the_leader_running(arun):
+    cache = MemoryCache()
+
+    async def create():
+        await asyncio.sleep(0.02)
+        return completion()
+
+    async def main():
+        leader = asyncio.create_task(cache.aget_or_create("k", create))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.aget_or_create("k", create))
+        await asyncio.sleep(0.005)
+        follower.cancel()
+        assert await leader == (completion(), True)
+        assert follower.cancelled()
+
+    arun(main())
+
+
+def test_conversations_answer_repeated_requests_from_the_cache(openai_api, config):
+    config = config.model_copy(update={"cache": MemoryCache()})
+
+    first = Conversation(config=config).ask("Hello")
+    second = Conversation(config=config).ask("Hello")
+
+    assert first.content == second.content == "echo: Hello"
+    assert len(openai_api.calls) == 1
+    assert config.cache.stats.hits == 1
+
+
+def test_concurrent_async_conversations_coalesce(openai_api, config, arun):
+    openai_api.delay = 0.01
+    config = config.model_copy(update={"cache": MemoryCache()})
+
+    async def main():
+        return await asyncio.gather(*(AsyncConversation(config=config).ask("Hi") for _ in range(4)))
+
+    assert {r.content for r in arun(main())} == {"echo: Hi"}
+    assert len(openai_api.calls) == 1
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_the_exact_cache_is_checked_before_the_semantic_cache(openai_api, config, arun, mode):
+    pytest.importorskip("numpy")
+    semantic = SemanticCache(threshold=0.5)
+    config = config.model_copy(update={"cache": MemoryCache(), "semantic_cache": semantic})
+
+    def ask(prompt: str) -> str:
+        if mode == "sync":
+            return Conversation(config=config).ask(prompt, use_functions=False).content
+        return arun(AsyncConversation(config=config).ask(prompt, use_functions=False)).content
+
+    assert ask("Hello") == ask("Hello") == "echo: Hello"
+    # Repeating a request is an exact hit, which skips the embedding request
+    assert len(openai_api.embedding_calls) == 1
+    assert (semantic.stats.hits, semantic.stats.misses) == (0, 1)
+
+    # Near-duplicates are answered by the semantic cache, and then by the exact cache
+    assert ask("Hello there") == ask("Hello there") == "echo: Hello"
+    assert len(openai_api.calls) == 1
+    assert len(openai_api.embedding_calls) == 2
+    assert (semantic.stats.hits, config.cache.stats.hits) == (1, 2)
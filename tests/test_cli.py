@@ -0,0 +1,106 @@
+import os
+import json
+import pytest
+from blacksmith.scripts.cli import RunSummary, main, open_output, read_completed, read_jobs
+
+
+def write_lines(path, *lines: str) -> str:
+    path.write_text("".join(lines))
+    return str(path)
+
+
+def test_jobs_are_read_with_their_ids(tmp_path):
+    path = write_lines(
+        tmp_path / "jobs.jsonl",
+        '{"id": 7, "prompt": "a"}\n',
+        "\n",
+        '"b"\n',
+        '{"prompt": "c"}',
+    )
+
+    assert list(read_jobs(path, "id")) == [
+        ("7", {"id": 7, "prompt": "a"}),
+        ("3", {"prompt": "b"}),
+        ("4", {"prompt": "c"}),
+    ]
+
+
+def test_invalid_jobs_are_reported_with_their_line(tmp_path):
+    path = write_lines(tmp_path / "jobs.jsonl", '{"prompt": "a"}\n', "{oops\n")
+
+    with pytest.raises(ValueError, match="jobs.jsonl:2: invalid JSON"):
+        list(read_jobs(path, "id"))
+
+
+def test_completed_jobs_skip_failures_and_truncated_lines(tmp_path):
+    path = write_lines(
+        tmp_path / "out.jsonl",
+        '{"id": "1", "response": "a"}\n',
+        '{"id": "2", "error": "APIError: down"}\n',
+        '{"id": "3", "resp',
+    )
+
+    assert read_completed(path) == {"1"}
+    assert read_completed(str(tmp_path / "missing.jsonl")) == set()
+
+    # The truncated line is ended before new results are appended
+    with open_output(path) as out:
+        out.write('{"id": "3"}\n')
+    assert read_completed(path) == {"1", "3"}
+
+
+def test_runs_resume_where_they_stopped(openai_api, tmp_path):
+    jobs = write_lines(
+        tmp_path / "jobs.jsonl", *(f'{{"id": {i}, "prompt": "p{i}"}}\n' for i in range(4))
+    )
+    output = write_lines(
+        tmp_path / "out.jsonl",
+        '{"id": "0", "response": "echo: p0"}\n',
+        '{"id": "1", "error": "APIError: down"}\n',
+        '{"id": "2", "resp',
+    )
+    args = [jobs, "-o", output, "--model", "gpt-3.5-turbo", "--temperature", "0"]
+
+    assert main(["run", *args, "--progress-interval", "0"]) == 0
+
+    with open(output) as f:
+        # Past the earlier results and the truncated line
+        records = [json.loads(line) for line in f.read().splitlines()[3:]]
+    assert sorted(r["id"] for r in records) == ["1", "2", "3"]
+    assert {r["id"]: r["response"] for r in records}["3"] == "echo: p3"
+    assert len(openai_api.calls) == 3
+
+    # Nothing is left to run
+    assert main(["run", *args, "--progress-interval", "0"]) == 0
+    assert len(openai_api.calls) == 3
+
+
+def test_runs_without_a_temperature_fail_at_startup(openai_api, tmp_path, capsys):
+    if os.getenv("TEMPERATURE"):
+        pytest.skip("TEMPERATURE is set")
+    jobs = write_lines(tmp_path / "jobs.jsonl", '"a"\n')
+
+    with pytest.raises(SystemExit) as e:
+        main(["run", jobs, "-o", str(tmp_path / "out.jsonl"), "--model", "gpt-3.5-turbo"])
+
+    assert e.value.code == 2
+    assert "--temperature (or $TEMPERATURE)" in capsys.readouterr().err
+    assert openai_api.calls == []
+
+
+def test_summaries_report_counts_latency_and_tokens():
+    summary = RunSummary()
+    summary.skipped = 1
+    summary.record(0.2, failed=False)
+    summary.record(0.6, failed=False)
+    summary.record(5.0, failed=True)
+    summary.record_usage({"usage": {"prompt_tokens": 10, "completion_tokens": 4}})
+    summary.record_usage({})
+
+    line = summary.line()
+
+    assert "done 2 failed 1 skipped 1" in line
+    # Failed jobs are left out of the latency quantiles
+    assert "p50 0.25s p95 0.75s" in line
+    assert "tokens 10 in 4 out" in line
+    assert "p50 - p95 -" in RunSummary().line()
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+from blacksmith.context import Config, model, using_context
+
+
+def test_model_blocks_are_isolated_between_threads(config):
+    barrier = threading.Barrier(2)
+    seen = {}
+
+    def run(name: str, temperature: float):
+        with model(name, temperature):
+            # Both blocks are open at once
+            barrier.wait()
+            seen[name] = (Config().load().model, config.resolve().temperature)
+
+    threads = [threading.Thread(target=run, args=args) for args in (("a", 0.1), ("b", 0.2))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert seen == {"a": ("a", 0.1), "b": ("b", 0.2)}
+    assert not using_context()
+    assert config.resolve() is config
+
+
+def test_model_blocks_are_isolated_between_tasks(config, arun):
+    async def run(name: str, temperature: float):
+        with model(name, temperature):
+            await asyncio.sleep(0.01)
+            return Config().load().model, config.resolve().temperature
+
+    async def main():
+        return await asyncio.gather(run("a", 0.1), run("b", 0.2))
+
+    assert arun(main()) == [("a", 0.1), ("b", 0.2)]
+    assert Config().load().model == "gpt-3.5-turbo"
+
+
+def test_resolved_configs_follow_changes_made_in_the_block(config):
+    with model("gpt-4", 1):
+        resolved = config.resolve()
+        assert config.resolve() is resolved
+        assert (resolved.model, resolved.temperature, resolved.bias is config.bias) == (
+            "gpt-4",
+            1.0,
+            True,
+        )
+
+        config.api_key = "sk-other"
+        assert config.resolve() is not resolved
+        assert (config.resolve().model, config.resolve().api_key) == ("gpt-4", "sk-other")
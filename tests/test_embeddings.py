@@ -0,0 +1,135 @@
+import sys
+import subprocess
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from blacksmith.embeddings import (  # noqa: E402
+    EmbeddingCache,
+    MemoryEmbeddingCache,
+    SQLiteEmbeddingCache,
+    VectorIndex,
+    aembed,
+    embed,
+    embedding_key,
+)
+from tests.conftest import FakeOpenAI  # noqa: E402
+
+
+def expected(*texts: str) -> "np.ndarray":
+    return np.array([FakeOpenAI.embedding(text) for text in texts], dtype=np.float32)
+
+
+def test_importing_embeddings_does_not_import_numpy():
+    code = "import sys, blacksmith.embeddings; print('numpy' in sys.modules)"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "False"
+
+
+def test_embed_returns_one_row_per_text(openai_api, config):
+    vectors = embed(["a", "b", "a"], config=config)
+
+    np.testing.assert_allclose(vectors, expected("a", "b", "a"), rtol=1e-6)
+    # Duplicates are only embedded once
+    assert [call["input"] for call in openai_api.embedding_calls] == [["a", "b"]]
+
+
+def test_embed_packs_texts_into_batches(openai_api, config):
+    texts = [f"text {i}" for i in range(5)]
+
+    embed(texts, max_batch_size=2, config=config)
+    assert [len(call["input"]) for call in openai_api.embedding_calls] == [2, 2, 1]
+
+    openai_api.embedding_calls.clear()
+    # Two tokens per text
+    embed([f"more {i}" for i in range(5)], max_batch_tokens=4, config=config)
+    assert [len(call["input"]) for call in openai_api.embedding_calls] == [2, 2, 1]
+
+
+def test_cached_embeddings_are_not_requested_again(openai_api, config):
+    cache = MemoryEmbeddingCache()
+    embed(["a", "b"], cache=cache, config=config)
+    vectors = embed(["b", "c"], cache=cache, config=config)
+
+    np.testing.assert_allclose(vectors, expected("b", "c"), rtol=1e-6)
+    assert [call["input"] for call in openai_api.embedding_calls] == [["a", "b"], ["c"]]
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_aembed_matches_embed(openai_api, config, arun):
+    cache = MemoryEmbeddingCache()
+    vectors = arun(aembed(["a", "b", "c"], cache=cache, max_batch_size=2, config=config))
+
+    np.testing.assert_allclose(vectors, expected("a", "b", "c"), rtol=1e-6)
+    assert len(openai_api.embedding_calls) == 2
+    assert len(cache) == 3
+
+
+def test_embedding_caches_are_abstract():
+    class Incomplete(EmbeddingCache):
+        def get_many(self, keys):
+            return {}
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_memory_caches_evict_the_oldest_entries():
+    cache = MemoryEmbeddingCache(maxsize=2)
+    cache.set_many({key: np.full(2, i, dtype=np.float32) for i, key in enumerate("abc")})
+
+    assert len(cache) == 2
+    assert set(cache.get_many(["a", "b", "c"])) == {"b", "c"}
+
+
+def test_sqlite_caches_round_trip(tmp_path):
+    path = str(tmp_path / "embeddings.db")
+    key = embedding_key("text-embedding-ada-002", "a")
+    SQLiteEmbeddingCache(path).set_many({key: np.arange(4, dtype=np.float32)})
+
+    found = SQLiteEmbeddingCache(path).get_many([key, "missing"])
+
+    assert list(found) == [key]
+    np.testing.assert_array_equal(found[key], np.arange(4, dtype=np.float32))
+
+
+def test_index_search_ranks_by_cosine_similarity():
+    index = VectorIndex(dim=2, capacity=1)
+    index.add(np.array([[1, 0], [0, 1], [1, 1]], dtype=np.float32), ids=["x", "y", "xy"])
+
+    (results,) = index.search(np.array([2, 0.1]), k=2)
+
+    # The index grew past its capacity, and vectors are compared by direction only
+    assert len(index) == 3
+    assert [id for id, _ in results] == ["x", "xy"]
+    assert results[0][1] == pytest.approx(0.9988, abs=1e-4)
+    assert index.search(np.zeros((1, 2)), k=0) == [[]]
+
+
+def test_index_rejects_mismatched_vectors():
+    index = VectorIndex(dim=2)
+    with pytest.raises(ValueError):
+        index.add(np.ones((1, 3)))
+    with pytest.raises(ValueError):
+        index.add(np.ones((2, 2)), ids=["a"])
+
+
+def test_indexes_need_texts_to_be_built_from(openai_api, config):
+    with pytest.raises(ValueError, match="no texts"):
+        VectorIndex.from_texts([], config=config)
+    assert openai_api.embedding_calls == []
+
+
+def test_indexes_load_memory_mapped_and_stay_writable(openai_api, config, tmp_path):
+    path = str(tmp_path / "docs")
+    VectorIndex.from_texts(["a", "b", "c"], config=config).save(path)
+
+    index = VectorIndex.load(path)
+    assert isinstance(index.vectors, np.memmap)
+    assert index.search_text("b", k=1, config=config)[0][0] == "b"
+
+    index.add(np.ones((1, 8)), ids=["d"])
+    assert index.ids == ["a", "b", "c", "d"]
+    assert index.search(np.ones(8), k=1)[0][0][0] == "d"
@@ -0,0 +1,168 @@
+import json
+import time
+import logging
+import threading
+import pytest
+from blacksmith.exceptions import CompletionError
+from blacksmith.llm import (
+    Choice,
+    agenerate_many,
+    agenerate_packed,
+    generate_many,
+    generate_packed,
+)
+from blacksmith.retry import RetryPolicy
+from tests.conftest import fake_completion
+
+CITIES = Choice(options=["SF", "LA"])
+
+
+def packed_handler(answer, delay: float = 0.0):
+    """
+    Returns a completion handler answering packed requests with `answer(items)`, and single requests like
+    `fake_completion`. Records the maximum number of requests handled at once.
+    """
+    lock, state = threading.Lock(), {"inflight": 0, "max_inflight": 0, "packed": 0, "single": 0}
+
+    def handler(request: dict) -> dict:
+        with lock:
+            state["inflight"] += 1
+            state["max_inflight"] = max(state["max_inflight"], state["inflight"])
+        try:
+            time.sleep(delay)
+            function = request["functions"][0]["name"]
+            if not function.endswith("Batch"):
+                state["single"] += 1
+                return fake_completion(request)
+            state["packed"] += 1
+            prompt = request["messages"][-1]["content"]
+            items = [json.loads(line) for line in prompt.splitlines() if line.startswith('{"id"')]
+            arguments = answer(items)
+            return {
+                "id": "chatcmpl-test",
+                "choices": [
+                    {
+                        "message": {
+                            "role": "assistant",
+                            "content": None,
+                            "function_call": {"name": function, "arguments": arguments},
+                        }
+                    }
+                ],
+                "usage": {"total_tokens": 10},
+            }
+        finally:
+            with lock:
+                state["inflight"] -= 1
+
+    handler.state = state
+    return handler
+
+
+def answer_all_but_the_last(items: list[dict]) -> str:
+    return json.dumps({"results": [{"id": item["id"], "choice": "LA"} for item in items[:-1]]})
+
+
+def test_generate_many_reports_failures_per_item(openai_api, config):
+    openai_api.errors = [ValueError("boom")]
+    config = config.model_copy(update={"retry": RetryPolicy(max_attempts=1)})
+
+    results = list(generate_many(CITIES, ["a", "b", "c"], ordered=True, config=config))
+
+    assert [r.index for r in results] == [0, 1, 2]
+    assert sum(not r.ok() for r in results) == 1
+    assert {r.result for r in results if r.ok()} == {"SF"}
+
+
+def test_packed_batches_retry_skipped_items_individually(openai_api, config):
+    openai_api.handler = packed_handler(answer_all_but_the_last)
+
+    results = list(generate_packed(CITIES, ["a", "b", "c"], ordered=True, config=config))
+
+    # The last item is retried on its own, where the fake picks the first option
+    assert [r.result for r in results] == ["LA", "LA", "SF"]
+    assert openai_api.handler.state["packed"] == 1
+    assert openai_api.handler.state["single"] == 1
+
+
+def test_malformed_batches_are_retried_item_by_item(openai_api, config):
+    openai_api.handler = packed_handler(lambda items: "{not json")
+
+    results = list(generate_packed(CITIES, ["a", "b", "c"], ordered=True, config=config))
+
+    assert [r.result for r in results] == ["SF", "SF", "SF"]
+    assert openai_api.handler.state["single"] == 3
+
+
+def test_unexpected_batch_errors_are_logged_and_reported(openai_api, config, caplog, monkeypatch):
+    import blacksmith.llm
+
+    def broken(obj, args, size):
+        raise RuntimeError("bug")
+
+    monkeypatch.setattr(blacksmith.llm, "_unpack", broken)
+    openai_api.handler = packed_handler(answer_all_but_the_last)
+
+    with caplog.at_level(logging.ERROR, logger="blacksmith.llm"):
+        results = list(generate_packed(CITIES, ["a", "b"], config=config))
+
+    assert [type(r.error) for r in results] == [RuntimeError, RuntimeError]
+    assert "Generating a ChoiceBatch failed" in caplog.text
+    assert openai_api.handler.state["single"] == 0
+
+
+def test_failed_batch_requests_fail_every_item(openai_api, config):
+    openai_api.errors = [ValueError("boom")]
+    config = config.model_copy(update={"retry": RetryPolicy(max_attempts=1)})
+
+    results = list(generate_packed(CITIES, ["a", "b"], config=config))
+
+    assert all(isinstance(r.error, CompletionError) for r in results)
+
+
+def test_packed_retries_share_the_concurrency_limit(openai_api, config):
+    openai_api.handler = packed_handler(lambda items: json.dumps({"results": []}), delay=0.01)
+
+    results = list(
+        generate_packed(CITIES, [str(i) for i in range(8)], max_concurrency=3, config=config)
+    )
+
+    assert len(results) == 8 and all(r.ok() for r in results)
+    assert openai_api.handler.state["single"] == 8
+    # Retries run in parallel, but never above the limit
+    assert openai_api.handler.state["max_inflight"] == 3
+
+
+def test_async_packed_batches_retry_within_the_limit(openai_api, config, arun):
+    openai_api.handler = packed_handler(answer_all_but_the_last)
+    queries = [str(i) for i in range(10)]
+
+    async def main():
+        return [
+            r
+            async for r in agenerate_packed(
+                CITIES, queries, max_batch_size=2, max_concurrency=3, ordered=True, config=config
+            )
+        ]
+
+    results = arun(main())
+
+    assert [r.result for r in results] == ["LA", "SF"] * 5
+    assert openai_api.handler.state["packed"] == 5
+    assert openai_api.handler.state["single"] == 5
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_agenerate_many(openai_api, config, arun, ordered):
+    async def main():
+        return [
+            r
+            async for r in agenerate_many(
+                CITIES, ["a", "b", "c"], max_concurrency=2, ordered=ordered, config=config
+            )
+        ]
+
+    results = arun(main())
+
+    assert sorted(r.index for r in results) == [0, 1, 2]
+    assert all(r.result == "SF" for r in results)
@@ -0,0 +1,170 @@
+import pytest
+from blacksmith.config.constants import ChatRoles
+from blacksmith.history import ContextWindow, MessageHistory
+from blacksmith.llm import ChatMessage, Conversation
+from blacksmith.utils.tokenizer import count_tokens, get_encoder
+
+
+def message(content: str, role: ChatRoles = ChatRoles.USER) -> ChatMessage:
+    return ChatMessage(role=role, content=content)
+
+
+def total(messages: list[ChatMessage]) -> int:
+    return sum(m.count_tokens("gpt-3.5-turbo") for m in messages)
+
+
+def test_get_encoder_without_a_model_uses_the_default_encoding():
+    assert get_encoder(None).name == "fake"
+    assert count_tokens(None, "one two three") == 3
+
+
+def test_message_token_counts_include_the_chat_format():
+    # One token per word, plus 3 for the message framing
+    assert message("one two").count_tokens("gpt-3.5-turbo") == 5
+
+
+def test_trim_drops_the_oldest_messages_first():
+    window = ContextWindow(max_tokens=12)
+    messages = [message("a b"), message("c d"), message("e f")]
+
+    assert window.trim(messages, total(messages), "gpt-3.5-turbo") == 10
+    assert [m.content for m in messages] == ["c d", "e f"]
+
+
+def test_trim_keeps_system_messages_and_the_latest_message():
+    window = ContextWindow(max_tokens=4)
+    messages = [message("be brief", ChatRoles.SYSTEM), message("a b"), message("c d e f g")]
+
+    assert window.trim(messages, total(messages), "gpt-3.5-turbo") == 13
+    assert [m.content for m in messages] == ["be brief", "c d e f g"]
+
+
+def test_trim_can_keep_observations():
+    window = ContextWindow(max_tokens=10, keep_observations=True)
+    observation = ChatMessage.from_record(
+        {"role": "user", "content": "result", "observation": True}
+    )
+    messages = [observation, message("a b"), message("c d")]
+
+    window.trim(messages, total(messages), "gpt-3.5-turbo")
+
+    assert [m.content for m in messages] == ["result", "c d"]
+
+
+def test_reserve_tokens_shrink_the_budget():
+    assert ContextWindow(max_tokens=100, reserve_tokens=30).budget == 70
+
+
+def test_conversations_fit_requests_in_the_window(openai_api, config):
+    c = Conversation(config=config, window=ContextWindow(max_tokens=15))
+    for prompt in ("one two", "three four", "five six"):
+        c.ask(prompt, use_functions=False)
+
+    # "five six" and the previous reply fit, older messages are left out of the request
+    assert [m["content"] for m in openai_api.calls[-1]["messages"]] == [
+        "echo: three four",
+        "five six",
+    ]
+    assert c.token_count() == 11
+
+
+def history(*contents: str) -> MessageHistory:
+    return MessageHistory(message(content) for content in contents)
+
+
+def contents(messages) -> list[str]:
+    return [m.content for m in messages]
+
+
+def test_forks_share_the_history_and_keep_their_own_tail():
+    parent = history("a", "b")
+    fork = parent.fork()
+    parent.append(message("c"))
+    fork.append(message("d"))
+    grandchild = fork.fork()
+    grandchild.append(message("e"))
+
+    assert contents(parent) == ["a", "b", "c"]
+    assert contents(fork) == ["a", "b", "d"]
+    assert contents(grandchild) == ["a", "b", "d", "e"]
+    # Forking moved the tail into a shared segment rather than copying it
+    assert fork._shared.parent is parent._shared
+    assert parent._tail == [parent[-1]]
+
+
+def test_history_indexing_and_slicing():
+    h = history("a", "b").fork()
+    h.extend([message("c"), message("d")])
+
+    assert len(h) == 4
+    assert [h[i].content for i in range(4)] == ["a", "b", "c", "d"]
+    assert (h[-1].content, h[-4].content) == ("d", "a")
+    assert contents(h[2:]) == ["c", "d"]
+    assert contents(h[1:3]) == ["b", "c"]
+    assert contents(h[::-1]) == ["d", "c", "b", "a"]
+    assert h[4:] == [] and h[3:1] == []
+    with pytest.raises(IndexError):
+        h[4]
+
+
+def test_editing_shared_messages_copies_the_history():
+    parent = history("a", "b")
+    fork = parent.fork()
+
+    fork[0] = message("x")
+    del fork[-1]
+    fork.insert(0, message("y"))
+
+    assert contents(fork) == ["y", "x"]
+    assert contents(parent) == ["a", "b"]
+
+
+def test_histories_compare_equal_to_lists():
+    h = history("a").fork()
+    assert h == list(h)
+    assert h != []
+    h.clear()
+    assert h == [] and len(h) == 0
+
+
+def test_forked_conversations_share_their_history(openai_api, config):
+    c = Conversation(system_prompt="Be brief.", config=config)
+    c.ask("Hello", use_functions=False)
+    left, right = c.fork(), c.fork()
+    left.ask("Left", use_functions=False)
+    right.ask("Right", use_functions=False)
+
+    assert [m["content"] for m in openai_api.calls[-1]["messages"]] == [
+        "Be brief.",
+        "Hello",
+        "echo: Hello",
+        "Right",
+    ]
+    assert contents(left.messages)[-2:] == ["Left", "echo: Left"]
+    assert len(c.messages) == 3
+    assert left.messages._shared is right.messages._shared is c.messages._shared
+
+
+def test_conversations_with_a_list_history_can_fork(openai_api, config):
+    c = Conversation(config=config, messages=[message("a")])
+    c.ask("b", use_functions=False)
+    fork = c.fork()
+    fork.ask("c", use_functions=False)
+
+    assert isinstance(c.messages, MessageHistory)
+    assert contents(fork.messages) == ["a", "b", "echo: b", "c", "echo: c"]
+    assert c.model_dump(include={"messages"})["messages"] == [m.to_payload() for m in c.messages]
+
+
+def test_forks_keep_the_window(openai_api, config):
+    c = Conversation(config=config, window=ContextWindow(max_tokens=15))
+    c.ask("one two", use_functions=False)
+    c.ask("three four", use_functions=False)
+    fork = c.fork()
+    fork.ask("five six", use_functions=False)
+
+    assert [m["content"] for m in openai_api.calls[-1]["messages"]] == [
+        "echo: three four",
+        "five six",
+    ]
+    assert len(fork.messages) == 6
@@ -0,0 +1,118 @@
+import asyncio
+import pytest
+import pydantic
+import blacksmith.llm
+from blacksmith.config.constants import ChatRoles
+from blacksmith.llm import (
+    AsyncConversation,
+    ChatMessage,
+    Choice,
+    Conversation,
+    agenerate_from,
+    generate_from,
+)
+from blacksmith.utils.session import close_aiosession, get_aiosession
+
+
+def test_ask_adds_the_prompt_and_reply_to_the_history(openai_api, config):
+    c = Conversation(system_prompt="Be brief.", config=config)
+    resp = c.ask("Hello")
+
+    assert resp.content == "echo: Hello"
+    assert resp.usage["prompt_tokens"] == 3
+    assert [m.role for m in c.messages] == [ChatRoles.SYSTEM, ChatRoles.USER, ChatRoles.ASSISTANT]
+    assert openai_api.calls[0]["api_key"] == "sk-test"
+
+
+def test_request_payloads_are_reused_until_a_message_is_replaced(openai_api, config):
+    c = Conversation(config=config)
+    c.ask("one", use_functions=False)
+    c.ask("two", use_functions=False)
+
+    first, second = (call["messages"] for call in openai_api.calls)
+    assert all(a is b for a, b in zip(first, second))
+    assert len(second) == 3
+
+    # Replacing a message in the middle of the history is sent with the next request
+    c.messages[1] = c.messages[1].model_copy(update={"content": "echo: uno"})
+    c.ask("three", use_functions=False)
+
+    third = openai_api.calls[2]["messages"]
+    assert [m["content"] for m in third] == ["one", "echo: uno", "two", "echo: two", "three"]
+    assert third[0] is first[0]
+
+
+def test_messages_are_immutable():
+    message = ChatMessage(role=ChatRoles.USER, content="Hi")
+    assert message.to_payload() == {"role": "user", "content": "Hi"}
+
+    with pytest.raises(pydantic.ValidationError):
+        message.content = "Hello"
+    edited = message.model_copy(update={"content": "Hello"})
+    assert edited.to_payload() == {"role": "user", "content": "Hello"}
+    assert message.to_payload()["content"] == "Hi"
+
+
+def test_generate_from_a_choice(openai_api, config):
+    assert generate_from(Choice(options=["a", "b"]), "Pick one", config=config) == "a"
+    assert openai_api.calls[0]["function_call"] == {"name": "Choice"}
+
+
+def test_async_ask_and_hooks(openai_api, config, arun):
+    seen = []
+
+    async def hook(completion):
+        seen.append(("async", completion["id"]))
+
+    c = AsyncConversation(config=config.model_copy(update={"on_completion": []}))
+    c.on_completion(hook)
+    c.on_completion(lambda completion: seen.append(("sync", completion["id"])))
+
+    resp = arun(c.ask("Hello"))
+
+    assert resp.content == "echo: Hello"
+    assert seen == [("async", "chatcmpl-test"), ("sync", "chatcmpl-test")]
+
+
+def test_async_asks_without_tools_do_not_fetch_them_synchronously(
+    openai_api, config, arun, monkeypatch
+):
+    def get_tools():
+        raise AssertionError("fetched the tools from the event loop")
+
+    monkeypatch.setattr(blacksmith.llm, "get_tools", get_tools)
+    resp = arun(AsyncConversation(config=config).ask("Hello"))
+
+    assert resp.content == "echo: Hello"
+    assert "functions" not in openai_api.calls[0]
+
+
+def test_agenerate_from(openai_api, config, arun):
+    assert arun(agenerate_from(Choice(options=[1, 2]), "Pick one", config=config)) == 1
+
+
+def test_concurrent_asks_share_one_session_per_loop(openai_api, config, arun):
+    openai_api.delay = 0.01
+
+    async def main():
+        session = get_aiosession()
+        responses = await asyncio.gather(
+            *(AsyncConversation(config=config).ask(f"q{i}") for i in range(20))
+        )
+        assert get_aiosession() is session
+        return responses
+
+    responses = arun(main())
+
+    assert [r.content for r in responses] == [f"echo: q{i}" for i in range(20)]
+    assert len(openai_api.calls) == 20
+
+
+def test_closed_sessions_are_replaced(arun):
+    async def main():
+        first = get_aiosession()
+        await close_aiosession()
+        assert first.closed
+        assert get_aiosession() is not first
+
+    arun(main())
@@ -0,0 +1,103 @@
+from blacksmith import metrics
+from blacksmith.llm import Conversation, FunctionCall
+from blacksmith.metrics import Histogram, Metrics
+from blacksmith.tools import tool
+
+
+def phases(collector: Metrics) -> set[tuple]:
+    return {labels for name, labels in collector.histograms if name == "blacksmith_phase_seconds"}
+
+
+def test_completions_and_tool_calls_are_recorded(openai_api, config, registry):
+    @tool(name="lookup", description="Looks up a value", params={"x": "A value"})
+    def lookup(x: str):
+        if x == "missing":
+            raise KeyError(x)
+        return x
+
+    collector = metrics.enable(Metrics())
+    response = Conversation(config=config).ask("Hello")
+    response.function_call.execute()
+    FunctionCall(tool="lookup", args={"x": "missing"}).execute()
+
+    model = ("model", "gpt-3.5-turbo")
+    assert phases(collector) == {
+        (model, ("phase", "send")),
+        (model, ("phase", "serialize")),
+        (model, ("phase", "network")),
+        (model, ("phase", "parse")),
+        (("phase", "tool"), ("tool", "lookup")),
+    }
+    assert collector.histogram("blacksmith_phase_seconds", phase="tool", tool="lookup").count == 2
+    prompt_tokens = sum(len(m["content"].split()) for m in openai_api.calls[0]["messages"])
+    assert (
+        collector.counter("blacksmith_tokens_total", model=model[1], type="prompt") == prompt_tokens
+    )
+    assert collector.counter("blacksmith_tokens_total", model=model[1], type="completion") == 2
+    assert collector.counter("blacksmith_tool_errors_total", tool="lookup", error="KeyError") == 1
+
+
+def test_spans_nest_within_a_request(openai_api, config):
+    collector = metrics.enable(Metrics())
+    Conversation(config=config).ask("Hello", use_functions=False)
+
+    spans = {span.name: span for span in collector.spans}
+    send = spans["send"]
+
+    # Spans are kept in the order they finish
+    assert list(spans) == ["serialize", "network", "parse", "send"]
+    assert send.parent_id is None
+    for name in ("serialize", "network", "parse"):
+        assert (spans[name].parent_id, spans[name].trace_id) == (send.span_id, send.trace_id)
+    assert send.attributes == {"model": "gpt-3.5-turbo", "cached": False}
+
+
+def test_spans_export_in_the_opentelemetry_format():
+    collector = Metrics()
+    with collector.span("send", model="gpt-4") as parent:
+        try:
+            with collector.span("network", model="gpt-4"):
+                raise TimeoutError("slow")
+        except TimeoutError:
+            pass
+
+    child, exported = collector.export_spans()
+    assert exported["name"] == "blacksmith.send"
+    assert (exported["parentSpanId"], exported["status"]) == ("", {"code": 1})
+    assert exported["attributes"] == [{"key": "model", "value": {"stringValue": "gpt-4"}}]
+    assert exported["endTimeUnixNano"] >= exported["startTimeUnixNano"]
+    assert (child["parentSpanId"], child["traceId"]) == (parent.span_id, parent.trace_id)
+    assert child["status"] == {"code": 2, "message": "TimeoutError: slow"}
+    assert collector.export_spans() == []
+
+
+def test_metrics_render_in_the_prometheus_format():
+    collector = Metrics(buckets=(0.1, 1))
+    collector.inc("blacksmith_cache_total", cache="exact", result="hit")
+    collector.inc("blacksmith_cache_total", cache="exact", result="hit")
+    collector.observe("blacksmith_phase_seconds", 0.5, phase="send", model='gpt-"4"')
+
+    assert collector.to_prometheus().splitlines() == [
+        "# HELP blacksmith_cache_total Completion and tool cache lookups by cache and result.",
+        "# TYPE blacksmith_cache_total counter",
+        'blacksmith_cache_total{cache="exact",result="hit"} 2',
+        "# HELP blacksmith_phase_seconds Time spent in each phase of a request or tool call.",
+        "# TYPE blacksmith_phase_seconds histogram",
+        'blacksmith_phase_seconds_bucket{model="gpt-\\"4\\"",phase="send",le="0.1"} 0',
+        'blacksmith_phase_seconds_bucket{model="gpt-\\"4\\"",phase="send",le="1"} 1',
+        'blacksmith_phase_seconds_bucket{model="gpt-\\"4\\"",phase="send",le="+Inf"} 1',
+        'blacksmith_phase_seconds_sum{model="gpt-\\"4\\"",phase="send"} 0.5',
+        'blacksmith_phase_seconds_count{model="gpt-\\"4\\"",phase="send"} 1',
+    ]
+
+
+def test_histogram_quantiles_are_bucket_bounds():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value)
+
+    assert (histogram.quantile(0.25), histogram.quantile(0.75), histogram.quantile(1)) == (
+        0.1,
+        1,
+        float("inf"),
+    )
@@ -0,0 +1,193 @@
+import time
+import threading
+import pytest
+from blacksmith.llm import AsyncConversation, Conversation
+from blacksmith.ratelimit import (
+    FileBackend,
+    MemoryBackend,
+    RateLimit,
+    RateLimitBackend,
+    RateLimiter,
+    _refund,
+    _take,
+)
+
+
+def test_a_new_bucket_starts_full():
+    limit = RateLimit(rpm=600, tpm=10_000)
+
+    assert limit.capacity() == (60, 1000)
+    bucket, wait = _take(None, limit, 1, 100, now=0)
+    assert (bucket, wait) == ((59, 900, 0), 0)
+
+
+def test_an_empty_bucket_reports_the_time_until_it_refills():
+    limit = RateLimit(rpm=600, tpm=10_000)
+
+    bucket, wait = _take((0, 1000, 0), limit, 1, 100, now=0)
+    # 600 RPM refills one request every 0.1s, and nothing is taken
+    assert (bucket, wait) == ((0, 1000, 0), pytest.approx(0.1))
+
+    bucket, wait = _take(bucket, limit, 1, 100, now=0.1)
+    assert wait == 0
+    assert bucket == (pytest.approx(0), 900, 0.1)
+
+
+def test_token_budgets_refill_continuously_up_to_capacity():
+    limit = RateLimit(tpm=6_000)
+
+    bucket, _ = _take((0, 0, 0), limit, 1, 0, now=1)
+    assert bucket[1] == 100
+    bucket, _ = _take((0, 0, 0), limit, 1, 0, now=3600)
+    assert bucket[1] == 600
+
+
+def test_requests_larger_than_the_bucket_go_through_once_it_is_full():
+    limit = RateLimit(tpm=6_000)
+
+    bucket, wait = _take(None, limit, 1, 5_000, now=0)
+    assert wait == 0
+    assert bucket[1] == -4_400
+
+    # The debt is repaid before the next request
+    _, wait = _take(bucket, limit, 1, 10, now=0)
+    assert wait == pytest.approx(44.1)
+
+
+def test_refunds_are_capped_at_capacity():
+    limit = RateLimit(tpm=6_000)
+
+    assert _refund((1, 500, 0), limit, 50) == (1, 550, 0)
+    assert _refund((1, 500, 0), limit, 500) == (1, 600, 0)
+    assert _refund((1, 500, 0), limit, -100) == (1, 400, 0)
+    assert _refund(None, limit, 50) is None
+
+
+def test_rate_limit_backends_are_abstract():
+    class Incomplete(RateLimitBackend):
+        def take(self, key, limit, requests, tokens):
+            return 0.0
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+@pytest.mark.parametrize("backend", ["memory", "file"])
+def test_backends_keep_one_bucket_per_key(backend, tmp_path):
+    backend = MemoryBackend() if backend == "memory" else FileBackend(str(tmp_path / "rl.json"))
+    limit = RateLimit(rpm=60, burst=1 / 60)
+
+    assert backend.take("a", limit, 1, 0) == 0
+    assert backend.take("a", limit, 1, 0) > 0
+    assert backend.take("b", limit, 1, 0) == 0
+
+
+def test_file_backends_share_buckets_through_the_file(tmp_path):
+    path = str(tmp_path / "rl.json")
+    limit = RateLimit(rpm=60, burst=1 / 60)
+
+    assert FileBackend(path).take("a", limit, 1, 0) == 0
+    assert FileBackend(path).take("a", limit, 1, 0) > 0
+
+
+def test_limiters_wait_for_budget():
+    limiter = RateLimiter(default=RateLimit(rpm=600, burst=1 / 600), completion_tokens=0)
+
+    start = time.perf_counter()
+    for _ in range(3):
+        limiter.acquire("gpt-3.5-turbo", "sk-test", 10)
+
+    assert time.perf_counter() - start == pytest.approx(0.2, abs=0.1)
+    assert limiter.stats.requests == 3
+    assert limiter.stats.waits == 2
+
+
+def test_limiters_keep_budgets_per_model_and_api_key():
+    limiter = RateLimiter(limits={"gpt-4": RateLimit(rpm=60, burst=1 / 60)})
+
+    limiter.acquire("gpt-4", "sk-a", 10)
+    limiter.acquire("gpt-4", "sk-b", 10)
+    limiter.acquire("gpt-3.5-turbo", "sk-a", 10)
+
+    assert limiter.stats.waits == 0
+
+
+def test_api_keys_can_have_their_own_budgets():
+    free, paid = RateLimit(rpm=600, burst=1 / 600), RateLimit(rpm=600)
+    limiter = RateLimiter(
+        limits={"gpt-4": paid, ("gpt-4", "sk-free"): free, (None, "sk-trial"): free},
+        completion_tokens=0,
+    )
+
+    assert limiter.limit_for("gpt-4", "sk-free") is free
+    assert limiter.limit_for("gpt-3.5-turbo", "sk-trial") is free
+    assert limiter.limit_for("gpt-4", "sk-paid") is paid
+    assert limiter.limit_for("gpt-3.5-turbo", "sk-paid") is None
+
+    for _ in range(3):
+        limiter.acquire("gpt-4", "sk-paid", 10)
+    assert limiter.stats.waits == 0
+
+    start = time.perf_counter()
+    limiter.acquire("gpt-4", "sk-free", 10)
+    limiter.acquire("gpt-4", "sk-free", 10)
+    # The free key gets one request every 0.1s
+    assert time.perf_counter() - start == pytest.approx(0.1, abs=0.05)
+    assert limiter.stats.waits == 1
+
+
+def test_reconcile_refunds_unused_tokens():
+    limiter = RateLimiter(default=RateLimit(tpm=60_000), completion_tokens=100)
+    key = limiter._key("gpt-4", None)
+
+    reserved = limiter.acquire("gpt-4", None, 50)
+    limiter.reconcile("gpt-4", None, reserved, {"total_tokens": 60})
+
+    assert reserved == 150
+    assert limiter.backend._buckets[key][1] == pytest.approx(6_000 - 60, abs=1)
+    assert limiter.stats.actual_tokens == 60
+
+
+class ThreadRecordingBackend(MemoryBackend):
+    def __init__(self) -> None:
+        super().__init__()
+        self.threads = set()
+
+    def take(self, key, limit, requests, tokens):
+        self.threads.add(threading.get_ident())
+        return super().take(key, limit, requests, tokens)
+
+    def refund(self, key, limit, tokens):
+        self.threads.add(threading.get_ident())
+        super().refund(key, limit, tokens)
+
+    # Use the default async versions, which run in a thread
+    atake = RateLimitBackend.atake
+    arefund = RateLimitBackend.arefund
+
+
+def test_async_limiters_keep_backend_io_off_the_event_loop(arun):
+    backend = ThreadRecordingBackend()
+    limiter = RateLimiter(default=RateLimit(rpm=600, tpm=60_000), backend=backend)
+
+    async def main():
+        reserved = await limiter.aacquire("gpt-4", None, 10)
+        await limiter.areconcile("gpt-4", None, reserved, {"total_tokens": 20})
+        return threading.get_ident()
+
+    loop_thread = arun(main())
+
+    assert backend.threads and loop_thread not in backend.threads
+    assert limiter.stats.actual_tokens == 20
+
+
+def test_conversations_reserve_and_reconcile_tokens(openai_api, config, arun):
+    limiter = RateLimiter(default=RateLimit(rpm=600, tpm=60_000))
+    config = config.model_copy(update={"rate_limit": limiter})
+
+    Conversation(config=config).ask("Hello", use_functions=False)
+    arun(AsyncConversation(config=config).ask("Hello", use_functions=False))
+
+    assert limiter.stats.requests == 2
+    # One prompt token plus 2 completion tokens each, as reported by the API
+    assert limiter.stats.actual_tokens == 6
@@ -0,0 +1,139 @@
+import time
+import socket
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import pytest
+from blacksmith.llm import AsyncConversation
+from blacksmith.registry import RemoteToolError, RemoteToolRegistry, create_app
+from blacksmith.tools import ToolRegistry, set_registry
+
+pytest.importorskip("fastapi")
+uvicorn = pytest.importorskip("uvicorn")
+
+
+@pytest.fixture(scope="module")
+def server():
+    """
+    Serves an `echo` tool on a free local port, counting the requests made to each endpoint.
+    """
+
+    def echo(text: str) -> str:
+        return text
+
+    served = ToolRegistry()
+    served.register_tool("echo", echo, "Echoes text", {"text": "The text"})
+    app = create_app(served)
+    requests: dict[str, int] = {}
+
+    @app.middleware("http")
+    async def count(request, call_next):
+        requests[request.url.path] = requests.get(request.url.path, 0) + 1
+        return await call_next(request)
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    server.requests = requests
+    server.url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+    yield server
+    server.should_exit = True
+    thread.join()
+    served.executor.shutdown()
+
+
+@pytest.fixture
+def remote(server):
+    server.requests.clear()
+    registry = RemoteToolRegistry(server.url, batch_window=0.5)
+    yield registry
+    registry.close()
+    registry.executor.shutdown()
+
+
+def test_calls_without_other_pending_calls_are_sent_right_away(remote):
+    remote.connect()
+
+    start = time.perf_counter()
+    assert remote.use_tool("echo", {"text": "hi"}) == "hi"
+    assert time.perf_counter() - start < 0.25
+
+
+def test_concurrent_calls_are_batched(remote, server):
+    remote.connect()
+    remote.batch_window = 0.05
+
+    # The first call is sent alone, and the calls made while it is pending are batched
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda i: remote.use_tool("echo", {"text": str(i)}), range(8)))
+
+    assert results == [str(i) for i in range(8)]
+    assert server.requests["/batch"] < 8
+
+
+def test_async_calls_without_other_pending_calls_are_sent_right_away(remote, server, arun):
+    async def main():
+        start = time.perf_counter()
+        one = await remote.ause_tool("echo", {"text": "hi"})
+        many = await asyncio.gather(*(remote.ause_tool("echo", {"text": str(i)}) for i in range(5)))
+        return one, many, time.perf_counter() - start
+
+    one, many, seconds = arun(main())
+
+    assert (one, many) == ("hi", ["0", "1", "2", "3", "4"])
+    # Calls made in the same loop iteration still share a request
+    assert server.requests["/batch"] == 2
+    assert seconds < 0.5
+
+
+def test_async_conversations_connect_without_blocking(remote, server, openai_api, config, arun):
+    def blocking_connect(refresh: bool = False):
+        raise AssertionError("connected from the event loop")
+
+    remote.connect = blocking_connect
+    set_registry(remote)
+
+    async def main():
+        conversations = [AsyncConversation(config=config) for _ in range(3)]
+        return await asyncio.gather(*(c.ask("Hello") for c in conversations))
+
+    arun(main())
+
+    assert [f["name"] for f in openai_api.calls[0]["functions"]] == ["echo"]
+    # Concurrent conversations share one connection attempt
+    assert server.requests["/tools"] == 1
+
+
+def test_calls_missing_from_a_short_response_fail(arun):
+    registry = RemoteToolRegistry("http://registry.invalid")
+    registry._connected = True
+    flushing = []
+
+    def post(calls: list[dict]) -> list[dict]:
+        return [{"result": call["args"]["text"]} for call in calls][:1]
+
+    async def apost(calls: list[dict]) -> list[dict]:
+        # The flush task is referenced while it runs
+        flushing.append(len(registry._aflushing))
+        return post(calls)
+
+    registry._post_batch, registry._apost_batch = post, apost
+    batch = [({"tool": "echo", "args": {"text": t}}, Future()) for t in "ab"]
+    registry._flush(batch)
+
+    assert batch[0][1].result() == {"result": "a"}
+    with pytest.raises(RemoteToolError, match="1 results for 2 calls"):
+        batch[1][1].result()
+
+    async def main():
+        calls = (registry.ause_tool("echo", {"text": t}) for t in "ab")
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    first, second = arun(main())
+    assert (first, type(second)) == ("a", RemoteToolError)
+    assert flushing == [1]
+    assert registry._aflushing == set()
@@ -0,0 +1,136 @@
+import time
+import asyncio
+import threading
+import openai
+import pytest
+from blacksmith.exceptions import CompletionError, DeadlineExceededError, RetriesExhaustedError
+from blacksmith.retry import RetryPolicy, retry_after
+
+
+def failing(*errors: Exception, result: str = "ok"):
+    """
+    Returns a `create` that raises `errors` in order, then returns `result`, recording the time of each call.
+    """
+    calls = []
+
+    def create(timeout):
+        calls.append(time.perf_counter())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    create.calls = calls
+    return create
+
+
+def gaps(calls: list[float]) -> list[float]:
+    return [b - a for a, b in zip(calls, calls[1:])]
+
+
+def test_retries_back_off_exponentially():
+    create = failing(openai.error.RateLimitError("slow down"), openai.error.TryAgain("again"))
+    policy = RetryPolicy(initial_backoff=0.02, jitter=False)
+
+    assert policy.call(create) == "ok"
+    first, second = gaps(create.calls)
+    assert 0.02 <= first < 0.04
+    assert 0.04 <= second < 0.08
+
+
+def test_retries_wait_as_long_as_the_server_asks():
+    assert retry_after(openai.error.RateLimitError(headers={"retry-after-ms": "150"})) == 0.15
+    assert retry_after(openai.error.RateLimitError(headers={"retry-after": "soon"})) is None
+
+    create = failing(openai.error.RateLimitError("slow down", headers={"retry-after": "0.1"}))
+    RetryPolicy(initial_backoff=0.001).call(create)
+
+    assert gaps(create.calls)[0] >= 0.1
+
+
+def test_requests_fail_once_the_deadline_passes():
+    timeouts = []
+
+    def create(timeout):
+        timeouts.append(timeout)
+        time.sleep(0.03)
+        raise openai.error.ServiceUnavailableError("down")
+
+    policy = RetryPolicy(max_attempts=100, initial_backoff=0.01, jitter=False, deadline=0.1)
+    start = time.perf_counter()
+    with pytest.raises(DeadlineExceededError) as e:
+        policy.call(create)
+
+    assert time.perf_counter() - start < 0.2
+    assert isinstance(e.value.last_error, openai.error.ServiceUnavailableError)
+    # Each attempt may only take what is left of the deadline
+    assert timeouts[0] <= 0.1 and timeouts[-1] < timeouts[0]
+
+
+def test_retries_are_exhausted_after_max_attempts(arun):
+    create = failing(*[openai.error.RateLimitError("slow down")] * 3)
+
+    with pytest.raises(RetriesExhaustedError) as e:
+        RetryPolicy(max_attempts=2, initial_backoff=0.001).call(create)
+    assert (e.value.attempts, len(create.calls)) == (2, 2)
+
+    async def invalid(timeout):
+        raise openai.error.InvalidRequestError("bad request", param=None)
+
+    # Other errors are not retried
+    with pytest.raises(CompletionError) as e:
+        arun(RetryPolicy(initial_backoff=0.001).acall(invalid))
+    assert type(e.value) is CompletionError and e.value.attempts == 1
+
+
+def test_synchronous_hedges_run_the_first_request_on_the_caller_thread():
+    threads = []
+
+    def create(timeout):
+        threads.append(threading.current_thread())
+        if len(threads) == 1:
+            time.sleep(0.1)
+            raise openai.error.InvalidRequestError("bad request", param=None)
+        return "duplicate"
+
+    policy = RetryPolicy(hedge=True, hedge_after=0.02)
+    assert policy.call(create) == "duplicate"
+
+    assert threads[0] is threading.current_thread()
+    assert threads[1].name.startswith("blacksmith-hedge")
+    # The latency observed is the duplicate's own, not counted from the first request
+    assert policy._latencies[-1] < 0.05
+
+    # Requests that finish before the threshold are not duplicated
+    fast = failing()
+    assert RetryPolicy(hedge=True, hedge_after=0.02).call(fast) == "ok"
+    time.sleep(0.05)
+    assert len(fast.calls) == 1
+
+
+def test_async_hedges_use_whichever_request_finishes_first(arun):
+    sent = []
+
+    async def create(timeout):
+        sent.append(time.perf_counter())
+        if len(sent) == 1:
+            await asyncio.sleep(0.3)
+            return "first"
+        return "duplicate"
+
+    policy = RetryPolicy(hedge=True, hedge_after=0.05)
+    start = time.perf_counter()
+
+    assert arun(policy.acall(create)) == "duplicate"
+    assert time.perf_counter() - start < 0.2
+    assert policy._latencies[-1] < 0.04
+
+
+def test_hedge_thresholds_follow_observed_latencies():
+    policy = RetryPolicy(hedge=True, hedge_quantile=0.9, hedge_min_samples=10)
+    for i in range(9):
+        policy.observe(i / 10)
+    assert policy.hedge_threshold() is None
+
+    policy.observe(0.9)
+    assert policy.hedge_threshold() == 0.9
+    assert RetryPolicy(hedge=False, hedge_after=1).hedge_threshold() is None
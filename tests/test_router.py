@@ -0,0 +1,136 @@
+import openai
+import pytest
+from blacksmith.llm import AsyncConversation, Conversation
+from blacksmith.ratelimit import RateLimit
+from blacksmith.retry import RetryPolicy
+from blacksmith.router import Endpoint, Router
+
+
+def stats(router: Router) -> dict:
+    return {s.name: s for s in router.stats()}
+
+
+def test_endpoints_fall_back_to_the_config_api_key():
+    assert Endpoint(api_base="http://local").credentials("sk-test") == {
+        "api_key": "sk-test",
+        "api_base": "http://local",
+    }
+    assert Endpoint(api_key="sk-a").credentials("sk-test") == {"api_key": "sk-a"}
+    assert Endpoint().credentials() == {}
+
+
+def test_requests_fail_over_to_the_next_endpoint():
+    router = Router([Endpoint(name="a"), Endpoint(name="b")])
+    sent = []
+
+    def create(endpoint: Endpoint) -> str:
+        sent.append(endpoint.name)
+        if endpoint.name == "a":
+            raise openai.error.RateLimitError("slow down")
+        return "ok"
+
+    assert router.call(create) == "ok"
+    assert sent == ["a", "b"]
+    assert (stats(router)["a"].errors, stats(router)["b"].errors) == (1, 0)
+    assert stats(router)["b"].latency is not None
+    # The endpoint that failed is now tried last
+    sent.clear()
+    router.call(create)
+    assert sent == ["b"]
+
+
+def test_other_errors_are_raised_without_failing_over():
+    router = Router([Endpoint(name="a"), Endpoint(name="b")])
+    sent = []
+
+    def create(endpoint: Endpoint):
+        sent.append(endpoint.name)
+        raise openai.error.InvalidRequestError("bad request", param=None)
+
+    with pytest.raises(openai.error.InvalidRequestError):
+        router.call(create)
+    assert sent == ["a"]
+    assert all(s.errors == 0 and s.inflight == 0 for s in router.stats())
+
+
+def test_the_last_error_is_raised_once_every_endpoint_failed(arun):
+    router = Router([Endpoint(name="a"), Endpoint(name="b")])
+
+    async def create(endpoint: Endpoint):
+        raise openai.error.APIError(f"{endpoint.name} is down", http_status=503)
+
+    with pytest.raises(openai.error.APIError, match="b is down"):
+        arun(router.acall(create))
+    assert [s.errors for s in router.stats()] == [1, 1]
+
+
+def test_conversations_send_each_attempt_to_another_endpoint(openai_api, config):
+    router = Router([Endpoint(name="a", api_key="sk-a"), Endpoint(name="b")])
+    openai_api.errors = [openai.error.RateLimitError("slow down")]
+    config = config.model_copy(update={"router": router, "retry": RetryPolicy(max_attempts=1)})
+
+    assert Conversation(config=config).ask("Hello", use_functions=False).content == "echo: Hello"
+    assert [call["api_key"] for call in openai_api.calls] == ["sk-a", "sk-test"]
+
+
+def test_requests_are_only_estimated_for_rate_limited_endpoints(openai_api, config, monkeypatch):
+    estimates = []
+    estimate = Conversation._estimate_tokens
+    monkeypatch.setattr(
+        Conversation,
+        "_estimate_tokens",
+        lambda self, *args: estimates.append(1) or estimate(self, *args),
+    )
+
+    config = config.model_copy(update={"router": Router([Endpoint()])})
+    Conversation(config=config).ask("Hello", use_functions=False)
+    assert estimates == []
+
+    router = Router([Endpoint(rate_limit=RateLimit(rpm=600))])
+    config = config.model_copy(update={"router": router})
+    Conversation(config=config).ask("Hello", use_functions=False)
+    assert estimates == [1]
+
+
+def test_streams_hold_their_endpoint_until_exhausted(openai_api, config):
+    router = Router([Endpoint(name="a", max_concurrency=1)])
+    config = config.model_copy(update={"router": router})
+
+    stream = Conversation(config=config).ask("one two three", stream=True, use_functions=False)
+    assert stats(router)["a"].inflight == 1
+
+    list(stream)
+    assert stream.response.content.strip() == "echo: one two three"
+    assert stats(router)["a"].inflight == 0
+    assert stats(router)["a"].latency is not None
+
+
+def test_closed_streams_release_their_endpoint(openai_api):
+    router = Router([Endpoint(name="a", max_concurrency=1)])
+    messages = [{"role": "user", "content": "one two three"}]
+
+    def create(endpoint: Endpoint):
+        return openai.ChatCompletion.create(messages=messages, stream=True)
+
+    stream = router.call(create, stream=True)
+    next(stream)
+    stream.close()
+    assert stats(router)["a"].inflight == 0
+
+    router.call(create, stream=True)
+    # Dropped streams release their endpoint when they are collected
+    assert stats(router)["a"].inflight == 0
+
+
+def test_async_streams_hold_their_endpoint_until_exhausted(openai_api, config, arun):
+    router = Router([Endpoint(name="a", max_concurrency=1)])
+    config = config.model_copy(update={"router": router})
+
+    async def main():
+        stream = await AsyncConversation(config=config).ask("Hi", stream=True, use_functions=False)
+        inflight = stats(router)["a"].inflight
+        [delta async for delta in stream]
+        return inflight, stream.response.content.strip()
+
+    assert arun(main()) == (1, "echo: Hi")
+    assert stats(router)["a"].inflight == 0
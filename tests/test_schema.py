@@ -0,0 +1,36 @@
+from blacksmith.llm import Choice, Schema, _choice_schema, _schema_cache
+
+
+class City(Schema):
+    name: str
+    population: int = 0
+
+
+def test_schemas_are_built_once_per_class(monkeypatch):
+    first = City.schema
+    monkeypatch.setattr(City, "model_json_schema", classmethod(lambda cls: 1 / 0))
+
+    assert City in _schema_cache
+    assert City.schema == first
+    assert first["parameters"]["required"] == ["name"]
+
+
+def test_callers_can_modify_their_schema():
+    City.schema["parameters"]["properties"].clear()
+    Choice(options=["a", "b"]).schema()["parameters"]["properties"]["choice"]["enum"].append("c")
+
+    assert set(City.schema["parameters"]["properties"]) == {"name", "population"}
+    assert Choice(options=["a", "b"]).schema()["parameters"]["properties"]["choice"]["enum"] == [
+        "a",
+        "b",
+    ]
+
+
+def test_choice_schemas_are_memoized_by_options():
+    _choice_schema.cache_clear()
+    Choice(options=[1, 2]).schema()
+    Choice(options=[1, 2]).schema()
+    strings = Choice(options=["1", "2"]).schema()
+
+    assert _choice_schema.cache_info().hits == 1
+    assert strings["parameters"]["properties"]["choice"]["type"] == "string"
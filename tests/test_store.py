@@ -0,0 +1,142 @@
+import os
+import uuid
+import pytest
+from blacksmith.history import ContextWindow
+from blacksmith.llm import Conversation
+from blacksmith.store import ConversationStore, JSONLStore, RedisStore, SQLiteStore
+
+
+@pytest.fixture(params=["sqlite", "jsonl", "redis"])
+def store(request, tmp_path) -> ConversationStore:
+    if request.param == "sqlite":
+        return SQLiteStore(str(tmp_path / "conversations.db"))
+    if request.param == "jsonl":
+        return JSONLStore(str(tmp_path / "conversations"))
+
+    pytest.importorskip("redis")
+    store = RedisStore(
+        os.environ.get("REDIS_URL", "redis://localhost:6379/0"),
+        prefix=f"blacksmith:test:{uuid.uuid4().hex}:",
+    )
+    try:
+        store._client.ping()
+    except Exception:
+        pytest.skip("Redis is not available")
+    return store
+
+
+class RecordingStore(ConversationStore):
+    """
+    Wraps a store, recording the calls made to it.
+    """
+
+    def __init__(self, store: ConversationStore) -> None:
+        self.store = store
+        self.calls: list[tuple[str, int]] = []
+
+    def append(self, conversation_id, records):
+        self.calls.append(("append", len(records)))
+        self.store.append(conversation_id, records)
+
+    def replace(self, conversation_id, records):
+        self.calls.append(("replace", len(records)))
+        self.store.replace(conversation_id, records)
+
+    def load_many(self, conversation_ids):
+        return self.store.load_many(conversation_ids)
+
+    def delete(self, conversation_id):
+        self.store.delete(conversation_id)
+
+
+def test_conversation_stores_are_abstract():
+    class Incomplete(ConversationStore):
+        def append(self, conversation_id, records):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_records_round_trip(store):
+    store.append("a", [{"role": "user", "content": "1"}])
+    store.append("a", [{"role": "assistant", "content": "2"}, {"role": "user", "content": "3"}])
+    store.append("b", [{"role": "user", "content": "x", "observation": True}])
+
+    assert store.load_many(["a", "b", "missing"]) == {
+        "a": [
+            {"role": "user", "content": "1"},
+            {"role": "assistant", "content": "2"},
+            {"role": "user", "content": "3"},
+        ],
+        "b": [{"role": "user", "content": "x", "observation": True}],
+    }
+    assert store.load("missing") is None
+
+
+def test_replace_and_delete(store):
+    store.append("a", [{"role": "user", "content": "1"}])
+    store.replace("a", [{"role": "user", "content": "2"}])
+    assert store.load("a") == [{"role": "user", "content": "2"}]
+
+    store.delete("a")
+    assert store.load("a") is None
+
+
+def test_conversations_round_trip(openai_api, config, store):
+    c = Conversation(system_prompt="Be brief.", config=config)
+    c.ask("Hello", use_functions=False)
+    conversation_id = c.save(store)
+
+    loaded = Conversation.load(conversation_id, store, config=config)
+
+    assert [(m.role, m.content) for m in loaded.messages] == [
+        (m.role, m.content) for m in c.messages
+    ]
+    loaded.ask("Again", use_functions=False)
+    loaded.save(store)
+    assert len(store.load(conversation_id)) == 5
+
+
+def test_saves_only_append_new_messages(openai_api, config, tmp_path):
+    store = RecordingStore(SQLiteStore(str(tmp_path / "conversations.db")))
+    c = Conversation(config=config)
+    c.ask("one", use_functions=False)
+    c.save(store)
+    c.save(store)
+    c.ask("two", use_functions=False)
+    c.save(store)
+
+    assert store.calls == [("append", 2), ("append", 2)]
+
+
+def test_windowed_conversations_save_the_full_history(openai_api, config, tmp_path):
+    store = RecordingStore(JSONLStore(str(tmp_path / "conversations")))
+    c = Conversation(config=config, window=ContextWindow(max_tokens=15))
+    for prompt in ("one two", "three four", "five six"):
+        c.ask(prompt, use_functions=False)
+        c.save(store)
+
+    # Messages left out of the requests stay in the history and the store, which is only appended to
+    assert len(openai_api.calls[-1]["messages"]) == 2
+    assert len(c.messages) == 6
+    assert len(store.load(c.id)) == 6
+    assert store.calls == [("append", 2)] * 3
+
+
+def test_cleared_conversations_are_replaced(openai_api, config, tmp_path):
+    store = RecordingStore(SQLiteStore(str(tmp_path / "conversations.db")))
+    c = Conversation(config=config)
+    c.ask("one", use_functions=False)
+    c.save(store)
+    c.clear()
+    c.ask("two", use_functions=False)
+    c.save(store)
+
+    assert store.calls == [("append", 2), ("replace", 2)]
+    assert [r["content"] for r in store.load(c.id)] == ["two", "echo: two"]
+
+
+def test_load_unknown_conversation_raises(tmp_path):
+    with pytest.raises(KeyError):
+        Conversation.load("missing", SQLiteStore(str(tmp_path / "conversations.db")))
@@ -0,0 +1,59 @@
+from blacksmith.cache import MemoryCache
+from blacksmith.config.constants import ChatRoles
+from blacksmith.llm import AsyncConversation, Conversation
+
+
+def test_streams_add_the_reply_once_exhausted(openai_api, config):
+    seen = []
+    c = Conversation(config=config.model_copy(update={"on_completion": [seen.append]}))
+
+    stream = c.ask("one two", stream=True, use_functions=False)
+    assert [m.role for m in c.messages] == [ChatRoles.USER]
+    deltas = list(stream)
+
+    assert deltas == ["echo: ", "one ", "two "]
+    assert stream.response.content == "echo: one two "
+    assert [m.role for m in c.messages] == [ChatRoles.USER, ChatRoles.ASSISTANT]
+    assert stream.time_to_first_token is not None
+    assert openai_api.calls[0]["stream"] is True
+    # Hooks are called once, and the time to first token stays on the stream
+    assert len(seen) == 1
+    assert "time_to_first_token" not in seen[0]
+
+
+def test_async_streams_add_the_reply_once_exhausted(openai_api, config, arun):
+    seen = []
+
+    async def hook(completion):
+        seen.append(completion)
+
+    c = AsyncConversation(config=config.model_copy(update={"on_completion": [hook]}))
+
+    async def main():
+        stream = await c.ask("one two", stream=True, use_functions=False)
+        before = len(c.messages)
+        return stream, before, [delta async for delta in stream]
+
+    stream, before, deltas = arun(main())
+
+    assert (before, len(c.messages)) == (1, 2)
+    assert "".join(deltas) == stream.response.content == "echo: one two "
+    assert stream.time_to_first_token is not None
+    assert len(seen) == 1
+
+
+def test_cached_streams_do_not_carry_an_old_time_to_first_token(openai_api, config):
+    seen = []
+    config = config.model_copy(update={"cache": MemoryCache(), "on_completion": [seen.append]})
+
+    first = Conversation(config=config).ask("Hello", stream=True, use_functions=False)
+    list(first)
+    second = Conversation(config=config).ask("Hello", stream=True, use_functions=False)
+    list(second)
+
+    assert len(openai_api.calls) == 1
+    assert second.response.content == first.response.content
+    (cached,) = [v for _, v in config.cache._entries.values()]
+    assert "time_to_first_token" not in cached
+    # Replayed streams are not reported to hooks again
+    assert len(seen) == 1
@@ -0,0 +1,44 @@
+import os
+import sys
+import subprocess
+import tiktoken
+from blacksmith.utils.tokenizer import DEFAULT_ENCODING, get_encoder, warm_tokenizers
+from tests.conftest import FakeEncoding
+
+
+def test_importing_blacksmith_does_not_import_the_api_client_or_tokenizer():
+    code = (
+        "import sys, blacksmith.llm, blacksmith.agent, blacksmith.context; "
+        "print(sorted(m for m in ('openai', 'tiktoken') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
+
+
+def test_warming_loads_each_encoder_once(monkeypatch, tmp_path):
+    loaded = []
+
+    def encoding_for_model(model: str) -> FakeEncoding:
+        loaded.append(model)
+        if model == "unknown":
+            raise KeyError(model)
+        return FakeEncoding()
+
+    def get_encoding(name: str) -> FakeEncoding:
+        loaded.append(name)
+        return FakeEncoding()
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", encoding_for_model)
+    monkeypatch.setattr(tiktoken, "get_encoding", get_encoding)
+    monkeypatch.delenv("TIKTOKEN_CACHE_DIR", raising=False)
+
+    warm_tokenizers(["gpt-4", "gpt-4", None, "unknown"], cache_dir=str(tmp_path))
+
+    assert os.environ["TIKTOKEN_CACHE_DIR"] == str(tmp_path)
+    # Unknown models fall back to the default encoding
+    assert loaded == ["gpt-4", DEFAULT_ENCODING, "unknown", DEFAULT_ENCODING]
+    get_encoder("gpt-4")
+    get_encoder("unknown")
+    assert len(loaded) == 4
@@ -0,0 +1,210 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from blacksmith.llm import FunctionCall, execute_all
+from blacksmith.tools import ToolCache, ToolRegistry, get_tools, tool, tool_cache_stats
+
+
+def square(x: int) -> int:
+    # Module level, so that the process pool can pickle it
+    return x * x
+
+
+def test_the_tool_list_is_rebuilt_after_a_registration(registry):
+    @tool(name="first", description="The first tool", params={"x": "A value"})
+    def first(x: str):
+        return x
+
+    tools = get_tools()
+    assert get_tools() is tools
+
+    @tool(name="second", description="The second tool", params={"x": "A value"})
+    def second(x: str):
+        return x
+
+    assert [t["name"] for t in tools] == ["first"]
+    assert [t["name"] for t in get_tools()] == ["first", "second"]
+
+
+def test_slow_tools_time_out(registry):
+    @tool(name="slow", description="A slow tool", params={"x": "A value"}, timeout=0.05)
+    def slow(x: str):
+        time.sleep(0.5)
+        return x
+
+    result = FunctionCall(tool="slow", args={"x": "a"}).execute()
+
+    assert (result.ok(), result.error.type, result.error.timed_out) == (
+        False,
+        "ToolTimeoutError",
+        True,
+    )
+    assert "slow timed out after 0.05s" in result.generate_observation().content
+
+
+def test_async_timeouts_match_sync_timeouts(registry, arun):
+    @tool(name="slow", description="A slow tool", params={"x": "A value"}, timeout=0.05)
+    async def slow(x: str):
+        await asyncio.sleep(0.5)
+        return x
+
+    assert FunctionCall(tool="slow", args={"x": "a"}).execute().error.timed_out
+    assert arun(FunctionCall(tool="slow", args={"x": "a"}).aexecute()).error.timed_out
+
+
+def test_tools_are_dispatched_by_kind(registry, arun):
+    @tool(name="where", description="Where the tool runs", params={"x": "A value"})
+    async def where(x: str):
+        return threading.current_thread().name
+
+    tool(name="square", description="Squares a number", params={"x": "A number"}, kind="cpu")(
+        square
+    )
+
+    assert registry.specs["where"].kind == "async"
+    # Synchronous callers run async tools on the tool loop, and async callers on their own loop
+    assert registry.use_tool("where", {"x": "a"}) == "blacksmith-tool-loop"
+    assert arun(registry.ause_tool("where", {"x": "a"})) == threading.current_thread().name
+    assert registry.use_tool("square", {"x": 3}) == 9
+    assert arun(registry.ause_tool("square", {"x": 4})) == 16
+
+
+def test_execute_all_runs_calls_concurrently_in_order(registry):
+    @tool(name="wait", description="Waits", params={"seconds": "How long to wait"})
+    def wait(seconds: int):
+        time.sleep(seconds / 10)
+        return seconds
+
+    start = time.perf_counter()
+    results = execute_all([FunctionCall(tool="wait", args={"seconds": s}) for s in (2, 1, 2)])
+
+    assert [r.result for r in results] == [2, 1, 2]
+    assert time.perf_counter() - start < 0.4
+
+
+def test_failed_calls_are_observed_as_errors(registry):
+    @tool(name="fail", description="Always fails", params={"x": "A value"})
+    def fail(x: str):
+        raise ValueError(f"bad {x}")
+
+    result = FunctionCall(tool="fail", args={"x": "a"}).execute()
+
+    assert (result.error.type, result.error.message, result.error.timed_out) == (
+        "ValueError",
+        "bad a",
+        False,
+    )
+    assert result.generate_observation().content == (
+        "Observation: calling fail with {'x': 'a'} failed with 'ValueError: bad a'"
+    )
+
+
+def test_execute_all_refuses_to_block_the_tool_loop(registry):
+    @tool(name="inner", description="The inner tool", params={"x": "A value"})
+    def inner(x: str):
+        return x
+
+    # The timeout keeps a deadlock from hanging the test
+    @tool(name="outer", description="The outer tool", params={"x": "A value"}, timeout=2)
+    async def outer(x: str):
+        return execute_all([FunctionCall(tool="inner", args={"x": x})])
+
+    result = FunctionCall(tool="outer", args={"x": "a"}).execute()
+
+    assert (result.error.type, result.error.timed_out) == ("RuntimeError", False)
+    # The tool loop is still usable
+    assert execute_all([FunctionCall(tool="inner", args={"x": "b"})])[0].result == "b"
+
+
+def test_cached_results_expire_after_their_ttl(registry):
+    calls = []
+
+    @tool(
+        name="now", description="Counts calls", params={"x": "A value"}, cache=ToolCache(ttl=0.05)
+    )
+    def now(x: str):
+        calls.append(x)
+        return len(calls)
+
+    assert [registry.use_tool("now", {"x": "a"}) for _ in range(2)] == [1, 1]
+    time.sleep(0.1)
+    assert registry.use_tool("now", {"x": "a"}) == 2
+
+
+def test_cache_keys_select_the_arguments_that_matter(registry):
+    calls = []
+
+    @tool(
+        name="search",
+        description="Searches",
+        params={"query": "The query", "verbose": "Whether to explain"},
+        cache=ToolCache(key=lambda args: args["query"].lower()),
+    )
+    def search(query: str, verbose: int):
+        calls.append(query)
+        return query.lower()
+
+    registry.use_tool("search", {"query": "Cats", "verbose": 0})
+    registry.use_tool("search", {"query": "cats", "verbose": 1})
+    registry.use_tool("search", {"query": "dogs", "verbose": 0})
+
+    assert calls == ["Cats", "dogs"]
+
+
+def test_concurrent_identical_calls_share_one_execution(registry, arun):
+    calls = []
+
+    @tool(name="slow", description="A slow tool", params={"x": "A value"}, cache=True)
+    def slow(x: str):
+        calls.append(x)
+        time.sleep(0.1)
+        return x
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: registry.use_tool("slow", {"x": "a"}), range(4)))
+
+    async def main():
+        return await asyncio.gather(*(registry.ause_tool("slow", {"x": "b"}) for _ in range(4)))
+
+    assert (results, arun(main())) == (["a"] * 4, ["b"] * 4)
+    assert calls == ["a", "b"]
+    assert registry.cache_stats()["slow"].coalesced == 6
+
+
+def test_cache_stats_are_kept_per_tool(registry):
+    @tool(name="cached", description="A cached tool", params={"x": "A value"}, cache=True)
+    def cached(x: str):
+        return x
+
+    @tool(name="uncached", description="An uncached tool", params={"x": "A value"})
+    def uncached(x: str):
+        return x
+
+    for x in ("a", "a", "b"):
+        registry.use_tool("cached", {"x": x})
+        registry.use_tool("uncached", {"x": x})
+
+    stats = tool_cache_stats()
+    assert list(stats) == ["cached"]
+    assert (stats["cached"].hits, stats["cached"].misses) == (1, 2)
+
+    registry.clear_cache("cached")
+    registry.use_tool("cached", {"x": "a"})
+    assert stats["cached"].misses == 3
+
+
+def test_sqlite_caches_persist_across_registries(tmp_path):
+    calls = []
+
+    def lookup(x: str):
+        calls.append(x)
+        return {"x": x}
+
+    cache = ToolCache(path=str(tmp_path / "tools.db"))
+    registries = [ToolRegistry(), ToolRegistry()]
+    for registry in registries:
+        registry.register_tool("lookup", lookup, "Looks up a value", {"x": "A value"}, cache=cache)
+
+    assert [r.use_tool("lookup", {"x": "a"}) for r in registries] == [{"x": "a"}] * 2
+    assert calls == ["a"]